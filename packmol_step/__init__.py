@@ -8,9 +8,97 @@ A step for building fluid boxes using Packmol
 # Bring up the classes so that they appear to be directly in
 # the packmol_step package.
 
+from packmol_step.artifacts import (  # noqa: F401
+    archive,
+    copy_back,
+    find_artifact,
+    load_coordinates,
+    open_artifact,
+    read_artifact,
+    remove_artifacts,
+    save_coordinates,
+)
+from packmol_step.canonical import canonical_definition  # noqa: F401
+from packmol_step.coarse import (  # noqa: F401
+    coarse_radius,
+    pseudo_atom_pdb,
+    pseudo_atom_xyz,
+    randomize_orientations,
+)
+from packmol_step.composition_series import (  # noqa: F401
+    composition_numbers,
+    parse_compositions,
+    principal_axes,
+    radius_of_gyration,
+    superpose,
+    swaps,
+)
+from packmol_step.density_series import (  # noqa: F401
+    clashing_molecules,
+    compress,
+    molecule_index,
+    parse_densities,
+)
+from packmol_step.exclusion import exclusion_spheres, with_solute  # noqa: F401
+from packmol_step.formats import (  # noqa: F401
+    atom_lines,
+    choose_filetype,
+    parse_atoms,
+    placed_text,
+    template_text,
+    xyz_text,
+)
+from packmol_step.history import BuildHistory  # noqa: F401
+from packmol_step.ingest import (  # noqa: F401
+    append_atoms,
+    atom_data,
+    ingest_pdb,
+    molecule_columns,
+    next_molecule,
+    orthorhombic_cell,
+    pdb_atoms,
+    register_templates,
+)
+from packmol_step.layers import layer_offsets, parse_layers, parse_lengths  # noqa: F401
+from packmol_step.limiter import ProcessLimiter  # noqa: F401
+from packmol_step.metadata import metadata  # noqa: F401
 from packmol_step.packmol import Packmol  # noqa: F401
+from packmol_step.packmol_output import (  # noqa: F401
+    accepted_loop,
+    Monitor,
+    packmol_processes,
+    parse_output,
+    PeakMemory,
+)
 from packmol_step.packmol_parameters import PackmolParameters  # noqa: F401
 from packmol_step.packmol_step import PackmolStep  # noqa: F401
+from packmol_step.regions import (  # noqa: F401
+    parse_regions,
+    parse_sizes,
+    place_regions,
+    region_shapes,
+)
+from packmol_step.solvent_library import (  # noqa: F401
+    close_atoms,
+    find_solvent_box,
+    match_atoms,
+    save_solvent_box,
+    solvated_pdb,
+    tile_solvent,
+)
+from packmol_step.templates import (  # noqa: F401
+    cached_template_path,
+    compact_conformer,
+    compactness,
+    configuration_from_template,
+    embed,
+    embedding_backends,
+    find_cached_template,
+    prepare_templates,
+    save_cached_template,
+    smiles_template,
+    template_arrays,
+)
 from packmol_step.tk_packmol import TkPackmol  # noqa: F401
 
 # Handle versioneer
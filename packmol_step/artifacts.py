@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+"""Handling of the files that Packmol reads and writes in the step directory."""
+
+import gzip
+import logging
+from pathlib import Path
+import shutil
+import time
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# The files that a Packmol step leaves in its directory
+artifacts = (
+    "input.inp",
+    "input_*.pdb",
+    "input_*.xyz",
+    "input_*.restart",
+    "coarse*",
+    "packmol.out",
+    "packmol.pdb",
+    "packmol.xyz",
+    "solute.*",
+)
+
+# The suffixes of the compressed files
+suffixes = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def copy_back(source, destination, patterns, compress="no"):
+    """Copy the chosen files from a scratch directory to the step directory.
+
+    Parameters
+    ----------
+    source : str or pathlib.Path
+        The scratch directory that Packmol ran in.
+    destination : str or pathlib.Path
+        The step directory to copy the files to.
+    patterns : [str]
+        Glob patterns for the files to copy back.
+    compress : str
+        "no" to copy the files as is, or "gzip" or "zstd" to compress them.
+
+    Returns
+    -------
+    dict(str, any)
+        The bytes in the scratch directory, the bytes copied back, and the time
+        taken to copy them.
+    """
+    source = Path(source)
+    destination = Path(destination)
+    destination.mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    total_bytes = sum(p.stat().st_size for p in source.rglob("*") if p.is_file())
+    copied_bytes = 0
+    copied = []
+    for pattern in patterns:
+        for path in sorted(source.glob(pattern)):
+            if not path.is_file() or path.name in copied:
+                continue
+            copied.append(path.name)
+            if compress in suffixes:
+                target = destination / (path.name + suffixes[compress])
+                with path.open("rb") as fin:
+                    with _open_compressed(target, compress, "wb") as fout:
+                        shutil.copyfileobj(fin, fout)
+            elif compress == "no":
+                target = destination / path.name
+                shutil.copyfile(path, target)
+            else:
+                raise ValueError(f"Do not recognize compression '{compress}'")
+            copied_bytes += target.stat().st_size
+    logger.debug(f"Copied {copied} from {source} to {destination}")
+
+    return {
+        "scratch bytes": total_bytes,
+        "bytes copied back": copied_bytes,
+        "bytes kept off the step directory": total_bytes - copied_bytes,
+        "copy back time": round(time.perf_counter() - t0, 3),
+    }
+
+
+def compress_file(path, method="gzip"):
+    """Compress a file, replacing the original.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The file to compress.
+    method : str
+        "gzip", or "zstd" if the zstandard package is installed.
+
+    Returns
+    -------
+    pathlib.Path
+        The path to the compressed file.
+    """
+    path = Path(path)
+    if method not in suffixes:
+        raise ValueError(f"Do not recognize compression '{method}'")
+    target = path.with_name(path.name + suffixes[method])
+    with path.open("rb") as fin, _open_compressed(target, method, "wb") as fout:
+        shutil.copyfileobj(fin, fout)
+    path.unlink()
+    return target
+
+
+def archive(directory, patterns=artifacts, method="gzip"):
+    """Compress the artifacts in a step directory.
+
+    Files that are already compressed are left as they are.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The step directory.
+    patterns : [str]
+        Glob patterns for the files to compress.
+    method : str
+        "gzip", or "zstd" if the zstandard package is installed.
+
+    Returns
+    -------
+    (int, int)
+        The number of bytes before and after compression.
+    """
+    directory = Path(directory)
+    before = 0
+    after = 0
+    for pattern in patterns:
+        for path in sorted(directory.glob(pattern)):
+            if path.is_file() and path.suffix not in suffixes.values():
+                before += path.stat().st_size
+                after += compress_file(path, method).stat().st_size
+    return before, after
+
+
+def remove_artifacts(directory, patterns=artifacts):
+    """Remove the artifacts from a step directory, compressed or not.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The step directory.
+    patterns : [str]
+        Glob patterns for the files to remove.
+
+    Returns
+    -------
+    int
+        The number of bytes removed.
+    """
+    directory = Path(directory)
+    removed = 0
+    for pattern in patterns:
+        for suffix in ("", *suffixes.values()):
+            for path in directory.glob(pattern + suffix):
+                if path.is_file():
+                    removed += path.stat().st_size
+                    path.unlink()
+    return removed
+
+
+def find_artifact(directory, name):
+    """Find an artifact in the step directory, whether or not it is compressed.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The step directory.
+    name : str
+        The name of the file without any compression suffix, e.g. "packmol.out".
+
+    Returns
+    -------
+    pathlib.Path or None
+        The path to the file, or None if it does not exist.
+    """
+    directory = Path(directory)
+    for suffix in ("", *suffixes.values()):
+        path = directory / (name + suffix)
+        if path.exists():
+            return path
+    return None
+
+
+def open_artifact(directory, name, mode="rt"):
+    """Open an artifact for reading, decompressing it transparently.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The step directory.
+    name : str
+        The name of the file without any compression suffix, e.g. "packmol.out".
+    mode : str
+        "rt" for text or "rb" for bytes.
+
+    Returns
+    -------
+    file object
+    """
+    path = find_artifact(directory, name)
+    if path is None:
+        raise FileNotFoundError(f"There is no '{name}' in {directory}")
+    for method, suffix in suffixes.items():
+        if path.name.endswith(suffix):
+            return _open_compressed(path, method, mode)
+    return path.open(mode)
+
+
+def read_artifact(directory, name):
+    """Read the text of an artifact, decompressing it transparently.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The step directory.
+    name : str
+        The name of the file without any compression suffix, e.g. "packmol.out".
+
+    Returns
+    -------
+    str
+        The contents of the file.
+    """
+    with open_artifact(directory, name) as fd:
+        return fd.read()
+
+
+def save_coordinates(path, xyz, symbols, cell=None):
+    """Save the coordinates of a build in a compact, compressed binary file.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The file to write, conventionally 'packmol.npz'.
+    xyz : [[float]]
+        The Cartesian coordinates in Å.
+    symbols : [str]
+        The element symbols of the atoms.
+    cell : (float, float, float)
+        The lengths of the orthorhombic cell, if periodic.
+    """
+    data = {
+        "xyz": np.asarray(xyz, dtype=np.float32),
+        "symbols": np.asarray(symbols, dtype="U3"),
+    }
+    if cell is not None:
+        data["cell"] = np.asarray(cell, dtype=np.float64)
+    with Path(path).open("wb") as fd:
+        np.savez_compressed(fd, **data)
+
+
+def load_coordinates(path):
+    """Read the coordinates written by save_coordinates.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The file to read.
+
+    Returns
+    -------
+    dict(str, numpy.ndarray)
+        The coordinates "xyz", the "symbols" and, if periodic, the "cell".
+    """
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _open_compressed(path, method, mode):
+    """Open a compressed file with the given method."""
+    if method == "gzip":
+        return gzip.open(path, mode)
+    if method == "zstd":
+        if zstandard is None:
+            raise RuntimeError(
+                "zstd compression needs the 'zstandard' package. Install it with "
+                "'conda install zstandard' or 'pip install zstandard'."
+            )
+        return zstandard.open(path, mode)
+    raise ValueError(f"Do not recognize compression '{method}'")
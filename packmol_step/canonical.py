@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""Canonical forms of the definitions of components, for finding duplicates.
+
+SMILES are put in RDKit's canonical form if RDKit is installed, so that e.g. "O"
+and "[OH2]" are recognized as the same molecule. Without RDKit only surrounding
+whitespace is removed.
+"""
+
+try:
+    from rdkit import Chem
+except ImportError:
+    Chem = None
+
+
+def canonical_definition(source, definition):
+    """A canonical form of the definition of a component, for finding duplicates.
+
+    Parameters
+    ----------
+    source : str
+        Where the molecule comes from, "SMILES" or "configuration".
+    definition : str
+        The SMILES string, or system/configuration name.
+
+    Returns
+    -------
+    str
+        The canonical SMILES if RDKit is available and understands the SMILES,
+        otherwise the definition with surrounding whitespace removed.
+    """
+    definition = definition.strip()
+    if source == "SMILES":
+        if Chem is not None:
+            mol = Chem.MolFromSmiles(definition)
+            if mol is not None:
+                return Chem.MolToSmiles(mol)
+    elif source == "configuration":
+        if definition == "":
+            return "current"
+    return definition
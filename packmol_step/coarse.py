@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""Coarse-grained, two-stage packing of large, flexible molecules.
+
+Packing long chains atom by atom is slow in Packmol. In the first stage each copy
+of a molecule is packed as a single pseudo-atom, which is very fast. In the second
+stage Packmol starts from the atomistic molecules placed at those centers with
+random orientations, and only has to polish away the remaining clashes.
+
+Packmol's restart files hold the center and three Euler angles of each molecule,
+so they carry the centers from the first stage to the second.
+"""
+
+import math
+import random
+
+# The pseudo-atom standing in for a molecule in the first stage
+pseudo_atom_pdb = (
+    "HETATM    1  X   CG      1       0.000   0.000   0.000  1.00  0.00           X\n"
+    "END\n"
+)
+pseudo_atom_xyz = "1\nA pseudo-atom\nX 0.0 0.0 0.0\n"
+
+# The fraction of a molecule's share of the volume used for its sphere, so that the
+# spheres pack loosely enough for Packmol to converge quickly.
+volume_fraction = 0.5
+
+
+def coarse_radius(bounding_radius, volume, tolerance=2.0):
+    """The radius of the pseudo-atom for a molecule.
+
+    The radius is that of the bounding sphere of the molecule, reduced if needed so
+    that the spheres fill no more than volume_fraction of the volume available to
+    each molecule, which matters for dense liquids of long chains.
+
+    Parameters
+    ----------
+    bounding_radius : float
+        The radius of the bounding sphere of the molecule, in Å.
+    volume : float
+        The volume per molecule at the requested density, in Å^3.
+    tolerance : float
+        The tolerance used by Packmol, which is also the smallest diameter.
+
+    Returns
+    -------
+    float
+        The radius in Å.
+    """
+    cap = (3 * volume_fraction * volume / (4 * math.pi)) ** (1 / 3)
+    return max(min(bounding_radius + tolerance / 2, cap), tolerance / 2)
+
+
+def randomize_orientations(text, rng=None):
+    """Give the molecules in a Packmol restart file random orientations.
+
+    Parameters
+    ----------
+    text : str
+        The restart file, with the center and three Euler angles of each molecule
+        on a line.
+    rng : random.Random
+        The random number generator, by default a new, randomly seeded one.
+
+    Returns
+    -------
+    str
+        The restart file with the same centers and new angles.
+    """
+    if rng is None:
+        rng = random.Random()
+    lines = []
+    for line in text.splitlines():
+        values = line.split()
+        if len(values) != 6:
+            lines.append(line)
+            continue
+        x, y, z = (float(value) for value in values[0:3])
+        # Uniform orientations: the Euler angle about the second axis follows the
+        # sine of the angle.
+        beta = rng.uniform(0.0, 2 * math.pi)
+        gamma = math.acos(rng.uniform(-1.0, 1.0))
+        theta = rng.uniform(0.0, 2 * math.pi)
+        lines.append(
+            f" {x:23.16e} {y:23.16e} {z:23.16e} {beta:23.16e} {gamma:23.16e} "
+            f"{theta:23.16e}"
+        )
+    lines.append("")
+    return "\n".join(lines)
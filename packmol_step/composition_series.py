@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""Making a series of compositions by swapping molecules in one packed box.
+
+The box is packed by Packmol once. The boxes with the other compositions are made
+by changing the identities of whole molecules, placing each new molecule on the
+center and principal axes of the one it replaces. Only the new molecules that then
+overlap their neighbors are repacked by Packmol, with the others fixed.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def parse_compositions(text):
+    """The compositions in a series, e.g. "1:3, 1:1, 3:1".
+
+    The compositions are separated by commas or semicolons, and the amounts of the
+    components in each by colons.
+
+    Parameters
+    ----------
+    text : str
+        The compositions.
+
+    Returns
+    -------
+    [[float]]
+        The amounts of the components in each composition, in the order given.
+    """
+    if text is None:
+        return []
+    result = []
+    try:
+        for composition in str(text).replace(";", ",").split(","):
+            if composition.strip() != "":
+                result.append([float(x) for x in composition.split(":")])
+    except ValueError:
+        raise RuntimeError(f"Cannot understand the composition series '{text}'.")
+    for composition in result:
+        if min(composition) < 0 or sum(composition) <= 0:
+            raise RuntimeError(f"The composition {composition} is not sensible.")
+    return result
+
+
+def composition_numbers(n_molecules, composition):
+    """The whole numbers of molecules closest to a composition.
+
+    Parameters
+    ----------
+    n_molecules : int
+        The total number of molecules.
+    composition : [float]
+        The relative amounts of the components.
+
+    Returns
+    -------
+    [int]
+        The number of molecules of each component, adding up to the total.
+    """
+    fractions = np.asarray(composition, dtype=float)
+    exact = n_molecules * fractions / fractions.sum()
+    numbers = np.floor(exact).astype(int)
+    # Give the remaining molecules to the largest remainders
+    extra = n_molecules - numbers.sum()
+    numbers[np.argsort(numbers - exact, kind="stable")[0:extra]] += 1
+    return numbers.tolist()
+
+
+def swaps(old, new, sizes):
+    """Which components give molecules to which, pairing the most similar sizes.
+
+    Parameters
+    ----------
+    old : [int]
+        The number of molecules of each component now.
+    new : [int]
+        The number wanted, with the same total.
+    sizes : [float]
+        The sizes of the molecules of the components, e.g. radii of gyration.
+
+    Returns
+    -------
+    [(int, int, int)]
+        The component giving molecules, the component receiving them, and the
+        number of molecules.
+    """
+    surplus = {i: o - n for i, (o, n) in enumerate(zip(old, new)) if o > n}
+    deficit = {i: n - o for i, (o, n) in enumerate(zip(old, new)) if n > o}
+    pairs = sorted(
+        ((abs(sizes[i] - sizes[j]), i, j) for i in surplus for j in deficit),
+    )
+    result = []
+    for _, i, j in pairs:
+        n = min(surplus[i], deficit[j])
+        if n > 0:
+            result.append((i, j, n))
+            surplus[i] -= n
+            deficit[j] -= n
+    return result
+
+
+def principal_axes(xyz):
+    """The centers and principal axes of molecules.
+
+    Parameters
+    ----------
+    xyz : numpy.ndarray
+        The coordinates of the atoms of the molecules, n_molecules x n_atoms x 3.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        The centers, n_molecules x 3, and the axes as the columns of right-handed
+        rotation matrices, n_molecules x 3 x 3, from the smallest spread to the
+        largest.
+    """
+    centers = xyz.mean(axis=1)
+    delta = xyz - centers[:, None, :]
+    _, axes = np.linalg.eigh(np.einsum("mai,maj->mij", delta, delta))
+    axes[:, :, 0] *= np.sign(np.linalg.det(axes))[:, None]
+    return centers, axes
+
+
+def superpose(template, placed):
+    """Place copies of a template on the centers and axes of placed molecules.
+
+    Parameters
+    ----------
+    template : array_like
+        The coordinates of the atoms of the template, n_atoms x 3.
+    placed : numpy.ndarray
+        The coordinates of the molecules being replaced, n_molecules x m x 3.
+
+    Returns
+    -------
+    numpy.ndarray
+        The coordinates of the copies, n_molecules x n_atoms x 3.
+    """
+    template = np.asarray(template, dtype=float)
+    t_center, t_axes = principal_axes(template[None, :, :])
+    centers, axes = principal_axes(placed)
+    # Rotate the template's axes onto those of each placed molecule
+    rotations = np.einsum("mij,kj->mik", axes, t_axes[0])
+    return (
+        np.einsum("mij,aj->mai", rotations, template - t_center[0])
+        + centers[:, None, :]
+    )
+
+
+def radius_of_gyration(xyz):
+    """The radius of gyration of a molecule, unweighted by mass."""
+    xyz = np.asarray(xyz, dtype=float)
+    return float(np.sqrt(((xyz - xyz.mean(axis=0)) ** 2).sum(axis=1).mean()))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""Making a series of densities by compressing one packed box of fluid.
+
+The box is packed by Packmol once, at the lowest density. The boxes at the higher
+densities are made by scaling the centers of mass of the molecules with the cell,
+keeping each molecule rigid, so they are cheap. Only the molecules that then
+overlap their neighbors are repacked by Packmol, with the others fixed.
+"""
+
+import logging
+
+import numpy as np
+
+from packmol_step.solvent_library import close_atoms
+
+logger = logging.getLogger(__name__)
+
+
+def parse_densities(text):
+    """The densities in a series, from a list separated by commas or spaces.
+
+    Parameters
+    ----------
+    text : str
+        The densities, e.g. "0.9, 1.0, 1.1".
+
+    Returns
+    -------
+    [float]
+        The densities, in the order given.
+    """
+    if text is None:
+        return []
+    try:
+        return [float(x) for x in str(text).replace(",", " ").split()]
+    except ValueError:
+        raise RuntimeError(f"Cannot understand the density series '{text}'.")
+
+
+def molecule_index(molecules):
+    """The index of the molecule of each atom, in the order Packmol wrote them.
+
+    Parameters
+    ----------
+    molecules : [dict]
+        The molecules, each with the "number" of copies and "n_atoms" in each.
+
+    Returns
+    -------
+    numpy.ndarray
+        The 0-based index of the molecule for each atom.
+    """
+    sizes = [
+        molecule["n_atoms"]
+        for molecule in molecules
+        for _ in range(max(0, molecule["number"]))
+    ]
+    return np.repeat(np.arange(len(sizes)), sizes)
+
+
+def compress(xyz, index, masses, factor):
+    """Scale the centers of mass of rigid molecules.
+
+    Parameters
+    ----------
+    xyz : array_like
+        The Cartesian coordinates of the atoms, n x 3, with the molecules whole.
+    index : numpy.ndarray
+        The index of the molecule of each atom, from molecule_index.
+    masses : array_like
+        The mass of each atom.
+    factor : float
+        The factor for the centers, the ratio of the new cell to the old.
+
+    Returns
+    -------
+    numpy.ndarray
+        The new Cartesian coordinates of the atoms.
+    """
+    xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+    masses = np.asarray(masses, dtype=float)
+    total = np.bincount(index, weights=masses)
+    centers = np.stack(
+        [np.bincount(index, weights=masses * xyz[:, i]) / total for i in range(3)],
+        axis=1,
+    )
+    return xyz + (factor - 1.0) * centers[index]
+
+
+def clashing_molecules(xyz, index, distance, cell):
+    """The molecules with an atom too close to an atom of another molecule.
+
+    Parameters
+    ----------
+    xyz : array_like
+        The Cartesian coordinates of the atoms, n x 3.
+    index : numpy.ndarray
+        The index of the molecule of each atom, from molecule_index.
+    distance : float
+        The smallest acceptable distance between molecules, in Å.
+    cell : (float, float, float)
+        The sides of the orthorhombic periodic cell.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array, True for each molecule that clashes.
+    """
+    close = close_atoms(xyz, xyz, distance, box=cell, labels=(index, index))
+    return np.bincount(index, weights=close, minlength=index[-1] + 1) > 0
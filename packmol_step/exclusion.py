@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Representing a large solute by spheres that exclude the fluid.
+
+Packmol handles a fixed solute atom by atom, so its work grows with the size of
+the solute even though only the surface matters to the fluid. Instead the solute
+can be left out of Packmol's input and replaced by a few constraints keeping the
+fluid outside spheres that cover the solute. The atoms of the solute are added back
+when Packmol's structure is read.
+"""
+
+import itertools
+import logging
+
+import numpy as np
+
+from packmol_step.formats import atom_lines
+
+logger = logging.getLogger(__name__)
+
+
+def exclusion_spheres(xyz, size, tolerance, cell=None):
+    """Spheres covering the atoms, clustered on a grid of cubic voxels.
+
+    Each occupied voxel gives one sphere, centered on the atoms in it and large
+    enough that no atom of the fluid outside it is closer than the tolerance to
+    any of those atoms.
+
+    Parameters
+    ----------
+    xyz : array_like
+        The Cartesian coordinates of the atoms, n x 3.
+    size : float
+        The side of the voxels, in Å. Larger voxels give fewer, larger spheres
+        that exclude more space around the solute.
+    tolerance : float
+        The minimum distance between the solute and the fluid, in Å.
+    cell : (float, float, float)
+        The sides of an orthorhombic periodic cell, or None. If given, the images
+        of spheres crossing the faces of the cell are added.
+
+    Returns
+    -------
+    numpy.ndarray
+        The x, y, z and radius of each sphere, n_spheres x 4.
+    """
+    xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+    if len(xyz) == 0:
+        return np.zeros((0, 4))
+
+    voxels = np.floor((xyz - xyz.min(axis=0)) / size).astype(int)
+    _, inverse = np.unique(voxels, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    counts = np.bincount(inverse)
+    centers = np.stack(
+        [np.bincount(inverse, weights=xyz[:, i]) / counts for i in range(3)], axis=1
+    )
+    radii = np.zeros(len(counts))
+    np.maximum.at(radii, inverse, np.linalg.norm(xyz - centers[inverse], axis=1))
+    spheres = np.column_stack((centers, radii + tolerance))
+
+    if cell is not None:
+        cell = np.asarray(cell, dtype=float)
+        images = [spheres]
+        for shift in itertools.product((-1, 0, 1), repeat=3):
+            if shift == (0, 0, 0):
+                continue
+            image = spheres + np.append(np.array(shift) * cell, 0.0)
+            r = image[:, 3:4]
+            touching = np.all((image[:, 0:3] + r > 0) & (image[:, 0:3] - r < cell), 1)
+            images.append(image[touching])
+        spheres = np.concatenate(images)
+
+    return spheres
+
+
+def with_solute(solute, lines, filetype="pdb"):
+    """Packmol's structure with the atoms of the solute put back first.
+
+    Parameters
+    ----------
+    solute : str
+        The structure file for the solute, as placed.
+    lines : iterable of str
+        The lines of Packmol's structure file, which may be an open file.
+    filetype : str
+        The format of the files, "pdb" or "xyz".
+
+    Yields
+    ------
+    str
+        The lines of the structure file, with the atoms of the solute before the
+        first atom from Packmol.
+    """
+    atoms = [line + "\n" for line in atom_lines(solute.splitlines(), filetype)]
+    lines = iter(lines)
+    if filetype == "xyz":
+        # The number of atoms, then the comment
+        for line in lines:
+            yield f"{int(line) + len(atoms)}\n"
+            break
+        for line in lines:
+            yield line
+            break
+        yield from atoms
+    else:
+        for line in lines:
+            if line[0:6] in ("ATOM  ", "HETATM"):
+                yield from atoms
+                yield line
+                break
+            yield line
+        else:
+            yield from atoms
+    yield from lines
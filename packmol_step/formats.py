@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""The formats of the structure files that Packmol reads and writes.
+
+Packmol reads the templates and writes the packed structure in one format, given by
+the filetype keyword. PDB is the default, since it keeps the names of the atoms,
+but its fixed columns limit the number of atoms in a template to 99,999, and
+writing large templates as PDB is slow. Builds with a large template therefore use
+Packmol's xyz format, which is written directly from the coordinates and has no
+such limits.
+"""
+
+import logging
+
+import numpy as np
+
+from packmol_step.solvent_library import solvated_pdb
+
+logger = logging.getLogger(__name__)
+
+# Templates with more atoms than this are written in the xyz format
+large_template = 10000
+
+
+def choose_filetype(molecules):
+    """The format for Packmol's files, from the size of the largest template.
+
+    Parameters
+    ----------
+    molecules : [dict]
+        The molecules, each with "n_atoms" in the template.
+
+    Returns
+    -------
+    str
+        "xyz" if any template has more than large_template atoms, otherwise "pdb".
+    """
+    if any(molecule["n_atoms"] > large_template for molecule in molecules):
+        return "xyz"
+    return "pdb"
+
+
+def xyz_text(symbols, xyz, comment=""):
+    """The xyz file for atoms.
+
+    Parameters
+    ----------
+    symbols : [str]
+        The element symbols of the atoms.
+    xyz : array_like
+        The Cartesian coordinates of the atoms, n x 3.
+    comment : str
+        The comment on the second line.
+
+    Returns
+    -------
+    str
+        The xyz file.
+    """
+    xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+    lines = [f"{len(xyz)}", comment]
+    lines.extend(
+        f"{symbol:2s} {x:14.6f} {y:14.6f} {z:14.6f}"
+        for symbol, (x, y, z) in zip(symbols, xyz.tolist())
+    )
+    return "\n".join(lines) + "\n"
+
+
+def template_text(configuration, filetype="pdb"):
+    """The file for a template for Packmol.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The template.
+    filetype : str
+        "pdb" or "xyz".
+
+    Returns
+    -------
+    str
+        The file for the template.
+    """
+    if filetype == "pdb":
+        return configuration.to_pdb_text()
+    elif filetype == "xyz":
+        return xyz_text(
+            configuration.atoms.symbols,
+            configuration.atoms.get_coordinates(fractionals=False),
+            comment=f"{configuration.system.name}/{configuration.name}",
+        )
+    raise RuntimeError(f"Do not recognize the filetype '{filetype}'")
+
+
+def atom_lines(lines, filetype="pdb"):
+    """The lines for the atoms in a structure file.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        The lines of the file, which may be an open file.
+    filetype : str
+        "pdb" or "xyz".
+
+    Yields
+    ------
+    str
+        The ATOM and HETATM records of a PDB file, or the lines after the two lines
+        of the header of an xyz file.
+    """
+    if filetype == "pdb":
+        yield from (line for line in lines if line[0:6] in ("ATOM  ", "HETATM"))
+    elif filetype == "xyz":
+        lines = iter(lines)
+        for _ in zip(range(2), lines):
+            pass
+        yield from (line for line in lines if line.strip() != "")
+    else:
+        raise RuntimeError(f"Do not recognize the filetype '{filetype}'")
+
+
+def parse_atoms(lines, filetype="pdb"):
+    """The symbols, names and Cartesian coordinates of atoms.
+
+    Parameters
+    ----------
+    lines : [str]
+        The lines for the atoms, from atom_lines.
+    filetype : str
+        "pdb" or "xyz".
+
+    Returns
+    -------
+    ([str], [str], numpy.ndarray)
+        The element symbols, the names, which are the symbols for xyz files, and
+        the coordinates, n x 3.
+    """
+    if filetype == "pdb":
+        xyz = np.array(
+            [(float(x[30:38]), float(x[38:46]), float(x[46:54])) for x in lines],
+            dtype=float,
+        )
+        symbols = [line[75:78].strip().capitalize() for line in lines]
+        names = [line[12:16].strip() for line in lines]
+    elif filetype == "xyz":
+        words = [line.split() for line in lines]
+        xyz = np.array([w[1:4] for w in words], dtype=float)
+        symbols = [w[0].capitalize() for w in words]
+        names = symbols
+    else:
+        raise RuntimeError(f"Do not recognize the filetype '{filetype}'")
+    return symbols, names, xyz.reshape(-1, 3)
+
+
+def placed_text(parts, filetype="pdb", remark="Solvated from the solvent library"):
+    """The structure file for molecules placed from templates, as Packmol writes it.
+
+    Parameters
+    ----------
+    parts : [(str, numpy.ndarray)]
+        The file of each template, and the coordinates of its copies,
+        n_copies x n_atoms x 3, in the order to write them.
+    filetype : str
+        "pdb" or "xyz".
+    remark : str
+        The remark at the start of a PDB file, or comment of an xyz file.
+
+    Returns
+    -------
+    str
+        The structure file.
+    """
+    if filetype == "pdb":
+        return solvated_pdb(parts, remark=remark)
+    elif filetype == "xyz":
+        symbols = []
+        xyz = []
+        for template, placed in parts:
+            lines = list(atom_lines(template.splitlines(), "xyz"))
+            names, _, _ = parse_atoms(lines, "xyz")
+            placed = np.asarray(placed, dtype=float).reshape(-1, 3)
+            symbols.extend(names * (len(placed) // max(1, len(names))))
+            xyz.append(placed)
+        xyz = np.concatenate(xyz) if len(xyz) > 0 else np.zeros((0, 3))
+        return xyz_text(symbols, xyz, comment=remark)
+    raise RuntimeError(f"Do not recognize the filetype '{filetype}'")
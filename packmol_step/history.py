@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""A local history of Packmol builds, used to predict the time and memory needed."""
+
+from datetime import datetime, timezone
+import logging
+import math
+from pathlib import Path
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# The features of a build that are recorded, and their SQL types
+features = {
+    "n_atoms": "INTEGER",
+    "n_molecules": "INTEGER",
+    "n_components": "INTEGER",
+    "n_solute_atoms": "INTEGER",
+    "density": "REAL",
+    "shape": "TEXT",
+    "periodic": "INTEGER",
+    "tolerance": "REAL",
+    "packmol_version": "TEXT",
+}
+
+# The measured results
+measurements = {
+    "wall_time": "REAL",
+    "peak_rss": "INTEGER",
+    "converged": "INTEGER",
+}
+
+# Flags for builds whose time and memory are not those of a whole packing, so are
+# not used for predictions: resumed from a checkpoint, stopped early by the
+# monitor, or started from a coarse-grained packing.
+flags = {
+    "resumed": "INTEGER",
+    "stopped_early": "INTEGER",
+    "coarse_grained": "INTEGER",
+}
+
+
+class BuildHistory(object):
+    """A SQLite database of previous Packmol builds on this host.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The database file, which is created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30)
+
+        columns = {**features, **measurements, **flags}
+        try:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS builds (id INTEGER PRIMARY KEY, date TEXT, "
+                + ", ".join(f"{key} {_type}" for key, _type in columns.items())
+                + ")"
+            )
+
+            # Add any columns missing from a history written by an older version
+            existing = {row[1] for row in self.db.execute("PRAGMA table_info(builds)")}
+            for key, _type in columns.items():
+                if key not in existing:
+                    self.db.execute(f"ALTER TABLE builds ADD COLUMN {key} {_type}")
+            self.db.commit()
+        except BaseException:
+            self.db.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM builds").fetchone()[0]
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+    def record(self, data):
+        """Add a build to the history.
+
+        Parameters
+        ----------
+        data : dict(str, any)
+            The features, measurements and flags of the build. Missing values are
+            NULL.
+        """
+        keys = [*features, *measurements, *flags]
+        values = [datetime.now(timezone.utc).isoformat()]
+        for key in keys:
+            value = data.get(key)
+            if isinstance(value, bool):
+                value = int(value)
+            values.append(value)
+        placeholders = ", ".join("?" * len(values))
+        self.db.execute(
+            f"INSERT INTO builds (date, {', '.join(keys)}) VALUES ({placeholders})",
+            values,
+        )
+        self.db.commit()
+
+    def predict(self, data, k=5):
+        """Estimate the time and memory for a build from similar past builds.
+
+        The k past builds with the same shape and periodicity that are closest in
+        the logarithms of the numbers of atoms and molecules and the density are
+        used, leaving out any that were resumed, stopped early or started from a
+        coarse-grained packing. Each is scaled to the requested size with an
+        exponent fitted to the history, and the results are averaged
+        geometrically.
+
+        Parameters
+        ----------
+        data : dict(str, any)
+            The features of the planned build.
+        k : int
+            The number of neighbors to use.
+
+        Returns
+        -------
+        dict(str, any) or None
+            The predicted "wall_time" in s and "peak_rss" in bytes, and the number
+            of builds, "n", they are based on. None if there is no similar build.
+        """
+        rows = self.db.execute(
+            "SELECT n_atoms, n_molecules, density, wall_time, peak_rss FROM builds "
+            "WHERE shape = ? AND periodic = ? AND n_atoms > 0 AND wall_time > 0 "
+            + "".join(f"AND COALESCE({key}, 0) = 0 " for key in flags),
+            (data["shape"], int(data["periodic"])),
+        ).fetchall()
+        if len(rows) == 0:
+            return None
+
+        n_atoms = data["n_atoms"]
+        n_molecules = data["n_molecules"]
+        density = data.get("density") or 1.0
+
+        def distance(row):
+            d = math.log(row[0] / n_atoms) ** 2
+            d += math.log(max(row[1], 1) / max(n_molecules, 1)) ** 2
+            d += math.log((row[2] or 1.0) / density) ** 2
+            return d
+
+        neighbors = sorted(rows, key=distance)[:k]
+
+        result = {"n": len(neighbors)}
+        for column, key, default in ((3, "wall_time", 1.0), (4, "peak_rss", 1.0)):
+            points = [(row[0], row[column]) for row in rows if row[column]]
+            exponent = _fit_exponent(points, default)
+            logs = [
+                math.log(row[column] * (n_atoms / row[0]) ** exponent)
+                for row in neighbors
+                if row[column]
+            ]
+            if len(logs) == 0:
+                result[key] = None
+            else:
+                result[key] = math.exp(sum(logs) / len(logs))
+        return result
+
+
+def _fit_exponent(points, default, lower=0.5, upper=2.5):
+    """Fit y = c * x**p by least squares in log space, returning p.
+
+    Parameters
+    ----------
+    points : [(float, float)]
+        The (x, y) points.
+    default : float
+        The exponent to use if there are too few distinct points.
+    lower, upper : float
+        Limits on the exponent, to keep extrapolations sensible.
+
+    Returns
+    -------
+    float
+    """
+    if len({x for x, _ in points}) < 3:
+        return default
+    xs = [math.log(x) for x, _ in points]
+    ys = [math.log(y) for _, y in points]
+    x0 = sum(xs) / len(xs)
+    y0 = sum(ys) / len(ys)
+    sxx = sum((x - x0) ** 2 for x in xs)
+    sxy = sum((x - x0) * (y - y0) for x, y in zip(xs, ys))
+    return min(upper, max(lower, sxy / sxx))
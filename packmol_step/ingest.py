@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+"""Reading the structure from Packmol into a configuration."""
+
+import itertools
+import logging
+
+import numpy as np
+
+from packmol_step.formats import atom_lines, parse_atoms
+
+logger = logging.getLogger(__name__)
+
+
+def pdb_atoms(text, skip=0, filetype="pdb"):
+    """The symbols and Cartesian coordinates of the atoms in a PDB file.
+
+    Parameters
+    ----------
+    text : str
+        The PDB file from Packmol.
+    skip : int
+        The number of atoms at the start to skip.
+    filetype : str
+        The format of the file, "pdb" or "xyz".
+
+    Returns
+    -------
+    ([str], [float], [float], [float])
+        The element symbols and x, y and z coordinates of the remaining atoms.
+    """
+    lines = list(atom_lines(text.splitlines(), filetype))[skip:]
+    symbols, _, xyz = parse_atoms(lines, filetype)
+    return symbols, xyz[:, 0].tolist(), xyz[:, 1].tolist(), xyz[:, 2].tolist()
+
+
+def atom_data(lines, cell=None, filetype="pdb"):
+    """The data for appending the atoms in PDB lines to a configuration.
+
+    The coordinates are converted from Packmol's Cartesian coordinates to
+    fractional ones, if a cell is given, in one array operation, so that they are
+    written to the configuration once, already converted.
+
+    Parameters
+    ----------
+    lines : [str]
+        The ATOM and HETATM lines of the PDB file, or the atom lines of an xyz file.
+    cell : (float, float, float)
+        The sides of an orthorhombic cell for fractional coordinates, or None to
+        keep the Cartesian coordinates.
+    filetype : str
+        The format of the lines, "pdb" or "xyz".
+
+    Returns
+    -------
+    dict(str, [any])
+        The "x", "y", "z", "symbol" and "name" of the atoms.
+    """
+    symbols, names, xyz = parse_atoms(lines, filetype)
+    if cell is not None:
+        xyz /= np.asarray(cell, dtype=float)
+    return {
+        "x": xyz[:, 0].tolist(),
+        "y": xyz[:, 1].tolist(),
+        "z": xyz[:, 2].tolist(),
+        "symbol": symbols,
+        "name": names,
+    }
+
+
+def register_templates(system_db, molecules):
+    """Record the templates of the molecules in the table of templates.
+
+    Each template is in the category "molecule", named by its SMILES or by its
+    system and configuration, with the number of atoms and molar mass. A template
+    already in the table is reused, so the ids are the same across steps. The id
+    is put in each molecule as "template id".
+
+    Parameters
+    ----------
+    system_db : molsystem.SystemDB
+        The system database.
+    molecules : [dict]
+        The molecules from get_input. Those without a "source", like the current
+        configuration when adding to it, are not templates.
+    """
+    templates = system_db.templates
+    for key, coltype in (("n_atoms", "int"), ("mass", "float")):
+        if key not in templates:
+            templates.add_attribute(key, coltype=coltype)
+
+    for molecule in molecules:
+        if molecule.get("source") is None:
+            continue
+        configuration = molecule["configuration"]
+        if molecule["source"] == "SMILES":
+            name = molecule["definition"]
+        else:
+            name = f"{configuration.system.name}/{configuration.name}"
+        tid = templates.get_id(name, category="molecule")
+        if tid is None:
+            tid = templates.create(
+                name,
+                category="molecule",
+                n_atoms=configuration.n_atoms,
+                mass=configuration.mass,
+            ).id
+        molecule["template id"] = tid
+
+
+def next_molecule(configuration):
+    """The number for the next molecule in a configuration.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The configuration.
+
+    Returns
+    -------
+    int
+        One more than the largest molecule number of the atoms, or 0 if none are
+        numbered.
+    """
+    if "molecule" not in configuration.atoms or configuration.n_atoms == 0:
+        return 0
+    numbers = [
+        x for x in configuration.atoms.get_column_data("molecule") if x is not None
+    ]
+    return max(numbers) + 1 if len(numbers) > 0 else 0
+
+
+def molecule_columns(molecules, first=0):
+    """The molecule and template of each atom, in the order Packmol wrote them.
+
+    Parameters
+    ----------
+    molecules : [dict]
+        The molecules, each with the "number" of copies, "n_atoms" in each and
+        the "template id".
+    first : int
+        The number of the first molecule.
+
+    Returns
+    -------
+    dict(str, [int])
+        The "molecule" number and "template" id of each atom.
+    """
+    numbers = [max(0, molecule["number"]) for molecule in molecules]
+    sizes = np.repeat([molecule["n_atoms"] for molecule in molecules], numbers)
+    tids = np.repeat([molecule["template id"] for molecule in molecules], numbers)
+    return {
+        "molecule": np.repeat(np.arange(first, first + len(sizes)), sizes).tolist(),
+        "template": np.repeat(tids, sizes).tolist(),
+    }
+
+
+def orthorhombic_cell(configuration):
+    """The sides of the cell if the configuration is in fractional coordinates.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The configuration, which must be orthorhombic if periodic.
+
+    Returns
+    -------
+    (float, float, float) or None
+        The sides a, b and c of the cell, or None for Cartesian coordinates.
+    """
+    if configuration.periodicity == 3 and (
+        configuration.coordinate_system == "fractional"
+    ):
+        return tuple(configuration.cell.parameters[0:3])
+    return None
+
+
+def append_atoms(
+    configuration,
+    text,
+    n_existing,
+    n_new,
+    charge=0.0,
+    bonds=None,
+    columns=None,
+    filetype="pdb",
+):
+    """Append the atoms that Packmol added to an existing configuration.
+
+    The existing atoms were a fixed structure, the first in Packmol's output, so
+    they are skipped and only the new atoms, their bonds and their other data are
+    written to the configuration.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The configuration to add to, which must be orthorhombic if periodic.
+    text : str
+        The PDB file from Packmol.
+    n_existing : int
+        The number of atoms already in the configuration.
+    n_new : int
+        The number of new atoms expected.
+    charge : float
+        The total charge of the new molecules.
+    bonds : ([int], [int], [int])
+        The 0-based indices of the atoms in the bonds among the new atoms, and the
+        bond orders.
+    columns : dict(str, [any])
+        Other data for the new atoms, like the atom types, charges, and the
+        molecule and template of each atom.
+    filetype : str
+        The format of Packmol's file, "pdb" or "xyz".
+
+    Returns
+    -------
+    [int]
+        The ids of the new atoms.
+    """
+    lines = list(atom_lines(text.splitlines(), filetype))[n_existing:]
+    if len(lines) != n_new:
+        raise RuntimeError(
+            f"Packmol's structure has {len(lines)} new atoms rather than {n_new}. "
+            "It may have been stopped while writing it."
+        )
+
+    atoms = configuration.atoms
+    data = atom_data(lines, cell=orthorhombic_cell(configuration), filetype=filetype)
+    if "name" not in atoms:
+        del data["name"]
+    if columns is not None:
+        for key, values in columns.items():
+            if key not in atoms:
+                if "atom_types_" in key:
+                    atoms.add_attribute(key, coltype="str")
+                elif "charges" in key:
+                    atoms.add_attribute(key, coltype="float")
+                elif key in ("molecule", "template"):
+                    atoms.add_attribute(key, coltype="int")
+                else:
+                    raise RuntimeError(f"Can't handle extra column '{key}'")
+            data[key] = values
+
+    ids = atoms.append(**data)
+
+    if bonds is not None and len(bonds[0]) > 0:
+        i_indices, j_indices, bond_orders = bonds
+        configuration.bonds.append(
+            i=[ids[i] for i in i_indices],
+            j=[ids[j] for j in j_indices],
+            bondorder=bond_orders,
+        )
+
+    configuration.charge = configuration.charge + charge
+
+    return ids
+
+
+def ingest_pdb(
+    configuration,
+    fd,
+    molecules,
+    batch_size=100000,
+    skip=0,
+    first_molecule=0,
+    filetype="pdb",
+):
+    """Read the structure from Packmol in batches, appending it to a configuration.
+
+    Only one batch of lines, atoms and bonds is held in memory at a time, so the
+    memory needed does not grow with the size of the system. Each batch is a whole
+    number of molecules, at least one, and is written to the database in one
+    append of the atoms and one of the bonds.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The configuration to add to. If it is in fractional coordinates its cell
+        must be orthorhombic.
+    fd : file object
+        The PDB file from Packmol, open for reading text.
+    molecules : [dict]
+        The molecules in the order that Packmol wrote them, each with the
+        "configuration" of the template, the "number" of copies and the "bonds" as
+        0-based indices and bond orders. If they have the "template id", the
+        molecule and template of each atom are written as well.
+    batch_size : int
+        The approximate number of atoms in each batch.
+    skip : int
+        The number of atoms at the start of the file to skip, e.g. the fixed atoms
+        of an existing configuration.
+    first_molecule : int
+        The number of the first molecule.
+    filetype : str
+        The format of the file, "pdb" or "xyz".
+
+    Returns
+    -------
+    int
+        The number of atoms added.
+    """
+    lines = itertools.islice(atom_lines(fd, filetype), skip, None)
+
+    cell = orthorhombic_cell(configuration)
+
+    atoms = configuration.atoms
+    if "name" not in atoms:
+        atoms.add_attribute("name", coltype="str")
+    numbered = all("template id" in molecule for molecule in molecules)
+    if numbered:
+        for key in ("molecule", "template"):
+            if key not in atoms:
+                atoms.add_attribute(key, coltype="int")
+
+    n_added = 0
+    n_molecules = first_molecule
+    for molecule in molecules:
+        template = molecule["configuration"]
+        n_atoms = template.n_atoms
+        n = molecule["number"]
+        if n <= 0 or n_atoms == 0:
+            continue
+
+        # The atom types and charges are copied from the template
+        columns = {}
+        for key in template.atoms.keys():
+            if "atom_types_" in key or "charges" in key:
+                if key not in atoms:
+                    coltype = "str" if "atom_types_" in key else "float"
+                    atoms.add_attribute(key, coltype=coltype)
+                columns[key] = template.atoms.get_column_data(key)
+
+        per_batch = max(1, batch_size // n_atoms)
+        for start in range(0, n, per_batch):
+            n_copies = min(per_batch, n - start)
+            block = list(itertools.islice(lines, n_copies * n_atoms))
+            if len(block) != n_copies * n_atoms:
+                raise RuntimeError(
+                    f"Packmol's structure has only {n_added + len(block)} new atoms. "
+                    "It may have been stopped while writing it."
+                )
+
+            data = atom_data(block, cell=cell, filetype=filetype)
+            for key, values in columns.items():
+                data[key] = values * n_copies
+            if numbered:
+                data["molecule"] = np.repeat(
+                    np.arange(n_molecules, n_molecules + n_copies), n_atoms
+                ).tolist()
+                data["template"] = [molecule["template id"]] * (n_copies * n_atoms)
+                n_molecules += n_copies
+            ids = atoms.append(**data)
+            n_added += len(ids)
+
+            if len(molecule["bonds"]) > 0:
+                i_atoms = []
+                j_atoms = []
+                bond_orders = []
+                for copy in range(0, n_copies * n_atoms, n_atoms):
+                    for i, j, bond_order in molecule["bonds"]:
+                        i_atoms.append(ids[copy + i])
+                        j_atoms.append(ids[copy + j])
+                        bond_orders.append(bond_order)
+                configuration.bonds.append(i=i_atoms, j=j_atoms, bondorder=bond_orders)
+
+    return n_added
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""Building a periodic cell of layers, e.g. for liquid-liquid interfaces.
+
+Each layer is a slab across the a and b sides of the cell, with its own composition
+and density. The slabs are independent, so each is packed by its own Packmol run
+in a cell of its own, all at the same time, keeping the molecules a gap away from
+the top and bottom. The packed slabs are then stacked along c, giving a cell whose
+height is exactly the sum of the thicknesses and gaps. A periodic solute, such as
+the slab of a solid, is the bottom layer and sets the a and b sides of the cell.
+"""
+
+import logging
+
+from packmol_step.composition_series import parse_compositions
+
+logger = logging.getLogger(__name__)
+
+
+def parse_lengths(text, what="thicknesses"):
+    """A list of positive numbers separated by commas or spaces.
+
+    Parameters
+    ----------
+    text : str
+        The numbers, e.g. "30, 20".
+    what : str
+        What the numbers are, for the error message.
+
+    Returns
+    -------
+    [float]
+        The numbers, in the order given.
+    """
+    if text is None:
+        return []
+    try:
+        result = [float(x) for x in str(text).replace(",", " ").split()]
+    except ValueError:
+        raise RuntimeError(f"Cannot understand the layer {what} '{text}'.")
+    if any(x <= 0 for x in result):
+        raise RuntimeError(f"The layer {what} '{text}' must be positive.")
+    return result
+
+
+def parse_layers(compositions, densities, thicknesses, n_components):
+    """The composition, density and thickness of each layer, from the bottom.
+
+    Parameters
+    ----------
+    compositions : str
+        The relative amounts of the fluid components in each layer, e.g. "1:0, 0:1",
+        as for a series of compositions.
+    densities : str
+        The density of each layer, e.g. "1.0, 0.8".
+    thicknesses : str
+        The thickness of each layer, e.g. "30, 30".
+    n_components : int
+        The number of fluid components.
+
+    Returns
+    -------
+    [dict(str, any)]
+        The "composition", "density" and "thickness" of each layer.
+    """
+    compositions = parse_compositions(compositions)
+    densities = parse_lengths(densities, "densities")
+    thicknesses = parse_lengths(thicknesses, "thicknesses")
+    if len(compositions) == 0:
+        raise RuntimeError("A layered cell needs the composition of each layer.")
+    if not (len(compositions) == len(densities) == len(thicknesses)):
+        raise RuntimeError(
+            f"There are {len(compositions)} layer compositions, {len(densities)} "
+            f"densities and {len(thicknesses)} thicknesses, which should be the same."
+        )
+    for composition in compositions:
+        if len(composition) != n_components:
+            raise RuntimeError(
+                f"The layer composition {composition} does not have an amount for "
+                f"each of the {n_components} fluid components."
+            )
+    return [
+        {"composition": composition, "density": density, "thickness": thickness}
+        for composition, density, thickness in zip(compositions, densities, thicknesses)
+    ]
+
+
+def layer_offsets(thicknesses, gap, bottom=0.0):
+    """Where the layers go in the stacked cell.
+
+    Each layer is packed in a cell of its own, the thickness of the layer plus the
+    gap high, with the molecules between half the gap and the thickness plus half
+    the gap. Its cell is then shifted up to sit on the layer below it.
+
+    Parameters
+    ----------
+    thicknesses : [float]
+        The thickness of each layer, from the bottom.
+    gap : float
+        The gap between neighboring layers, including between the top layer and
+        the bottom of the periodic image above.
+    bottom : float
+        The height of the cell of a solid under the layers, or 0.0 for none. The
+        layers are kept the whole gap away from the solid on both sides.
+
+    Returns
+    -------
+    ([float], float)
+        The shift along c of each layer, and the height of the stacked cell.
+    """
+    offsets = []
+    z = bottom + gap / 2 if bottom > 0 else 0.0
+    for thickness in thicknesses:
+        offsets.append(z)
+        z += thickness + gap
+    if bottom > 0:
+        z += gap / 2
+    return offsets, z
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""A host-wide limit on the number of Packmol processes running at once.
+
+Several flowcharts sharing a node each start their own Packmol process, which
+oversubscribes the cores and memory. The limiter is a counting semaphore built
+from lock files in a directory shared by all the processes on the host, normally
+under the SEAMM root in a directory named for the host, so that a root shared by
+several nodes limits each node separately. Each lock file is a slot; a process
+holds a slot for as long as its Packmol is running, and waits if all the slots
+are taken.
+"""
+
+import logging
+import os
+from pathlib import Path
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessLimiter(object):
+    """A counting semaphore across processes on one host, with optional pinning.
+
+    Use it as a context manager around the code that runs Packmol::
+
+        with ProcessLimiter(directory, max_processes=4) as limiter:
+            ...
+        print(limiter.wait_time)
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The directory for the lock files, which must be shared by all the processes
+        that are to be limited.
+    max_processes : int
+        The maximum number of processes at once. 0 or less means no limit.
+    cores_per_process : int
+        If greater than 0, pin the process to this many cores while it holds a
+        slot. Slot n gets the n'th set of cores available to this process. Without
+        a limit on the processes there are no slots, so no pinning.
+    poll : float
+        The time in seconds between attempts to get a slot.
+    """
+
+    def __init__(self, directory, max_processes=0, cores_per_process=0, poll=0.5):
+        self.directory = Path(directory).expanduser()
+        self.max_processes = max_processes
+        self.cores_per_process = cores_per_process
+        self.poll = poll
+
+        self.slot = None
+        self.cores = None
+        self.wait_time = 0.0
+
+        self._fd = None
+        self._saved_affinity = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+    @property
+    def enabled(self):
+        """Whether the limiter is actually limiting anything."""
+        return self.max_processes > 0 and fcntl is not None
+
+    def acquire(self):
+        """Wait for a free slot, then take it and pin to its cores if requested."""
+        t0 = time.perf_counter()
+        if self.max_processes > 0 and fcntl is None:
+            logger.warning("Cannot limit the Packmol processes on this platform.")
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            while self._fd is None:
+                for slot in range(self.max_processes):
+                    path = self.directory / f"slot_{slot}.lock"
+                    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        os.close(fd)
+                        continue
+                    self._fd = fd
+                    self.slot = slot
+                    break
+                else:
+                    time.sleep(self.poll)
+        self.wait_time = time.perf_counter() - t0
+
+        if self.cores_per_process > 0:
+            if self.slot is None:
+                # Without a slot every process would be pinned to the same cores
+                logger.warning(
+                    "Not pinning Packmol to cores, since that needs a limit on the "
+                    "number of Packmol processes."
+                )
+            else:
+                self._pin()
+
+    def release(self):
+        """Restore the CPU affinity and free the slot."""
+        if self._saved_affinity is not None:
+            os.sched_setaffinity(0, self._saved_affinity)
+            self._saved_affinity = None
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def _pin(self):
+        """Pin this process, and hence its children, to the cores for the slot."""
+        if not hasattr(os, "sched_setaffinity"):
+            logger.warning("Cannot pin Packmol to cores on this platform.")
+            return
+
+        available = sorted(os.sched_getaffinity(0))
+        n = min(self.cores_per_process, len(available))
+        n_sets = len(available) // n
+        first = (self.slot % n_sets) * n
+        self.cores = available[first : first + n]
+
+        self._saved_affinity = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, self.cores)
+        logger.debug(f"Pinned Packmol in slot {self.slot} to cores {self.cores}")
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""This file contains metadata describing the results from Packmol."""
+
+metadata = {}
+
+"""Description of the results from a Packmol step.
+
+Each result is described by a dictionary with the following keys:
+
+    description : str
+        A human readable description of the result.
+    dimensionality : str
+        "scalar" for single values.
+    type : str
+        The Python type of the result, "float", "integer", "string" or "boolean".
+    units : str
+        The units of the result, if any.
+
+The results can be saved as variables in the flowchart, or as columns in tables,
+which allows the performance and quality of many builds to be followed.
+"""
+metadata["results"] = {
+    "number of atoms": {
+        "description": "The number of atoms packed",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "number of molecules": {
+        "description": "The number of molecules packed",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "density": {
+        "description": "The density of the packed region",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "g/mL",
+    },
+    "number of loops": {
+        "description": "The number of GENCAN loops run by Packmol",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "objective function": {
+        "description": "The final value of Packmol's objective function",
+        "dimensionality": "scalar",
+        "type": "float",
+    },
+    "constraint violation": {
+        "description": "The maximum violation of the constraints",
+        "dimensionality": "scalar",
+        "type": "float",
+    },
+    "minimum distance": {
+        "description": "The minimum distance between atoms in different molecules",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "Å",
+    },
+    "converged": {
+        "description": "Whether Packmol met the tolerance",
+        "dimensionality": "scalar",
+        "type": "boolean",
+    },
+    "stopped early": {
+        "description": "Whether Packmol was stopped once the packing was good enough",
+        "dimensionality": "scalar",
+        "type": "boolean",
+    },
+    "running time": {
+        "description": "The running time reported by Packmol",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "s",
+    },
+    "wall time": {
+        "description": "The elapsed time for running Packmol",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "s",
+    },
+}
@@ -2,18 +2,30 @@
 
 """A step for building fluids with Packmol in a SEAMM flowchart"""
 
+import concurrent.futures
 import configparser
 import importlib
+import json
 import logging
 import math
 import os
 from pathlib import Path
 import pprint
 import shutil
+import socket
+import sys
+import tempfile
 import textwrap
+import time
 
+import numpy as np
 from tabulate import tabulate
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 from molsystem import SystemDB
 import seamm
 import seamm_util
@@ -21,6 +33,7 @@ from seamm_util import Configuration, ureg, Q_, units_class  # noqa: F401
 import seamm_util.printing as printing
 from seamm_util.printing import FormattedText as __
 import packmol_step
+from packmol_step.canonical import canonical_definition
 
 is_expr = seamm.Node.is_expr
 
@@ -28,6 +41,36 @@ logger = logging.getLogger(__name__)
 job = printing.getPrinter()
 printer = printing.getPrinter("packmol")
 
+# gfortran buffers the output of Packmol unless told not to, which would hide its
+# progress from the monitor and leave packmol.out incomplete if it is stopped.
+packmol_env = {"GFORTRAN_UNBUFFERED_PRECONNECTED": "y"}
+
+
+def _set_writeout(files, interval):
+    """Have Packmol write the structure at least every so many loops.
+
+    An existing writeout in the input is kept if it is more frequent, so that
+    checkpointing and monitoring can share the one setting.
+
+    Parameters
+    ----------
+    files : dict(str, str)
+        The input files for Packmol. The input, input.inp, is changed in place.
+    interval : int
+        The largest number of loops between writing the structure.
+    """
+    lines = files["input.inp"].splitlines()
+    existing = [i for i, line in enumerate(lines) if line.startswith("writeout ")]
+    if len(existing) > 0:
+        interval = min([interval, *(int(lines[i].split()[1]) for i in existing)])
+        first = existing[0]
+        lines = [line for line in lines if not line.startswith("writeout ")]
+    else:
+        first = next(i for i, line in enumerate(lines) if line.startswith("structure"))
+    lines.insert(first, f"writeout {interval}")
+    lines.append("")
+    files["input.inp"] = "\n".join(lines)
+
 
 class Packmol(seamm.Node):
     def __init__(self, flowchart=None, extension=None):
@@ -47,6 +90,7 @@ class Packmol(seamm.Node):
         )
 
         self.parameters = packmol_step.PackmolParameters()
+        self._metadata = packmol_step.metadata
 
     @property
     def version(self):
@@ -73,6 +117,147 @@ class Packmol(seamm.Node):
         if parser_exists:
             return result
 
+        # Options for sharing the host with other Packmol processes
+        parser.add_argument(
+            parser_name,
+            "--max-processes",
+            default=0,
+            type=int,
+            help=(
+                "The maximum number of Packmol processes to run at once on this "
+                "host, or 0 for no limit"
+            ),
+        )
+        parser.add_argument(
+            parser_name,
+            "--cores-per-process",
+            default=0,
+            type=int,
+            help=(
+                "Pin each Packmol process to this many cores, or 0 to not pin. Needs "
+                "a maximum number of processes"
+            ),
+        )
+
+        # Options for checkpointing
+        parser.add_argument(
+            parser_name,
+            "--checkpoint-interval",
+            default=0,
+            type=int,
+            help=(
+                "Checkpoint Packmol every this many loops, so that a stopped job "
+                "resumes from the checkpoint when rerun. 0 to not checkpoint."
+            ),
+        )
+
+        # Options for preparing the templates
+        parser.add_argument(
+            parser_name,
+            "--template-processes",
+            default=1,
+            type=int,
+            help=(
+                "The number of processes for embedding and typing the SMILES "
+                "components of mixtures"
+            ),
+        )
+
+        # Options for running in local scratch space
+        parser.add_argument(
+            parser_name,
+            "--scratch-directory",
+            default="",
+            help=(
+                "Run Packmol in a temporary directory in this node-local or tmpfs "
+                "directory, copying back only the chosen files. Empty to run in the "
+                "step directory."
+            ),
+        )
+        parser.add_argument(
+            parser_name,
+            "--scratch-return-files",
+            default="packmol.pdb packmol.xyz packmol.out stderr.txt",
+            help="The files to copy back from the scratch directory",
+        )
+        parser.add_argument(
+            parser_name,
+            "--scratch-compress",
+            default="no",
+            choices=["no", "gzip", "zstd"],
+            help="Whether to compress the files copied back from the scratch directory",
+        )
+
+        # Options for archiving the files in the step directory
+        parser.add_argument(
+            parser_name,
+            "--archive",
+            default="no",
+            choices=["no", "gzip", "zstd"],
+            help="Whether to compress the input and output files of Packmol",
+        )
+        parser.add_argument(
+            parser_name,
+            "--keep-files",
+            default="always",
+            choices=["always", "on failure only", "never"],
+            help="When to keep the input and output files of Packmol",
+        )
+        parser.add_argument(
+            parser_name,
+            "--coordinates-file",
+            default="no",
+            choices=["no", "npz"],
+            help="Whether to save the coordinates in a compact binary file",
+        )
+
+        # Options for reading the structure from Packmol
+        parser.add_argument(
+            parser_name,
+            "--ingest-batch-size",
+            default=0,
+            type=int,
+            help=(
+                "Read the structure from Packmol in batches of about this many atoms, "
+                "so the memory needed does not grow with the size of the system. 0 "
+                "to read it all at once."
+            ),
+        )
+
+        # The library of boxes of solvent for tiling around solutes
+        parser.add_argument(
+            parser_name,
+            "--solvent-library",
+            default="solvent_library",
+            help=(
+                "The directory, relative to the SEAMM root, holding the boxes of "
+                "solvent for tiling around solutes. Empty for no library."
+            ),
+        )
+
+        # The cache of the structures embedded from SMILES
+        parser.add_argument(
+            parser_name,
+            "--template-cache",
+            default="",
+            help=(
+                "The directory, relative to the SEAMM root, holding the 3-D "
+                "structures embedded from SMILES, for reuse. Empty, the default, for "
+                "no cache. Needed to build SMILES with 'template cache only'."
+            ),
+        )
+
+        # The history of builds, used to predict resources
+        parser.add_argument(
+            parser_name,
+            "--history-file",
+            default="packmol_history.db",
+            help=(
+                "The SQLite file, relative to the SEAMM root, for the history of "
+                "Packmol builds on this host. Empty to not keep a history."
+            ),
+        )
+
         return result
 
     def description_text(self, P=None):
@@ -95,11 +280,24 @@ class Packmol(seamm.Node):
             periodic = periodic.lower() == "yes"
         shape = P["shape"]
 
-        if periodic:
+        if P["mode"] == "add to the current configuration":
+            text = "Will add the following molecules to the current configuration"
+            text += ", keeping its atoms fixed:\n\n"
+        elif P["mode"] == "build a layered cell":
+            text = (
+                "Will create a periodic cell of layers of the following molecules:\n\n"
+            )
+        elif P["mode"] == "build separate regions":
+            text = (
+                "Will create a periodic cell with separate regions of the following "
+                "molecules:\n\n"
+            )
+        elif periodic:
             text = f"Will create a {shape} periodic cell"
+            text += " containing the following molecules:\n\n"
         else:
             text = f"Will create a {shape} region"
-        text += " containing the following molecules:\n\n"
+            text += " containing the following molecules:\n\n"
 
         # Print table of molecules
         table = {
@@ -145,52 +343,137 @@ class Packmol(seamm.Node):
 
         # And the rest of the control
         dimensions = P["dimensions"]
-        text = f"\n\nThe dimensions of the region will be {dimensions}"
-        if dimensions == "given explicitly":
-            if shape == "cubic":
-                text += f" by the edge length {P['edge length']}."
-            elif shape == "rectangular":
-                text += f" by the three sides {P['a']} x{P['b']} x{P['c']}."
-            elif shape == "spherical":
-                text += f" by the diameter {P['diameter']}."
-            else:
-                raise RuntimeError(f"Do not recognize shape '{shape}'")
-        elif dimensions == "calculated from the volume":
-            text += f" {P['volume']}."
-        elif dimensions == "calculated from the solute dimensions":
-            text += (
-                ". If the input structure is periodic, its dimensions will be used. "
-                "Otherwise for molecules, the region will be a box with "
-                f"extra space of {P['solvent thickness']} around the molecule."
+        if P["mode"] == "add to the current configuration":
+            text = "\n\nThe cell will be that of the current configuration."
+        elif P["mode"] == "build a layered cell":
+            text = (
+                "\n\nThe layers, from the bottom, will have the compositions "
+                f"{P['layer compositions']}, densities {P['layer densities']} g/mL "
+                f"and thicknesses {P['layer thicknesses']} Å, with a gap of "
+                f"{P['interface gap']} between them. The layers will be packed at the "
+                "same time, each by its own Packmol, and stacked along c in a cell "
+                f"{P['a']} x {P['b']} across, or as wide as the solid under them if "
+                "the solute is a periodic configuration."
+            )
+        elif P["mode"] == "build separate regions":
+            text = (
+                f"\n\nThe cell will be {P['a']} x {P['b']} x {P['c']}, with regions "
+                f"of shapes {P['region shapes']}, sizes {P['region sizes']} Å, "
+                f"compositions {P['region compositions']} and densities "
+                f"{P['region densities']} g/mL. The regions will be packed at the same "
+                "time, each by its own Packmol, and placed at random at least "
+                f"{P['region spacing']} apart."
             )
-        elif dimensions == "calculated from the density":
-            text += f" {P['density']}."
-        elif dimensions == "calculated using the Ideal Gas Law":
-            text += f" (PV=NRT) with P={P['pressure']} and T={P['temperature']}."
         else:
-            raise RuntimeError(f"Do not recognize dimensions '{dimensions}'")
+            text = f"\n\nThe dimensions of the region will be {dimensions}"
+            if dimensions == "given explicitly":
+                if shape == "cubic":
+                    text += f" by the edge length {P['edge length']}."
+                elif shape == "rectangular":
+                    text += f" by the three sides {P['a']} x{P['b']} x{P['c']}."
+                elif shape == "spherical":
+                    text += f" by the diameter {P['diameter']}."
+                else:
+                    raise RuntimeError(f"Do not recognize shape '{shape}'")
+            elif dimensions == "calculated from the volume":
+                text += f" {P['volume']}."
+            elif dimensions == "calculated from the solute dimensions":
+                text += (
+                    ". If the input structure is periodic, its dimensions will be "
+                    "used. Otherwise for molecules, the region will be a box with "
+                    f"extra space of {P['solvent thickness']} around the molecule."
+                )
+                if P["solvation"] == "tiling a box from the solvent library":
+                    text += (
+                        " The solvent will be tiled from a box in the solvent library, "
+                        "if there is one, rounding the cell up to a whole number of "
+                        "boxes."
+                    )
+            elif dimensions == "calculated from the density":
+                text += f" {P['density']}."
+                if str(P["density series"]).strip() != "":
+                    text += (
+                        " Boxes will also be made at the densities "
+                        f"{P['density series']}, by packing the lowest density and "
+                        "compressing it, repacking only the molecules that then "
+                        f"overlap closer than {P['series minimum distance']}."
+                    )
+            elif dimensions == "calculated using the Ideal Gas Law":
+                text += f" (PV=NRT) with P={P['pressure']} and T={P['temperature']}."
+            else:
+                raise RuntimeError(f"Do not recognize dimensions '{dimensions}'")
 
         amount = P["fluid amount"]
-        text += " The number of molecules of the fluid will be obtained "
-        if amount == "rounding this number of atoms":
+        if P["mode"] not in ("build a layered cell", "build separate regions"):
+            text += " The number of molecules of the fluid will be obtained "
+            if amount == "rounding this number of atoms":
+                text += (
+                    f"by rounding {P['approximate number of atoms']} atoms to give "
+                    "a whole number of molecules with the requested ratios."
+                )
+            elif amount == "rounding this number of molecules":
+                text += (
+                    f"by rounding {P['approximate number of molecules']} molecules to "
+                    "give the requested ratios of species."
+                )
+            elif amount == "using the density":
+                text += f" by using the density {P['density']}."
+            elif amount == "using the Ideal Gas Law":
+                text += (
+                    f" by using the Ideal Gas Law (PV=NRT) with P={P['pressure']} and "
+                    f"T={P['temperature']}."
+                )
+            else:
+                raise RuntimeError(f"Do not recognize amount '{amount}'")
+
+        if str(P["composition series"]).strip() != "":
             text += (
-                f"by rounding {P['approximate number of atoms']} atoms to give "
-                "a whole number of molecules with the requested ratios."
+                " Boxes will also be made with the compositions "
+                f"{P['composition series']}, by swapping molecules in the packed box "
+                "and repacking only the new molecules that overlap closer than "
+                f"{P['series minimum distance']}."
             )
-        elif amount == "rounding this number of molecules":
+
+        if P["solute representation"] == "exclusion spheres":
             text += (
-                f"by rounding {P['approximate number of molecules']} molecules to give "
-                "the requested ratios of species."
+                " Any solute will be given to Packmol as spheres of about "
+                f"{P['exclusion sphere size']} covering it, which the fluid is kept "
+                "outside of, and its atoms put back afterwards."
             )
-        elif amount == "using the density":
-            text += f" by using the density {P['density']}."
-        elif amount == "using the Ideal Gas Law":
+
+        if P["embedding"] == "template cache only":
             text += (
-                f" by using the Ideal Gas Law (PV=NRT) with P={P['pressure']} and "
-                f"T={P['temperature']}."
+                " The 3-D structures of any SMILES will be taken from the template "
+                "cache."
+            )
+        elif P["embedding"] != "OpenBabel":
+            text += f" Any SMILES will be built in 3-D with {P['embedding']}."
+        conformers = P["conformers"]
+        if is_expr(conformers) or int(conformers) > 1:
+            text += (
+                f" The conformer with the smallest {P['conformer measure']} of "
+                f"{conformers} will be used for each SMILES."
             )
-        else:
-            raise RuntimeError(f"Do not recognize amount '{amount}'")
+
+        if P["packing method"] == "coarse-grained, then atomistic":
+            text += (
+                " Each molecule will first be packed as a single sphere, then the "
+                "atomistic structure will be polished."
+            )
+
+        criterion = P["stop early"]
+        if criterion == "objective function below":
+            text += (
+                " Packmol will be stopped once its objective function is below "
+                f"{P['maximum objective']}."
+            )
+        elif criterion == "minimum distance above":
+            text += (
+                " Packmol will be stopped once the minimum distance between "
+                f"molecules is above {P['stop early minimum distance']}."
+            )
+        elif criterion == "time limit":
+            text += f" Packmol will be stopped after {P['time limit']}."
 
         description += str(__(text, indent=self.indent + 4 * " "))
         return description
@@ -209,6 +492,14 @@ class Packmol(seamm.Node):
         P = self.parameters.current_values_to_dict(
             context=seamm.flowchart_variables._data
         )
+        # Layers and separate regions are each packed on their own, then put in
+        # place in one periodic cell.
+        kind = {
+            "build a layered cell": "layer",
+            "build separate regions": "region",
+        }.get(P["mode"])
+        if kind is not None:
+            P["periodic"] = True
         periodic = P["periodic"]
 
         # Print what we are doing. Have to fix formatting for printing...
@@ -229,9 +520,51 @@ class Packmol(seamm.Node):
 
         # Get the input files and any more output to print
         tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
-        molecules, files, output, cell = Packmol.get_input(
-            P, system_db, tmp_db, seamm.flowchart_variables, ff=ff
-        )
+        summary = {}
+        if kind is not None:
+            make = self._layers if kind == "layer" else self._regions
+            molecules, pieces, output, cell = make(P, system_db, tmp_db, ff, summary)
+            files = {}
+        else:
+            molecules, files, output, cell = Packmol.get_input(
+                P,
+                system_db,
+                tmp_db,
+                seamm.flowchart_variables,
+                ff=ff,
+                summary=summary,
+                n_processes=self.options.get("template_processes", 1),
+                library=self._solvent_library(),
+                cache=self._template_cache(),
+            )
+
+        # How long building the SMILES in 3-D took, which varies with the backend
+        n_embedded = summary["n_embedded"]
+        if n_embedded > 0:
+            backend = summary["embedding"]
+            embedding_time = summary["embedding time"]
+            if backend == "template cache only":
+                output += (
+                    f" The 3-D structures of the {n_embedded} SMILES were taken from "
+                    f"the template cache in {embedding_time:.2f} s."
+                )
+            else:
+                output += (
+                    f" Building the {n_embedded} SMILES in 3-D with {backend} took "
+                    f"{embedding_time:.2f} s"
+                )
+                if summary["n_cached"] > 0:
+                    output += f", with {summary['n_cached']} from the template cache"
+                output += "."
+
+        # A solute in solvent tiled from the library does not need Packmol, and
+        # layers or separate regions are packed on their own and put in place.
+        tiled = "input.inp" not in files
+
+        # The structure is PDB, or xyz if there are large templates
+        filetype = summary["filetype"]
+        structure_file = f"packmol.{filetype}"
+        solute_file = f"solute.{filetype}"
 
         self.logger.log(0, pprint.pformat(files))
 
@@ -279,88 +612,488 @@ class Packmol(seamm.Node):
         # Use the matching version of the seamm-packmol image by default.
         config["version"] = self.version
 
-        result = executor.run(
-            cmd=["{code}", "<", "input.inp", ">", "packmol.out"],
-            config=config,
-            directory=self.directory,
-            files=files,
-            return_files=["packmol.pdb", "packmol.out"],
-            in_situ=True,
-            shell=True,
-        )
+        # Open the history of builds on this host, and predict the resources
+        options = self.options
+        history_file = options.get("history_file", "")
+        if history_file == "" or tiled:
+            history = None
+        else:
+            history = packmol_step.BuildHistory(ini_dir / history_file)
+        if P["predict resources"] != "No" and not tiled:
+            try:
+                self._predict(P, history, summary)
+            except BaseException:
+                if history is not None:
+                    history.close()
+                raise
+
+        # Wait for a free slot if the number of Packmol processes is limited
+        metrics = {}
+        try:
+            if summary["n_embedded"] > 0:
+                metrics["embedding backend"] = summary["embedding"]
+                metrics["embedding time"] = round(summary["embedding time"], 3)
+                metrics["templates from cache"] = summary["n_cached"]
+            limiter = packmol_step.ProcessLimiter(
+                ini_dir / "locks" / "packmol" / socket.gethostname(),
+                max_processes=options.get("max_processes", 0),
+                cores_per_process=options.get("cores_per_process", 0),
+            )
 
-        if not result:
-            self.logger.error("There was an error running Packmol")
-            return None
+            # Run in local scratch space if requested, to spare the shared filesystem
+            scratch = "" if tiled else options.get("scratch_directory", "")
+            patterns = options.get("scratch_return_files", structure_file).split()
+            if scratch == "":
+                work_dir = Path(self.directory)
+            else:
+                scratch = Path(os.path.expandvars(scratch)).expanduser()
+                scratch.mkdir(parents=True, exist_ok=True)
+                work_dir = Path(tempfile.mkdtemp(prefix="packmol_", dir=scratch))
 
-        self.logger.debug(pprint.pformat(result))
+            # Clean up the scratch directory however Packmol finishes
+            try:
+                # Checkpoint the packing so that it can be resumed if the job stops
+                interval = 0 if tiled else options.get("checkpoint_interval", 0)
+                if interval > 0:
+                    metrics["resumed"] = self._checkpoint(
+                        files, interval, scratch != ""
+                    )
+
+                # Stop Packmol once the packing is good enough, if requested
+                monitor = None
+                if P["stop early"] != "No" and not tiled:
+                    monitor = self._monitor(
+                        P,
+                        files,
+                        work_dir,
+                        structure_file,
+                        config.get("code", "packmol"),
+                        summary,
+                    )
+
+                batch_size = options.get("ingest_batch_size", 0)
+                if tiled:
+                    t0 = time.perf_counter()
+                    if kind is not None:
+                        files[structure_file] = self._pack_separately(
+                            executor,
+                            config,
+                            molecules,
+                            pieces,
+                            filetype,
+                            ini_dir,
+                            metrics,
+                            kind,
+                        )
+                    (work_dir / structure_file).write_text(files[structure_file])
+                    result = {
+                        structure_file: {
+                            "data": files[structure_file],
+                            "exception": None,
+                        }
+                    }
+                    metrics["wall time"] = round(time.perf_counter() - t0, 3)
+                else:
+                    with limiter:
+                        if limiter.enabled:
+                            metrics["queue wait time"] = round(limiter.wait_time, 3)
+                            metrics["slot"] = limiter.slot
+                        if limiter.cores is not None:
+                            metrics["cores"] = limiter.cores
+
+                        # In batches the structure is read from the file rather
+                        # than returned by the executor, which would read it all
+                        # into memory. The executor keeps files that existed before
+                        # the run, so create it.
+                        if batch_size > 0:
+                            files[structure_file] = ""
+                            return_files = ["packmol.out"]
+                        else:
+                            return_files = [structure_file, "packmol.out"]
 
-        # Get the bond orders and extra parameters like ff atom types
-        extra_data = {}
-        total_q = 0.0
-        offset = 0
-        i_indices = []
-        j_indices = []
-        bond_orders = []
-        for molecule in molecules:
-            n = molecule["number"]
-            for _ in range(n):
-                for i, j, bond_order in molecule["bonds"]:
-                    i_indices.append(i + offset)
-                    j_indices.append(j + offset)
-                    bond_orders.append(bond_order)
-                offset += molecule["configuration"].n_atoms
-
-            total_q += n * molecule["configuration"].charge
-
-            atoms = molecule["configuration"].atoms
-            for key in atoms.keys():
-                if "atom_types_" in key or "charges" in key:
-                    if key in extra_data:
-                        extra_data[key].extend(atoms.get_column_data(key) * n)
-                    else:
-                        extra_data[key] = atoms.get_column_data(key) * n
-
-        # Remove the temporary database
-        tmp_db.close()
-
-        # Get the system to fill and make sure it is empty
-        system, configuration = self.get_system_configuration(P, same_as=None)
-        configuration.clear()
-        configuration.charge = total_q
-
-        # Create the configuration from the PDB output of Packmol
-        configuration.coordinate_system = "Cartesian"
-        configuration.from_pdb_text(result["packmol.pdb"]["data"])
-
-        ids = configuration.atoms.ids
-        i_atoms = [ids[x] for x in i_indices]
-        j_atoms = [ids[x] for x in j_indices]
-        configuration.bonds.append(i=i_atoms, j=j_atoms, bondorder=bond_orders)
-
-        # And set the extra data we saved earlier.
-        for key, values in extra_data.items():
-            if key not in configuration.atoms:
-                if "atom_types_" in key:
-                    configuration.atoms.add_attribute(key, coltype="str")
-                elif "charges" in key:
-                    configuration.atoms.add_attribute(key, coltype="float")
+                        t0 = time.perf_counter()
+                        if "coarse.inp" in files:
+                            self._coarse_stage(
+                                executor, config, work_dir, files, metrics
+                            )
+                        memory = packmol_step.PeakMemory(
+                            work_dir, code=config.get("code", "packmol")
+                        )
+                        memory.start()
+                        if monitor is not None:
+                            monitor.start()
+                        try:
+                            result = executor.run(
+                                cmd=["{code}", "<", "input.inp", ">", "packmol.out"],
+                                config=config,
+                                directory=work_dir,
+                                files=files,
+                                return_files=return_files,
+                                in_situ=True,
+                                shell=True,
+                                env=packmol_env,
+                            )
+                        finally:
+                            if monitor is not None:
+                                monitor.finish()
+                            rss = memory.finish()
+
+                        # Use the copy of the structure that was checked, since Packmol
+                        # may have been stopped while writing a newer one.
+                        if monitor is not None and monitor.copy is not None:
+                            os.replace(monitor.copy, work_dir / structure_file)
+                            if result and structure_file in result:
+                                text = (work_dir / structure_file).read_text()
+                                result[structure_file]["data"] = text
+                        metrics["wall time"] = round(time.perf_counter() - t0, 3)
+                        if rss is not None:
+                            metrics["peak RSS"] = rss
+            except BaseException:
+                # Keep the log and whatever else there is to see what went wrong
+                if scratch != "":
+                    packmol_step.copy_back(
+                        work_dir,
+                        self.directory,
+                        [*patterns, "packmol.out"],
+                        compress=options.get("scratch_compress", "no"),
+                    )
+                raise
+            else:
+                if scratch != "":
+                    metrics.update(
+                        packmol_step.copy_back(
+                            work_dir,
+                            self.directory,
+                            patterns,
+                            compress=options.get("scratch_compress", "no"),
+                        )
+                    )
+            finally:
+                if scratch != "":
+                    shutil.rmtree(work_dir, ignore_errors=True)
+
+            if limiter.enabled and limiter.wait_time >= 1.0:
+                printer.important(
+                    f"    Waited {limiter.wait_time:.1f} s for one of the "
+                    f"{limiter.max_processes} Packmol slots on this host."
+                )
+
+            if scratch != "":
+                printer.important(
+                    f"    Ran Packmol in {scratch}, keeping "
+                    f"{metrics['bytes kept off the step directory']:,} bytes off the "
+                    "step directory. Copying back "
+                    f"{metrics['bytes copied back']:,} bytes took "
+                    f"{metrics['copy back time']:.2f} s."
+                )
+
+            # The quality of the packing that was achieved
+            log = ""
+            if result and "packmol.out" in result:
+                log = result["packmol.out"]["data"] or ""
+            progress = packmol_step.parse_output(log, summary.get("tolerance", 2.0))
+            stopped = monitor is not None and monitor.stopped
+            if stopped:
+                quality = monitor.accepted
+            else:
+                quality = {
+                    "function value": progress.get("final function value"),
+                    "minimum distance": progress.get("minimum distance"),
+                    "constraint violation": progress.get("final constraint violation"),
+                }
+            metrics["stopped early"] = stopped
+            if quality is not None:
+                for key in (
+                    "function value",
+                    "minimum distance",
+                    "constraint violation",
+                ):
+                    if quality.get(key) is not None:
+                        metrics[key] = quality[key]
+
+            # Record the build in the history
+            if history is not None:
+                history.record(
+                    {
+                        **summary,
+                        "packmol_version": progress.get("version"),
+                        "wall_time": metrics["wall time"],
+                        "peak_rss": metrics.get("peak RSS"),
+                        "converged": progress["converged"] is True,
+                        "resumed": metrics.get("resumed", False),
+                        "stopped_early": stopped,
+                        "coarse_grained": "coarse-grained time" in metrics,
+                    }
+                )
+
+            if stopped:
+                if quality is None:
+                    raise RuntimeError(
+                        f"Packmol was stopped because {monitor.reason} before it wrote "
+                        "a structure."
+                    )
+                printer.important(
+                    f"    Stopped Packmol after loop {quality['loop']} because "
+                    f"{monitor.reason}. The objective function is "
+                    f"{quality.get('function value', float('nan')):.3g} and the "
+                    "minimum distance between molecules is "
+                    f"{quality.get('minimum distance', float('nan')):.2f} Å.\n"
+                )
+
+            if not result:
+                self.logger.error("There was an error running Packmol")
+                if options.get("keep_files", "always") == "never":
+                    metrics["bytes removed"] = packmol_step.remove_artifacts(
+                        self.directory
+                    )
+                else:
+                    self._archive(options, metrics)
+                return None
+
+            self.logger.debug(pprint.pformat(result))
+
+            # Record the templates, so each atom can be labeled with its molecule and
+            # template, sparing later steps from finding the molecules from the bonds.
+            packmol_step.register_templates(system_db, molecules)
+
+            # The templates are needed to swap molecules for a series of compositions
+            compositions = packmol_step.parse_compositions(P["composition series"])
+            if len(compositions) > 0:
+                templates = [
+                    {
+                        **packmol_step.template_arrays(
+                            molecule["configuration"], bonds=False
+                        ),
+                        "bonds": molecule["bonds"],
+                    }
+                    for molecule in molecules
+                ]
+
+            if batch_size > 0:
+                system, configuration = self._ingest(
+                    P, system_db, molecules, files, cell, batch_size, metrics, filetype
+                )
+                tmp_db.close()
+            else:
+                # Get the bond orders and extra parameters like ff atom types
+                extra_data = {}
+                total_q = 0.0
+                offset = 0
+                i_indices = []
+                j_indices = []
+                bond_orders = []
+                adding = P["mode"] == "add to the current configuration"
+                n_existing = 0
+                numbered = []
+                for molecule in molecules:
+                    if adding and molecule["type"] == "solute":
+                        # The atoms of the current configuration are already there,
+                        # and not in Packmol's structure if it only saw spheres.
+                        if solute_file not in files:
+                            n_existing = molecule["configuration"].n_atoms
+                        continue
+                    n = molecule["number"]
+                    for _ in range(n):
+                        for i, j, bond_order in molecule["bonds"]:
+                            i_indices.append(i + offset)
+                            j_indices.append(j + offset)
+                            bond_orders.append(bond_order)
+                        offset += molecule["configuration"].n_atoms
+
+                    total_q += n * molecule["configuration"].charge
+                    numbered.append(molecule)
+
+                    atoms = molecule["configuration"].atoms
+                    for key in atoms.keys():
+                        if "atom_types_" in key or "charges" in key:
+                            if key in extra_data:
+                                extra_data[key].extend(atoms.get_column_data(key) * n)
+                            else:
+                                extra_data[key] = atoms.get_column_data(key) * n
+
+                # Remove the temporary database
+                tmp_db.close()
+
+                if adding:
+                    # Append only the new atoms and bonds to the current configuration
+                    system = system_db.system
+                    configuration = system.configuration
+                    extra_data.update(
+                        packmol_step.molecule_columns(
+                            numbered, first=packmol_step.next_molecule(configuration)
+                        )
+                    )
+                    packmol_step.append_atoms(
+                        configuration,
+                        result[structure_file]["data"],
+                        n_existing,
+                        offset,
+                        charge=total_q,
+                        bonds=(i_indices, j_indices, bond_orders),
+                        columns=extra_data,
+                        filetype=filetype,
+                    )
                 else:
-                    raise RuntimeError(f"Can't handle extra column '{key}'")
-            configuration.atoms.get_column(key)[:] = values
+                    # Get the system to fill and make sure it is empty
+                    system, configuration = self.get_system_configuration(
+                        P, same_as=None
+                    )
+                    configuration.clear()
+                    configuration.charge = total_q
+                    extra_data.update(packmol_step.molecule_columns(numbered))
+
+                    # Create the configuration from the output of Packmol
+                    text = result[structure_file]["data"]
+                    if solute_file in files:
+                        text = "".join(
+                            packmol_step.with_solute(
+                                files[solute_file],
+                                text.splitlines(keepends=True),
+                                filetype=filetype,
+                            )
+                        )
+                    if periodic or filetype != "pdb":
+                        # by convention we keep periodic systems in fractional
+                        # coordinates, so convert Packmol's before writing them once.
+                        if periodic:
+                            configuration.periodicity = 3
+                            a, b, c = cell
+                            configuration.cell.parameters = (a, b, c, 90.0, 90.0, 90.0)
+                            configuration.coordinate_system = "fractional"
+                        else:
+                            configuration.periodicity = 0
+                            configuration.coordinate_system = "Cartesian"
+                        if "name" not in configuration.atoms:
+                            configuration.atoms.add_attribute("name", coltype="str")
+                        lines = list(
+                            packmol_step.atom_lines(text.splitlines(), filetype)
+                        )
+                        configuration.atoms.append(
+                            **packmol_step.atom_data(
+                                lines, cell if periodic else None, filetype=filetype
+                            )
+                        )
+                    else:
+                        configuration.coordinate_system = "Cartesian"
+                        configuration.from_pdb_text(text)
+
+                    if configuration.n_atoms != offset:
+                        raise RuntimeError(
+                            f"Packmol's structure has {configuration.n_atoms} atoms "
+                            f"rather than {offset}. It may have been stopped while "
+                            "writing it."
+                        )
 
-        # Finally, make periodic of correct size
-        if periodic:
-            configuration.periodicity = 3
-            a, b, c = cell
-            configuration.cell.parameters = (a, b, c, 90.0, 90.0, 90.0)
-            # by convention we keep periodic systems in fractional coordinates
-            xyz = configuration.atoms.get_coordinates(fractionals=False)
-            configuration.coordinate_system = "fractional"
-            configuration.atoms.set_coordinates(xyz, fractionals=False)
+                    ids = configuration.atoms.ids
+                    i_atoms = [ids[x] for x in i_indices]
+                    j_atoms = [ids[x] for x in j_indices]
+                    configuration.bonds.append(
+                        i=i_atoms, j=j_atoms, bondorder=bond_orders
+                    )
+
+                    # And set the extra data we saved earlier.
+                    for key, values in extra_data.items():
+                        if key not in configuration.atoms:
+                            if "atom_types_" in key:
+                                configuration.atoms.add_attribute(key, coltype="str")
+                            elif "charges" in key:
+                                configuration.atoms.add_attribute(key, coltype="float")
+                            elif key in ("molecule", "template"):
+                                configuration.atoms.add_attribute(key, coltype="int")
+                            else:
+                                raise RuntimeError(f"Can't handle extra column '{key}'")
+                        configuration.atoms.get_column(key)[:] = values
+
+            # Make the rest of a series of densities by compressing the packed box
+            if len(packmol_step.parse_densities(P["density series"])) > 0:
+                output += self._density_series(
+                    P,
+                    executor,
+                    config,
+                    configuration,
+                    molecules,
+                    files,
+                    summary,
+                    metrics,
+                )
 
-        printer.important(__(output, indent=4 * " "))
-        printer.important("")
+            # Make the rest of a series of compositions by swapping molecules
+            if len(compositions) > 0:
+                output += self._composition_series(
+                    P,
+                    executor,
+                    config,
+                    configuration,
+                    molecules,
+                    templates,
+                    files,
+                    compositions,
+                    summary,
+                    metrics,
+                )
+
+            # Save the results as requested
+            data = {
+                "number of atoms": summary["n_atoms"],
+                "number of molecules": summary["n_molecules"],
+                "density": summary["density"],
+                "number of loops": len(progress["loops"]),
+                "objective function": metrics.get("function value"),
+                "constraint violation": metrics.get("constraint violation"),
+                "minimum distance": metrics.get("minimum distance"),
+                "converged": progress["converged"] is True,
+                "stopped early": stopped,
+                "running time": progress.get("running time"),
+                "wall time": metrics["wall time"],
+            }
+            self.store_results(
+                configuration=configuration,
+                data=data,
+                create_tables=P["create tables"],
+                printer=printer,
+            )
+
+            if kind is None:
+                text = f"\nPackmol ran {data['number of loops']} loops"
+                if data["running time"] is not None:
+                    text += f" in {data['running time']:.1f} s"
+                if data["objective function"] is not None:
+                    text += (
+                        f". The objective function is {data['objective function']:.3g}"
+                    )
+                if data["minimum distance"] is not None:
+                    text += (
+                        " and the minimum distance between molecules is "
+                        f"{data['minimum distance']:.2f} Å"
+                    )
+                output += text + "."
+
+            printer.important(__(output, indent=4 * " "))
+            printer.important("")
+
+            # The checkpoint is no longer needed
+            if interval > 0:
+                shutil.rmtree(Path(self.directory) / "checkpoint", ignore_errors=True)
+
+            # Keep, compress or remove the files in the step directory
+            if options.get("coordinates_file", "no") == "npz":
+                packmol_step.save_coordinates(
+                    Path(self.directory) / "packmol.npz",
+                    configuration.atoms.get_coordinates(fractionals=False),
+                    configuration.atoms.symbols,
+                    cell=cell if periodic else None,
+                )
+            if options.get("keep_files", "always") == "always":
+                self._archive(options, metrics)
+            else:
+                metrics["bytes removed"] = packmol_step.remove_artifacts(self.directory)
+        finally:
+            if history is not None:
+                history.close()
+
+            # Save the metrics for this step, whether or not Packmol succeeded
+            path = Path(self.directory) / "metrics.json"
+            path.write_text(json.dumps(metrics, indent=4))
 
         # Since we have succeeded, add the citation.
 
@@ -374,9 +1107,1399 @@ class Packmol(seamm.Node):
 
         return next_node
 
+    def _checkpoint(self, files, interval, absolute):
+        """Set up checkpointing, resuming from an earlier checkpoint if possible.
+
+        Packmol writes its restart file to checkpoint/packmol.restart in the step
+        directory, and the input and templates are kept next to it. If this step
+        was stopped before and the input is unchanged, Packmol restarts from
+        that file using the same templates, rather than packing from scratch. A
+        resumed packing does not start from a coarse-grained packing again.
+
+        Parameters
+        ----------
+        files : dict(str, str)
+            The input files for Packmol, which are updated.
+        interval : int
+            The number of Packmol loops between checkpoints.
+        absolute : bool
+            Whether to use the absolute path to the checkpoint, which is needed
+            if Packmol is not running in the step directory.
+
+        Returns
+        -------
+        bool
+            Whether the packing is resumed from a checkpoint.
+        """
+        checkpoint = Path(self.directory) / "checkpoint"
+        restart = checkpoint / "packmol.restart"
+        path = str(restart.resolve()) if absolute else "checkpoint/packmol.restart"
+        templates = [name for name in files if name != "input.inp"]
+
+        inp = checkpoint / "input.inp"
+        resume = (
+            restart.exists()
+            and inp.exists()
+            and inp.read_text() == files["input.inp"]
+            and all((checkpoint / name).exists() for name in templates)
+        )
+        if resume:
+            # Use the same templates, which the restart file refers to
+            for name in templates:
+                files[name] = (checkpoint / name).read_text()
+
+            # The checkpoint replaces the start from a coarse-grained packing, so
+            # skip that stage and its restart file for each structure
+            for name in templates:
+                if name == "coarse.inp" or name.startswith("coarse_"):
+                    del files[name]
+            files["input.inp"] = "\n".join(
+                line
+                for line in files["input.inp"].splitlines()
+                if not line.strip().startswith("restart_from ")
+            )
+            printer.important(
+                f"    Resuming Packmol from the checkpoint in {checkpoint}.\n"
+            )
+        else:
+            shutil.rmtree(checkpoint, ignore_errors=True)
+            checkpoint.mkdir(parents=True)
+            for name, text in files.items():
+                (checkpoint / name).write_text(text)
+
+        _set_writeout(files, interval)
+        lines = files["input.inp"].splitlines()
+        first = next(i for i, line in enumerate(lines) if line.startswith("structure"))
+        extra = [f"restart_to {path}"]
+        if resume:
+            extra.append(f"restart_from {path}")
+        lines[first:first] = extra
+        lines.append("")
+        files["input.inp"] = "\n".join(lines)
+
+        return resume
+
+    def _coarse_stage(self, executor, config, directory, files, metrics):
+        """Pack each molecule as a pseudo-atom, to start the atomistic packing.
+
+        The centers of the molecules from Packmol's restart files are given random
+        orientations and become the restart files for the atomistic packing.
+
+        Parameters
+        ----------
+        executor : seamm_exec.Base
+            The executor for Packmol.
+        config : dict(str, str)
+            The configuration for running Packmol.
+        directory : pathlib.Path
+            The directory where Packmol runs.
+        files : dict(str, str)
+            The input files for Packmol. The restart files are added.
+        metrics : dict(str, any)
+            The metrics for the step, which are updated.
+        """
+        restarts = [
+            Path(name).with_suffix(".restart").name
+            for name in files
+            if name.startswith("coarse_") and name.endswith((".pdb", ".xyz"))
+        ]
+
+        t0 = time.perf_counter()
+        result = executor.run(
+            cmd=["{code}", "<", "coarse.inp", ">", "coarse.out"],
+            config=config,
+            directory=directory,
+            files=files,
+            return_files=["coarse.out", *restarts],
+            in_situ=True,
+            shell=True,
+            env=packmol_env,
+        )
+        if not result:
+            raise RuntimeError("There was an error in the coarse-grained packing.")
+        for name in restarts:
+            text = result[name]["data"]
+            if text is None:
+                raise RuntimeError(
+                    f"The coarse-grained packing did not write the restart file {name}."
+                )
+            if isinstance(text, bytes):
+                text = text.decode()
+            files[name.replace("coarse_", "input_")] = (
+                packmol_step.randomize_orientations(text)
+            )
+        metrics["coarse-grained time"] = round(time.perf_counter() - t0, 3)
+
+        printer.important(
+            "    Packed the molecules as spheres in "
+            f"{metrics['coarse-grained time']:.1f} s.\n"
+        )
+
+    def _composition_series(
+        self,
+        P,
+        executor,
+        config,
+        configuration,
+        molecules,
+        templates,
+        files,
+        compositions,
+        summary,
+        metrics,
+    ):
+        """Make the boxes with the other compositions by swapping molecules.
+
+        Molecules of components with too many molecules are replaced by ones of
+        components with too few, pairing the most similar sizes, and each new
+        molecule is placed on the center and principal axes of the old one. New
+        molecules that overlap their neighbors are repacked by Packmol, with the
+        rest fixed. Each composition is a new configuration in the same system.
+
+        Parameters
+        ----------
+        P : dict(str, any)
+            The control parameters for the step.
+        executor : seamm_exec.Base
+            The executor for Packmol.
+        config : dict(str, str)
+            The configuration for running Packmol.
+        configuration : molsystem._Configuration
+            The packed configuration.
+        molecules : [dict]
+            The molecules in the order that Packmol wrote them.
+        templates : [dict(str, any)]
+            The templates of the molecules, from template_arrays.
+        files : dict(str, str)
+            The input files for Packmol, including the templates.
+        compositions : [[float]]
+            The relative amounts of the components in each composition.
+        summary : dict(str, any)
+            The summary of the build from get_input.
+        metrics : dict(str, any)
+            The metrics for the step, which are updated.
+
+        Returns
+        -------
+        str
+            The description of the series for the output.
+        """
+        t0 = time.perf_counter()
+        numbers = [max(0, molecule["number"]) for molecule in molecules]
+        sizes = [
+            packmol_step.radius_of_gyration(template["xyz"]) for template in templates
+        ]
+        cell = np.array(configuration.cell.parameters[0:3])
+        distance = P["series minimum distance"].to("Å").magnitude
+
+        # The coordinates of the molecules of each component
+        xyz0 = np.array(configuration.atoms.get_coordinates(fractionals=False))
+        blocks = []
+        start = 0
+        for n, template in zip(numbers, templates):
+            n_atoms = len(template["atno"])
+            blocks.append(xyz0[start : start + n * n_atoms].reshape(n, n_atoms, 3))
+            start += n * n_atoms
+
+        # Make sure the attributes of the atoms exist for all the components
+        atoms = configuration.atoms
+        for template in templates:
+            for key in template["columns"]:
+                if key not in atoms:
+                    coltype = "str" if "atom_types_" in key else "float"
+                    atoms.add_attribute(key, coltype=coltype)
+        tids = [molecule["template id"] for molecule in molecules]
+
+        system = configuration.system
+        table = {"Composition": [], "Numbers": [], "Swapped": [], "Repacked": []}
+        n_repacked = 0
+        n_swapped = 0
+        for i, composition in enumerate(compositions, start=1):
+            new_numbers = packmol_step.composition_numbers(sum(numbers), composition)
+
+            # Replace evenly spread molecules of each giving component
+            kept = [np.ones(n, dtype=bool) for n in numbers]
+            added = [[] for _ in numbers]
+            given = [0] * len(numbers)
+            surplus = [max(0, o - n) for o, n in zip(numbers, new_numbers)]
+            chosen = [
+                np.linspace(0, n - 1, k).round().astype(int) if k > 0 else []
+                for n, k in zip(numbers, surplus)
+            ]
+            for j, k, n in packmol_step.swaps(numbers, new_numbers, sizes):
+                which = chosen[j][given[j] : given[j] + n]
+                given[j] += n
+                kept[j][which] = False
+                added[k].append(
+                    packmol_step.superpose(templates[k]["xyz"], blocks[j][which])
+                )
+
+            new_blocks = []
+            swapped = []
+            for block, keep, extra in zip(blocks, kept, added):
+                new_blocks.append(np.concatenate([block[keep], *extra]))
+                swapped.append(
+                    np.repeat(
+                        np.arange(len(new_blocks[-1])) >= keep.sum(), block.shape[1]
+                    )
+                )
+            xyz = np.concatenate([b.reshape(-1, 3) for b in new_blocks])
+            swapped = np.concatenate(swapped)
+            n_new = int(sum(surplus))
+            n_swapped += n_new
+
+            # Repack the new molecules that overlap others
+            new_molecules = [
+                {"n_atoms": len(template["atno"]), "number": n}
+                for template, n in zip(templates, new_numbers)
+            ]
+            index = packmol_step.molecule_index(new_molecules)
+            moving = np.zeros(len(xyz), dtype=bool)
+            if swapped.any():
+                close = packmol_step.close_atoms(
+                    xyz[swapped],
+                    xyz,
+                    distance,
+                    box=cell,
+                    labels=(index[swapped], index),
+                )
+                moving = np.isin(index, index[swapped][close])
+            n_moving = len(np.unique(index[moving]))
+            if n_moving > 0:
+                xyz = self._repack(
+                    executor,
+                    config,
+                    new_molecules,
+                    files,
+                    xyz,
+                    moving,
+                    cell,
+                    summary["tolerance"],
+                    f"composition_{i}",
+                    filetype=summary["filetype"],
+                )
+                n_repacked += n_moving
+
+            name = ":".join(f"{x:g}" for x in composition)
+            new = system.create_configuration(
+                name=f"{configuration.name} {name}",
+                periodicity=3,
+                coordinate_system="fractional",
+                cell_parameters=(*cell.tolist(), 90.0, 90.0, 90.0),
+                make_current=False,
+            )
+            fractional = xyz / cell
+            data = {
+                "x": fractional[:, 0].tolist(),
+                "y": fractional[:, 1].tolist(),
+                "z": fractional[:, 2].tolist(),
+                "atno": [],
+                **{key: [] for template in templates for key in template["columns"]},
+            }
+            i_atoms = []
+            j_atoms = []
+            bond_orders = []
+            charge = 0.0
+            offset = 0
+            for template, n in zip(templates, new_numbers):
+                n_atoms = len(template["atno"])
+                data["atno"].extend(template["atno"] * n)
+                for key in data.keys() - {"x", "y", "z", "atno"}:
+                    values = template["columns"].get(key, [None] * n_atoms)
+                    data[key].extend(values * n)
+                for copy in range(offset, offset + n * n_atoms, n_atoms):
+                    for ii, jj, bond_order in template["bonds"]:
+                        i_atoms.append(copy + ii)
+                        j_atoms.append(copy + jj)
+                        bond_orders.append(bond_order)
+                charge += n * template["charge"]
+                offset += n * n_atoms
+            data.update(
+                packmol_step.molecule_columns(
+                    [{**m, "template id": tid} for m, tid in zip(new_molecules, tids)]
+                )
+            )
+            ids = new.atoms.append(**data)
+            if len(i_atoms) > 0:
+                new.bonds.append(
+                    i=[ids[x] for x in i_atoms],
+                    j=[ids[x] for x in j_atoms],
+                    bondorder=bond_orders,
+                )
+            new.charge = charge
+
+            table["Composition"].append(name)
+            table["Numbers"].append(":".join(str(n) for n in new_numbers))
+            table["Swapped"].append(n_new)
+            table["Repacked"].append(n_moving)
+
+        metrics["composition series time"] = round(time.perf_counter() - t0, 3)
+        metrics["molecules swapped"] = n_swapped
+        metrics["molecules repacked"] = n_repacked
+
+        text = (
+            f"\n\nMade boxes with {len(compositions)} other compositions by swapping "
+            "molecules in the packed box in "
+            f"{metrics['composition series time']:.2f} s, repacking the new "
+            "molecules that overlapped with Packmol:\n\n"
+        )
+        text_lines = tabulate(
+            table,
+            headers="keys",
+            tablefmt="psql",
+            colalign=("left", "left", "right", "right"),
+        )
+        return text + textwrap.indent(text_lines, 4 * " ") + "\n"
+
+    def _density_series(
+        self, P, executor, config, configuration, molecules, files, summary, metrics
+    ):
+        """Make the boxes at the other densities by compressing the packed box.
+
+        Each new configuration is in the same system and shares the atoms and bonds
+        of the packed one, so only its cell and coordinates are written. Molecules
+        that overlap after compressing are repacked by Packmol, with the rest fixed.
+
+        Parameters
+        ----------
+        P : dict(str, any)
+            The control parameters for the step.
+        executor : seamm_exec.Base
+            The executor for Packmol.
+        config : dict(str, str)
+            The configuration for running Packmol.
+        configuration : molsystem._Configuration
+            The packed configuration, at the lowest density.
+        molecules : [dict]
+            The molecules in the order that Packmol wrote them.
+        files : dict(str, str)
+            The input files for Packmol, including the templates.
+        summary : dict(str, any)
+            The summary of the build from get_input.
+        metrics : dict(str, any)
+            The metrics for the step, which are updated.
+
+        Returns
+        -------
+        str
+            The description of the series for the output.
+        """
+        packed = summary["density"]
+        units = P["density"].units
+        densities = [P["density"].m_as("g/ml")]
+        densities.extend(
+            Q_(x, units).m_as("g/ml")
+            for x in packmol_step.parse_densities(P["density series"])
+        )
+        densities = sorted({x for x in densities if x > packed * (1 + 1.0e-6)})
+
+        t0 = time.perf_counter()
+        index = packmol_step.molecule_index(molecules)
+        masses = configuration.atoms.atomic_masses
+        xyz0 = np.array(configuration.atoms.get_coordinates(fractionals=False))
+        cell0 = np.array(configuration.cell.parameters[0:3])
+        distance = P["series minimum distance"].to("Å").magnitude
+        system = configuration.system
+
+        table = {"Density (g/mL)": [], "Cell (Å)": [], "Repacked": []}
+        n_repacked = 0
+        for i, density in enumerate(densities, start=1):
+            factor = (packed / density) ** (1 / 3)
+            cell = cell0 * factor
+            xyz = packmol_step.compress(xyz0, index, masses, factor)
+            clash = packmol_step.clashing_molecules(xyz, index, distance, cell)
+            if clash.any():
+                xyz = self._repack(
+                    executor,
+                    config,
+                    molecules,
+                    files,
+                    xyz,
+                    clash[index],
+                    cell,
+                    summary["tolerance"],
+                    f"series_{i}",
+                    filetype=summary["filetype"],
+                )
+                n_repacked += int(clash.sum())
+
+            new = system.create_configuration(
+                name=f"{configuration.name} at {density:.4f} g/mL",
+                periodicity=3,
+                coordinate_system="fractional",
+                cell_parameters=(*cell.tolist(), 90.0, 90.0, 90.0),
+                atomset=configuration.atomset,
+                bondset=configuration.bondset,
+                make_current=False,
+            )
+            new.atoms.set_coordinates(xyz / cell, fractionals=True)
+            new.charge = configuration.charge
+
+            table["Density (g/mL)"].append(f"{density:.4f}")
+            table["Cell (Å)"].append(" x ".join(f"{x:.3f}" for x in cell))
+            table["Repacked"].append(int(clash.sum()))
+
+        metrics["density series time"] = round(time.perf_counter() - t0, 3)
+        metrics["molecules repacked"] = n_repacked
+
+        text = (
+            f"\n\nMade boxes at {len(densities)} higher densities by compressing the "
+            f"packed box in {metrics['density series time']:.2f} s, repacking the "
+            "molecules that overlapped with Packmol:\n\n"
+        )
+        text_lines = tabulate(
+            table, headers="keys", tablefmt="psql", colalign=("right", "left", "right")
+        )
+        return text + textwrap.indent(text_lines, 4 * " ") + "\n"
+
+    def _ingest(
+        self, P, system_db, molecules, files, cell, batch_size, metrics, filetype
+    ):
+        """Read the structure from Packmol in batches into the configuration.
+
+        Parameters
+        ----------
+        P : dict(str, any)
+            The control parameters for the step.
+        system_db : molsystem.SystemDB
+            The system database.
+        molecules : [dict]
+            The molecules from get_input, in the order Packmol wrote them.
+        files : dict(str, str)
+            The input files from get_input, with the solute if Packmol only saw
+            exclusion spheres for it.
+        cell : (float, float, float)
+            The sides of the periodic cell, if any.
+        batch_size : int
+            The approximate number of atoms in each batch.
+        metrics : dict(str, any)
+            The metrics for the step, which are updated.
+        filetype : str
+            The format of Packmol's files, "pdb" or "xyz".
+
+        Returns
+        -------
+        (molsystem._System, molsystem._Configuration)
+            The system and configuration holding the structure.
+        """
+        t0 = time.perf_counter()
+        reset_peak_rss()
+
+        adding = P["mode"] == "add to the current configuration"
+        skip = 0
+        first_molecule = 0
+        if adding:
+            # The atoms of the current configuration are already there, and not
+            # in Packmol's structure if it only saw spheres.
+            if f"solute.{filetype}" not in files:
+                skip = molecules[0]["configuration"].n_atoms
+            molecules = molecules[1:]
+        total_q = sum(m["number"] * m["configuration"].charge for m in molecules)
+
+        if adding:
+            system = system_db.system
+            configuration = system.configuration
+            configuration.charge = configuration.charge + total_q
+            first_molecule = packmol_step.next_molecule(configuration)
+        else:
+            system, configuration = self.get_system_configuration(P, same_as=None)
+            configuration.clear()
+            configuration.charge = total_q
+            if P["periodic"]:
+                # by convention we keep periodic systems in fractional coordinates
+                configuration.periodicity = 3
+                a, b, c = cell
+                configuration.cell.parameters = (a, b, c, 90.0, 90.0, 90.0)
+                configuration.coordinate_system = "fractional"
+            else:
+                configuration.periodicity = 0
+                configuration.coordinate_system = "Cartesian"
+
+        try:
+            fd = packmol_step.open_artifact(self.directory, f"packmol.{filetype}")
+        except FileNotFoundError:
+            raise RuntimeError(
+                f"Packmol did not write its structure, packmol.{filetype}, to the "
+                "step directory. If running in scratch space, it must be one of the "
+                "files copied back."
+            )
+        with fd:
+            lines = fd
+            solute = files.get(f"solute.{filetype}")
+            if solute is not None and not adding:
+                lines = packmol_step.with_solute(solute, fd, filetype=filetype)
+            packmol_step.ingest_pdb(
+                configuration,
+                lines,
+                molecules,
+                batch_size=batch_size,
+                skip=skip,
+                first_molecule=first_molecule,
+                filetype=filetype,
+            )
+
+        metrics["ingestion time"] = round(time.perf_counter() - t0, 3)
+        rss = peak_rss()
+        if rss is not None:
+            metrics["ingestion peak RSS"] = rss
+
+        return system, configuration
+
+    def _combine_summaries(self, P, molecules, summaries, volume, summary):
+        """The summary of a cell built from separately packed layers or regions.
+
+        Parameters
+        ----------
+        P : dict(str, any)
+            The control parameters for the step.
+        molecules : [dict]
+            All the molecules in the cell, with the number of each.
+        summaries : [dict(str, any)]
+            The summaries from get_input for the layers or regions.
+        volume : float
+            The volume of the cell, in Å^3.
+        summary : dict(str, any)
+            The summary of the build, which is filled in for the whole cell.
+
+        Returns
+        -------
+        (int, pint.Quantity)
+            The number of atoms and the density of the cell.
+        """
+        n_atoms = sum(m["number"] * m["n_atoms"] for m in molecules)
+        n_solute_atoms = sum(m["n_atoms"] for m in molecules if m["type"] == "solute")
+        mass = sum(molecule["number"] * molecule["mass"] for molecule in molecules)
+        density = mass / Q_(volume, "Å^3")
+        density.ito("g/ml")
+        summary.update(
+            n_atoms=n_atoms,
+            n_molecules=sum(molecule["number"] for molecule in molecules),
+            n_components=len(molecules),
+            n_solute_atoms=n_solute_atoms,
+            density=density.magnitude,
+            shape="rectangular",
+            periodic=True,
+            tolerance=summaries[0]["tolerance"],
+            filetype=(
+                "xyz" if any(x["filetype"] == "xyz" for x in summaries) else "pdb"
+            ),
+            embedding=P["embedding"],
+            **{
+                key: sum(x[key] for x in summaries)
+                for key in ("embedding time", "n_embedded", "n_cached")
+            },
+        )
+        return n_atoms, density
+
+    def _layers(self, P, system_db, tmp_db, ff, summary):
+        """Create the input for each layer of a layered cell.
+
+        Each layer is packed by Packmol in a periodic cell of its own, as high as
+        the layer plus the interface gap, with the density of the layer. A periodic
+        solute is the solid under the layers and is not packed.
+
+        Parameters
+        ----------
+        P : dict(str, any)
+            The control parameters for the step.
+        system_db : molsystem.SystemDB
+            The system database.
+        tmp_db : molsystem.SystemDB
+            The temporary database for the templates.
+        ff : seamm_ff_util.Forcefield
+            The forcefield to assign, or None.
+        summary : dict(str, any)
+            The summary of the build, which is filled in for the whole cell.
+
+        Returns
+        -------
+        ([dict], [dict], str, (float, float, float))
+            The molecules in the order they are stacked, the layers with the input
+            for Packmol, the text to print, and the sides of the cell.
+        """
+        # The series would only be applied to the whole cell, mixing the layers
+        for key in ("composition series", "density series"):
+            if str(P[key]).strip() != "":
+                raise RuntimeError(
+                    f"A layered cell cannot have a {key}. Give the composition and "
+                    "density of each layer instead."
+                )
+
+        context = seamm.flowchart_variables
+        solute = None
+        fluids = []
+        for molecule in P["molecules"]:
+            component = molecule["component"]
+            if is_expr(component):
+                component = context.value(component)
+            if component == "solute":
+                solute = molecule
+            else:
+                fluids.append(molecule)
+
+        layers = packmol_step.parse_layers(
+            P["layer compositions"],
+            P["layer densities"],
+            P["layer thicknesses"],
+            len(fluids),
+        )
+        gap = P["interface gap"].to("Å").magnitude
+
+        # A periodic solute is the solid under the layers, and sets the cell
+        molecules = []
+        bottom = 0.0
+        if solute is None:
+            a = P["a"].to("Å").magnitude
+            b = P["b"].to("Å").magnitude
+        else:
+            solid = self._solid(P, solute, system_db, tmp_db, ff)
+            a, b, bottom, *angles = solid["configuration"].cell.parameters
+            if any(abs(angle - 90.0) > 1.0e-3 for angle in angles):
+                raise RuntimeError("The solid under the layers must be orthorhombic.")
+            molecules.append(solid)
+
+        offsets, height = packmol_step.layer_offsets(
+            [layer["thickness"] for layer in layers], gap, bottom=bottom
+        )
+
+        layer_summaries = []
+        for layer, offset in zip(layers, offsets):
+            thickness = layer["thickness"]
+            P_layer = {
+                **P,
+                "mode": "build a new configuration",
+                "periodic": True,
+                "shape": "rectangular",
+                "dimensions": "given explicitly",
+                "a": Q_(a, "Å"),
+                "b": Q_(b, "Å"),
+                "c": Q_(thickness + gap, "Å"),
+                "fluid amount": "using the density",
+                "density": Q_(layer["density"], "g/ml"),
+                "density series": "",
+                "composition series": "",
+                "solvation": "packing with Packmol",
+                "molecules": [
+                    {**molecule, "count": str(amount)}
+                    for molecule, amount in zip(fluids, layer["composition"])
+                ],
+            }
+            layer_summary = {}
+            layer_molecules, files, _, _ = Packmol.get_input(
+                P_layer,
+                system_db,
+                tmp_db,
+                context,
+                ff=ff,
+                summary=layer_summary,
+                n_processes=self.options.get("template_processes", 1),
+                cache=self._template_cache(),
+                slab=(gap / 2, gap / 2 + thickness),
+            )
+            layer.update(
+                molecules=layer_molecules,
+                files=files,
+                offset=offset,
+                shift=(0.0, 0.0, offset),
+                filetype=layer_summary["filetype"],
+                n_atoms=layer_summary["n_atoms"],
+                n_molecules=layer_summary["n_molecules"],
+            )
+            layer_summaries.append(layer_summary)
+            molecules.extend(layer_molecules)
+
+        # The whole cell, for the history and results
+        n_atoms, density = self._combine_summaries(
+            P, molecules, layer_summaries, a * b * height, summary
+        )
+
+        string = (
+            f"Created a periodic {a:.4f} x {b:.4f} x {height:.4f} Å cell of "
+            f"{len(layers)} layers"
+        )
+        if solute is not None:
+            string += " on the solid"
+        string += f", {gap:.2f} Å apart.\n\n"
+        table = {
+            "Layer": [],
+            "Bottom (Å)": [],
+            "Thickness (Å)": [],
+            "Density (g/mL)": [],
+            "Molecules": [],
+            "Atoms": [],
+        }
+        for i, (layer, layer_summary) in enumerate(zip(layers, layer_summaries), 1):
+            table["Layer"].append(i)
+            table["Bottom (Å)"].append(f"{layer['offset'] + gap / 2:.2f}")
+            table["Thickness (Å)"].append(f"{layer['thickness']:.2f}")
+            table["Density (g/mL)"].append(f"{layer_summary['density']:.4f}")
+            table["Molecules"].append(layer["n_molecules"])
+            table["Atoms"].append(layer["n_atoms"])
+        text_lines = tabulate(
+            table, headers="keys", tablefmt="psql", colalign=("center",)
+        )
+        string += textwrap.indent(text_lines, 4 * " ")
+        string += f"\n\nThere are a total of {n_atoms} atoms in the cell"
+        string += f" giving a density of {density:.5~P}."
+
+        return molecules, layers, string, (a, b, height)
+
+    def _pack_separately(
+        self, executor, config, molecules, pieces, filetype, ini_dir, metrics, kind
+    ):
+        """Pack the layers or regions at the same time, and put them in place.
+
+        Parameters
+        ----------
+        executor : seamm_exec.Base
+            The executor for Packmol.
+        config : dict(str, str)
+            The configuration for running Packmol.
+        molecules : [dict]
+            The molecules from _layers or _regions, starting with the solid if
+            there is one.
+        pieces : [dict]
+            The layers or regions, with the input for Packmol and the "shift" to
+            their place in the cell.
+        filetype : str
+            The format of the whole structure, "pdb" or "xyz".
+        ini_dir : pathlib.Path
+            The directory with the configuration of Packmol, for the locks.
+        metrics : dict(str, any)
+            The metrics for the step, which are updated.
+        kind : str
+            What the pieces are, "layer" or "region", for the directories, metrics
+            and messages.
+
+        Returns
+        -------
+        str
+            The structure of the whole cell, written as Packmol would, with the
+            solid first if there is one.
+        """
+
+        def pack(i, piece):
+            directory = Path(self.directory) / f"{kind}_{i}"
+            directory.mkdir(parents=True, exist_ok=True)
+            files = dict(piece["files"])
+            structure_file = f"packmol.{piece['filetype']}"
+            # Pinning is for the whole process, so the threads are not pinned
+            limiter = packmol_step.ProcessLimiter(
+                ini_dir / "locks" / "packmol" / socket.gethostname(),
+                max_processes=self.options.get("max_processes", 0),
+            )
+            with limiter:
+                t0 = time.perf_counter()
+                if "coarse.inp" in files:
+                    self._coarse_stage(executor, config, directory, files, {})
+                result = executor.run(
+                    cmd=["{code}", "<", "input.inp", ">", "packmol.out"],
+                    config=config,
+                    directory=directory,
+                    files=files,
+                    return_files=[structure_file, "packmol.out"],
+                    in_situ=True,
+                    shell=True,
+                    env=packmol_env,
+                )
+                t = time.perf_counter() - t0
+            if not result or result[structure_file]["data"] is None:
+                raise RuntimeError(f"There was an error running Packmol for {kind} {i}")
+            text = result[structure_file]["data"]
+            if isinstance(text, bytes):
+                text = text.decode()
+            log = result["packmol.out"]["data"] or ""
+            if isinstance(log, bytes):
+                log = log.decode()
+            return text, log, t
+
+        t0 = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(pieces)) as pool:
+            results = list(pool.map(pack, range(1, len(pieces) + 1), pieces))
+        wall_time = time.perf_counter() - t0
+
+        # The solid first, then each piece shifted to its place, keeping the
+        # molecules in the order Packmol wrote them
+        parts = []
+        if molecules[0]["type"] == "solute":
+            configuration = molecules[0]["configuration"]
+            parts.append(
+                (
+                    packmol_step.template_text(configuration, filetype),
+                    configuration.atoms.get_coordinates(fractionals=False),
+                )
+            )
+        times = []
+        for i, (piece, (text, log, t)) in enumerate(zip(pieces, results), start=1):
+            lines = list(packmol_step.atom_lines(text.splitlines(), piece["filetype"]))
+            _, _, xyz = packmol_step.parse_atoms(lines, piece["filetype"])
+            if len(xyz) != piece["n_atoms"]:
+                raise RuntimeError(
+                    f"Packmol's structure for {kind} {i} has {len(xyz)} atoms rather "
+                    f"than {piece['n_atoms']}."
+                )
+            xyz += piece["shift"]
+            start = 0
+            for molecule in piece["molecules"]:
+                n = molecule["number"] * molecule["n_atoms"]
+                parts.append(
+                    (
+                        packmol_step.template_text(molecule["configuration"], filetype),
+                        xyz[start : start + n],
+                    )
+                )
+                start += n
+            progress = packmol_step.parse_output(log)
+            piece["converged"] = progress["converged"] is True
+            times.append(round(t, 3))
+
+        metrics[f"{kind} times"] = times
+        metrics[f"{kind}s converged"] = [piece["converged"] for piece in pieces]
+        metrics[f"{kind}s wall time"] = round(wall_time, 3)
+
+        printer.important(
+            f"    Packed the {len(pieces)} {kind}s at the same time in "
+            f"{wall_time:.1f} s, the longest taking {max(times):.1f} s and all of "
+            f"them {sum(times):.1f} s.\n"
+        )
+        for i, piece in enumerate(pieces, start=1):
+            if not piece["converged"]:
+                printer.important(
+                    f"    Warning: Packmol did not converge for {kind} {i}.\n"
+                )
+
+        return packmol_step.placed_text(
+            parts, filetype=filetype, remark=f"The {kind}s, each packed by Packmol"
+        )
+
+    def _regions(self, P, system_db, tmp_db, ff, summary):
+        """Create the input for each of several separate regions in one cell.
+
+        Each region, a sphere or box, is packed by Packmol on its own with its
+        composition and density, as a non-periodic region would be. The regions
+        are placed at random in the periodic cell, apart from each other and from
+        their periodic images.
+
+        Parameters
+        ----------
+        P : dict(str, any)
+            The control parameters for the step.
+        system_db : molsystem.SystemDB
+            The system database.
+        tmp_db : molsystem.SystemDB
+            The temporary database for the templates.
+        ff : seamm_ff_util.Forcefield
+            The forcefield to assign, or None.
+        summary : dict(str, any)
+            The summary of the build, which is filled in for the whole cell.
+
+        Returns
+        -------
+        ([dict], [dict], str, (float, float, float))
+            The molecules in the order of the regions, the regions with the input
+            for Packmol, the text to print, and the sides of the cell.
+        """
+        # The series would only be applied to the whole cell, mixing the regions
+        for key in ("composition series", "density series"):
+            if str(P[key]).strip() != "":
+                raise RuntimeError(
+                    f"A build of separate regions cannot have a {key}. Give the "
+                    "composition and density of each region instead."
+                )
+
+        context = seamm.flowchart_variables
+        fluids = []
+        for molecule in P["molecules"]:
+            component = molecule["component"]
+            if is_expr(component):
+                component = context.value(component)
+            if component == "solute":
+                raise RuntimeError("A build of separate regions cannot have a solute.")
+            fluids.append(molecule)
+
+        regions = packmol_step.parse_regions(
+            P["region shapes"],
+            P["region sizes"],
+            P["region compositions"],
+            P["region densities"],
+            len(fluids),
+        )
+        cell = tuple(P[key].to("Å").magnitude for key in ("a", "b", "c"))
+        spacing = P["region spacing"].to("Å").magnitude
+        centers = packmol_step.place_regions(
+            [region["radius"] for region in regions], cell, spacing
+        )
+
+        molecules = []
+        region_summaries = []
+        for region, center in zip(regions, centers):
+            sides = region["sides"]
+            P_region = {
+                **P,
+                "mode": "build a new configuration",
+                "periodic": False,
+                "dimensions": "given explicitly",
+                "fluid amount": "using the density",
+                "density": Q_(region["density"], "g/ml"),
+                "density series": "",
+                "composition series": "",
+                "solvation": "packing with Packmol",
+                "molecules": [
+                    {**molecule, "count": str(amount)}
+                    for molecule, amount in zip(fluids, region["composition"])
+                ],
+            }
+            # Packmol's spheres are around the origin, and boxes start there
+            if region["shape"] == "sphere":
+                P_region["shape"] = "spherical"
+                P_region["diameter"] = Q_(sides[0], "Å")
+                shift = center
+            else:
+                P_region["shape"] = "rectangular"
+                P_region["a"], P_region["b"], P_region["c"] = (
+                    Q_(x, "Å") for x in sides
+                )
+                shift = center - np.array(sides) / 2
+            region_summary = {}
+            region_molecules, files, _, _ = Packmol.get_input(
+                P_region,
+                system_db,
+                tmp_db,
+                context,
+                ff=ff,
+                summary=region_summary,
+                n_processes=self.options.get("template_processes", 1),
+                cache=self._template_cache(),
+            )
+            region.update(
+                molecules=region_molecules,
+                files=files,
+                center=center,
+                shift=shift,
+                filetype=region_summary["filetype"],
+                n_atoms=region_summary["n_atoms"],
+                n_molecules=region_summary["n_molecules"],
+            )
+            region_summaries.append(region_summary)
+            molecules.extend(region_molecules)
+
+        # The whole cell, for the history and results
+        a, b, c = cell
+        n_atoms, density = self._combine_summaries(
+            P, molecules, region_summaries, a * b * c, summary
+        )
+
+        string = (
+            f"Created a periodic {a:.4f} x {b:.4f} x {c:.4f} Å cell with "
+            f"{len(regions)} separate regions, at least {spacing:.2f} Å apart.\n\n"
+        )
+        table = {
+            "Region": [],
+            "Shape": [],
+            "Size (Å)": [],
+            "Center (Å)": [],
+            "Density (g/mL)": [],
+            "Molecules": [],
+            "Atoms": [],
+        }
+        for i, (region, region_summary) in enumerate(zip(regions, region_summaries), 1):
+            table["Region"].append(i)
+            table["Shape"].append(region["shape"])
+            if region["shape"] == "sphere":
+                table["Size (Å)"].append(f"{region['sides'][0]:.1f}")
+            else:
+                table["Size (Å)"].append(
+                    " x ".join(f"{x:.1f}" for x in region["sides"])
+                )
+            table["Center (Å)"].append(", ".join(f"{x:.1f}" for x in region["center"]))
+            table["Density (g/mL)"].append(f"{region_summary['density']:.4f}")
+            table["Molecules"].append(region["n_molecules"])
+            table["Atoms"].append(region["n_atoms"])
+        text_lines = tabulate(
+            table, headers="keys", tablefmt="psql", colalign=("center", "left")
+        )
+        string += textwrap.indent(text_lines, 4 * " ")
+        string += f"\n\nThere are a total of {n_atoms} atoms in the cell"
+        string += f" giving an overall density of {density:.5~P}."
+
+        return molecules, regions, string, cell
+
+    def _solid(self, P, solute, system_db, tmp_db, ff):
+        """The periodic solute under the layers of a layered cell.
+
+        Parameters
+        ----------
+        P : dict(str, any)
+            The control parameters for the step.
+        solute : dict(str, str)
+            The solute in the list of molecules, which must be a periodic
+            configuration.
+        system_db : molsystem.SystemDB
+            The system database.
+        tmp_db : molsystem.SystemDB
+            The temporary database for the templates.
+        ff : seamm_ff_util.Forcefield
+            The forcefield to assign, or None.
+
+        Returns
+        -------
+        dict(str, any)
+            The solute, as in the molecules from get_input.
+        """
+        context = seamm.flowchart_variables
+        source = solute["source"]
+        if is_expr(source):
+            source = context.value(source)
+        definition = solute["definition"]
+        if is_expr(definition):
+            definition = context.value(definition)
+        if source != "configuration":
+            raise RuntimeError(
+                "The solute of a layered cell must be a periodic configuration, the "
+                "solid under the layers."
+            )
+        if definition == "" or definition == "current":
+            source_configuration = system_db.system.configuration
+        elif "/" in definition:
+            sysname, confname = definition.split("/")
+            source_configuration = system_db.get_system(sysname).get_configuration(
+                confname
+            )
+        else:
+            source_configuration = system_db.system.get_configuration(definition)
+        if source_configuration.periodicity != 3:
+            raise RuntimeError(
+                "The solute of a layered cell must be a periodic configuration, the "
+                "solid under the layers."
+            )
+
+        template = packmol_step.template_arrays(source_configuration)
+        name = source_configuration.system.name
+        if ff is not None:
+            ff_key = f"atom_types_{ff.current_forcefield}"
+            columns = template["columns"]
+            if (
+                ff_key not in columns
+                or P["assign forcefield"] == "Always"
+                or any(typ is None for typ in columns[ff_key])
+            ):
+                typed = tmp_db.create_system(name=name).create_configuration(
+                    name="typed"
+                )
+                packmol_step.configuration_from_template(typed, template, bonds=True)
+                ff.assign_forcefield(typed)
+                template = packmol_step.template_arrays(typed)
+        configuration = tmp_db.create_system(name=name).create_configuration(
+            name=source_configuration.name
+        )
+        packmol_step.configuration_from_template(configuration, template)
+        mass = configuration.mass * ureg.g / ureg.mol
+        mass.ito("kg")
+
+        return {
+            "configuration": configuration,
+            "count": 1.0,
+            "type": "solute",
+            "mass": mass,
+            "n_atoms": configuration.n_atoms,
+            "definition": definition,
+            "source": "configuration",
+            "bonds": template["bonds"],
+            "number": 1,
+        }
+
+    def _monitor(self, P, files, directory, structure_file, code, summary):
+        """Set up the monitor that stops Packmol once the packing is good enough.
+
+        Packmol is asked to write the structure after every loop, so that the
+        structure it is stopped at is the one that was checked.
+
+        Parameters
+        ----------
+        P : dict(str, any)
+            The current values of the parameters.
+        files : dict(str, str)
+            The input files for Packmol. The input is changed in place.
+        directory : pathlib.Path
+            The directory where Packmol runs.
+        structure_file : str
+            The name of the structure file that Packmol writes.
+        code : str
+            The command that runs Packmol, to find its process.
+        summary : dict(str, any)
+            The features of this build from get_input.
+
+        Returns
+        -------
+        packmol_step.Monitor
+            The monitor, which has not been started.
+        """
+        criterion = P["stop early"]
+        if criterion == "objective function below":
+            value = P["maximum objective"]
+        elif criterion == "minimum distance above":
+            value = P["stop early minimum distance"].m_as("Å")
+        elif criterion == "time limit":
+            value = P["time limit"].m_as("s")
+        else:
+            raise RuntimeError(f"Do not recognize the criterion '{criterion}'")
+
+        _set_writeout(files, 1)
+
+        return packmol_step.Monitor(
+            directory / "packmol.out",
+            criterion,
+            value,
+            tolerance=summary.get("tolerance", 2.0),
+            structure=directory / structure_file,
+            code=code,
+        )
+
+    def _predict(self, P, history, summary):
+        """Predict the time and memory for Packmol from the history of builds.
+
+        Parameters
+        ----------
+        P : dict(str, any)
+            The current values of the parameters.
+        history : BuildHistory
+            The history of builds on this host, or None if it is not kept.
+        summary : dict(str, any)
+            The features of this build from get_input.
+        """
+        if history is None:
+            printer.important(
+                "    Cannot predict the resources for Packmol because the history "
+                "of builds is turned off.\n"
+            )
+            return
+
+        prediction = history.predict(summary)
+        if prediction is None:
+            printer.important(
+                "    There are no similar builds in the history to predict the "
+                "resources for Packmol.\n"
+            )
+            return
+
+        wall_time = prediction["wall_time"]
+        peak_rss = prediction["peak_rss"]
+        text = f"    Based on {prediction['n']} similar builds, Packmol should take "
+        if wall_time < 120:
+            text += f"about {wall_time:.0f} s"
+        elif wall_time < 7200:
+            text += f"about {wall_time / 60:.0f} min"
+        else:
+            text += f"about {wall_time / 3600:.1f} h"
+        if peak_rss is not None:
+            text += f" and {Q_(peak_rss, 'B').to_compact():~.2P} of memory"
+        text += "."
+
+        over = []
+        time_budget = P["time budget"].m_as("s")
+        if time_budget > 0 and wall_time > time_budget:
+            over.append(f"the time budget of {P['time budget']:~P}")
+        memory_budget = P["memory budget"].m_as("B")
+        if memory_budget > 0 and peak_rss is not None and peak_rss > memory_budget:
+            over.append(f"the memory budget of {P['memory budget']:~P}")
+        if len(over) > 0:
+            text += " This is over " + " and ".join(over) + "."
+        printer.important(text + "\n")
+
+        if len(over) > 0 and P["predict resources"] == "Stop if over budget":
+            raise RuntimeError(
+                "Packmol is predicted to be over " + " and ".join(over) + "."
+            )
+
+    def _repack(
+        self,
+        executor,
+        config,
+        molecules,
+        files,
+        xyz,
+        moving,
+        cell,
+        tolerance,
+        name,
+        filetype="pdb",
+    ):
+        """Repack the overlapping molecules with Packmol, keeping the others fixed.
+
+        Parameters
+        ----------
+        executor : seamm_exec.Base
+            The executor for Packmol.
+        config : dict(str, str)
+            The configuration for running Packmol.
+        molecules : [dict]
+            The molecules in the order of the atoms.
+        files : dict(str, str)
+            The input files for Packmol, including the templates.
+        xyz : numpy.ndarray
+            The Cartesian coordinates of the atoms, n x 3.
+        moving : numpy.ndarray
+            Boolean array, True for the atoms of the molecules to repack.
+        cell : numpy.ndarray
+            The sides of the orthorhombic periodic cell.
+        tolerance : float
+            The tolerance for Packmol, in Å.
+        name : str
+            The stem of the names of the files for this packing.
+        filetype : str
+            The format of the templates, "pdb" or "xyz".
+
+        Returns
+        -------
+        numpy.ndarray
+            The new Cartesian coordinates of the atoms, in the same order.
+        """
+        template = np.repeat(
+            np.arange(len(molecules)),
+            [
+                molecule["n_atoms"] * max(0, molecule["number"])
+                for molecule in molecules
+            ],
+        )
+
+        a, b, c = cell
+        lines = [
+            "seed -1",
+            f"tolerance {tolerance}",
+            f"output {name}.{filetype}",
+            f"filetype {filetype}",
+            f"pbc {a:.4f} {b:.4f} {c:.4f}",
+        ]
+        series_files = {}
+        if not moving.all():
+            series_files[f"{name}_fixed.{filetype}"] = packmol_step.placed_text(
+                [
+                    (
+                        files[f"input_{i}.{filetype}"],
+                        xyz[(template == i - 1) & ~moving],
+                    )
+                    for i in range(1, len(molecules) + 1)
+                ],
+                filetype=filetype,
+                remark="The molecules kept fixed",
+            )
+            lines.append(f"structure {name}_fixed.{filetype}")
+            lines.append("   fixed 0.0 0.0 0.0 0.0 0.0 0.0")
+            lines.append("   number 1")
+            lines.append("end structure")
+        for i, molecule in enumerate(molecules, start=1):
+            n = (
+                int(np.count_nonzero((template == i - 1) & moving))
+                // molecule["n_atoms"]
+            )
+            if n > 0:
+                template_file = f"input_{i}.{filetype}"
+                series_files[template_file] = files[template_file]
+                lines.append(f"structure {template_file}")
+                lines.append(f"   number {n}")
+                lines.append("end structure")
+        lines.append("")
+        series_files[f"{name}.inp"] = "\n".join(lines)
+
+        result = executor.run(
+            cmd=["{code}", "<", f"{name}.inp", ">", f"{name}.out"],
+            config=config,
+            directory=Path(self.directory),
+            files=series_files,
+            return_files=[f"{name}.{filetype}", f"{name}.out"],
+            in_situ=True,
+            shell=True,
+            env=packmol_env,
+        )
+        text = result[f"{name}.{filetype}"]["data"] if result else None
+        if text is None:
+            raise RuntimeError("Packmol did not repack the overlapping molecules.")
+        if isinstance(text, bytes):
+            text = text.decode()
+
+        symbols, xs, ys, zs = packmol_step.pdb_atoms(text, filetype=filetype)
+        if len(symbols) != len(xyz):
+            raise RuntimeError(
+                f"Packmol's repacked structure has {len(symbols)} atoms rather than "
+                f"{len(xyz)}."
+            )
+        # The fixed atoms are first, then the moving ones, each in their order
+        order = np.concatenate((np.flatnonzero(~moving), np.flatnonzero(moving)))
+        new = np.empty_like(xyz)
+        new[order] = np.array((xs, ys, zs)).T
+        return new
+
+    def _solvent_library(self):
+        """The directory of the solvent library, or None if there is none.
+
+        Returns
+        -------
+        pathlib.Path or None
+            The directory, which is relative to the SEAMM root if not absolute.
+        """
+        library = self.options.get("solvent_library", "solvent_library")
+        if library == "":
+            return None
+        root = Path(self.global_options["root"]).expanduser()
+        return root / Path(os.path.expandvars(library)).expanduser()
+
+    def _template_cache(self):
+        """The directory of the cache of embedded structures, or None if none.
+
+        Returns
+        -------
+        pathlib.Path or None
+            The directory, which is relative to the SEAMM root if not absolute.
+        """
+        cache = self.options.get("template_cache", "")
+        if cache == "":
+            return None
+        root = Path(self.global_options["root"]).expanduser()
+        return root / Path(os.path.expandvars(cache)).expanduser()
+
+    def _archive(self, options, metrics):
+        """Compress the files in the step directory if requested.
+
+        Parameters
+        ----------
+        options : dict(str, any)
+            The options for this step.
+        metrics : dict(str, any)
+            The metrics for the step, which are updated.
+        """
+        method = options.get("archive", "no")
+        if method != "no":
+            before, after = packmol_step.archive(self.directory, method=method)
+            metrics["archived bytes"] = before
+            metrics["compressed bytes"] = after
+
     @staticmethod
-    def get_input(P, system_db, tmp_db, context, ff=None):
-        """Create the input for Packmol."""
+    def get_input(
+        P,
+        system_db,
+        tmp_db,
+        context,
+        ff=None,
+        summary=None,
+        n_processes=1,
+        library=None,
+        cache=None,
+        slab=None,
+    ):
+        """Create the input for Packmol.
+
+        If summary is a dictionary, it is filled with the features of the build
+        that are kept in the history of builds. If n_processes is more than 1, the
+        SMILES components are embedded and typed in a pool of that many processes.
+        If the solvent is tiled from a box in the library directory, the files
+        contain only the finished structure, packmol.pdb, and no input for Packmol.
+        The files are PDB, or xyz if any template is too large for PDB. The SMILES
+        are embedded with the backend in P["embedding"], using and adding to the
+        cache directory of embedded structures if it is given, and the most compact
+        of P["conformers"] conformers is used. A slab (z0, z1) keeps the fluid in
+        a periodic cell between those heights, for one layer of a layered cell, and
+        the density is that of the slab.
+        """
 
         # Return the translation from points a to b
         def recenter(a, b):
@@ -437,10 +2560,11 @@ class Packmol(seamm.Node):
         # Need to know if there is a solute
         have_solute = False
 
-        # May need to create molecules.
-        solute_configuration = None
-        molecules = []
-        for molecule in P["molecules"]:
+        # Resolve the definitions of the components, merging any duplicate fluids
+        # into one component so that they share a single template and structure.
+        components = []
+        seen = {}
+        for position, molecule in enumerate(P["molecules"]):
             component = molecule["component"]
             if is_expr(component):
                 component = context.value(component)
@@ -458,29 +2582,124 @@ class Packmol(seamm.Node):
             if count == 0:
                 continue
 
+            if component != "solute":
+                key = (component, source, canonical_definition(source, definition))
+                if key in seen:
+                    seen[key][3] += count
+                    seen[key][4].append((definition, count, position))
+                    continue
+            components.append(
+                [component, source, definition, count, [(definition, count, position)]]
+            )
+            if component != "solute":
+                seen[key] = components[-1]
+
+        # When adding to the current configuration, its atoms are a fixed structure
+        adding = P["mode"] == "add to the current configuration"
+        if adding:
+            if any(component == "solute" for component, *_ in components):
+                raise RuntimeError(
+                    "Cannot have a solute when adding to the current configuration."
+                )
+            if system_db.system.configuration.periodicity != 3:
+                raise RuntimeError(
+                    "Can only add molecules to a periodic configuration."
+                )
+            components.insert(
+                0, ["solute", "configuration", "current", 1.0, [("current", 1.0, -1)]]
+            )
+
+        # Embed the SMILES and assign the forcefield in parallel if requested
+        backend = P["embedding"]
+        conformers = P["conformers"]
+        measure = P["conformer measure"]
+        embedded = []
+        templates = {}
+        if n_processes > 1:
+            templates = packmol_step.prepare_templates(
+                [
+                    definition
+                    for _, source, definition, *_ in components
+                    if source == "SMILES"
+                ],
+                ff=ff,
+                n_processes=n_processes,
+                backend=backend,
+                cache=cache,
+                conformers=conformers,
+                measure=measure,
+            )
+            embedded = [
+                (template["embedded by"], template["embedding time"])
+                for template in templates.values()
+            ]
+
+        # May need to create molecules.
+        solute_configuration = None
+        molecules = []
+        for component, source, definition, count, entries in components:
+            template = None
+            # The current configuration when adding to it is only an obstacle
+            existing = adding and component == "solute"
             if source == "SMILES":
                 tmp_system = tmp_db.create_system(name=definition)
                 tmp_configuration = tmp_system.create_configuration(name="default")
-                tmp_configuration.from_smiles(definition, flavor="openbabel")
-                if ff is not None:
-                    ff.assign_forcefield(tmp_configuration)
+                if definition in templates:
+                    template = templates[definition]
+                    packmol_step.configuration_from_template(
+                        tmp_configuration, template
+                    )
+                else:
+                    t0 = time.perf_counter()
+                    embedded_by = packmol_step.embed(
+                        tmp_configuration,
+                        definition,
+                        backend,
+                        cache,
+                        conformers,
+                        measure,
+                    )
+                    embedded.append((embedded_by, time.perf_counter() - t0))
+                    if ff is not None:
+                        ff.assign_forcefield(tmp_configuration)
             elif source == "configuration":
                 if definition == "" or definition == "current":
-                    tmp_system = system_db.system
-                    tmp_configuration = tmp_system.configuration
+                    source_configuration = system_db.system.configuration
                 else:
                     if "/" in definition:
                         sysname, confname = definition.split("/")
-                        tmp_system = system_db.get_system(sysname)
+                        source_system = system_db.get_system(sysname)
                     else:
                         confname = definition
-                    tmp_configuration = tmp_system.get_configuration(confname)
-                if ff is not None:
-                    if ff_key not in tmp_configuration.atoms or assign_ff_always:
-                        ff.assign_forcefield(tmp_configuration)
-                    else:
-                        if any(typ is None for typ in tmp_configuration.atoms[ff_key]):
-                            ff.assign_forcefield(tmp_configuration)
+                        source_system = system_db.system
+                    source_configuration = source_system.get_configuration(confname)
+                # Work on a copy in the temporary database, made from a read-only
+                # snapshot, so that nothing is written to the system database.
+                template = packmol_step.template_arrays(
+                    source_configuration, bonds=not existing
+                )
+                name = source_configuration.system.name
+                if ff is not None and not existing:
+                    columns = template["columns"]
+                    if (
+                        ff_key not in columns
+                        or assign_ff_always
+                        or any(typ is None for typ in columns[ff_key])
+                    ):
+                        # Typing needs the bonds, so use a second, bonded copy
+                        typed = tmp_db.create_system(name=name).create_configuration(
+                            name="typed"
+                        )
+                        packmol_step.configuration_from_template(
+                            typed, template, bonds=True
+                        )
+                        ff.assign_forcefield(typed)
+                        template = packmol_step.template_arrays(typed)
+                tmp_system = tmp_db.create_system(name=name)
+                tmp_configuration = tmp_system.create_configuration(
+                    name=source_configuration.name
+                )
+                packmol_step.configuration_from_template(tmp_configuration, template)
 
             tmp_mass = tmp_configuration.mass * ureg.g / ureg.mol
             tmp_mass.ito("kg")
@@ -500,12 +2719,15 @@ class Packmol(seamm.Node):
                 fluid_mass += count * tmp_mass
 
             # Keep track of the bonding information to add at end_bond
-            bonds = []
-            index = {_id: i for i, _id in enumerate(tmp_configuration.atoms.ids)}
-            for row in tmp_configuration.bonds.bonds():
-                bonds.append((index[row["i"]], index[row["j"]], row["bondorder"]))
-            tmp_configuration.bonds.clear()
-            tmp_configuration.db.commit()
+            if template is not None:
+                bonds = template["bonds"]
+            else:
+                bonds = []
+                index = {_id: i for i, _id in enumerate(tmp_configuration.atoms.ids)}
+                for row in tmp_configuration.bonds.bonds():
+                    bonds.append((index[row["i"]], index[row["j"]], row["bondorder"]))
+                tmp_configuration.bonds.clear()
+                tmp_configuration.db.commit()
 
             molecules.append(
                 {
@@ -515,7 +2737,9 @@ class Packmol(seamm.Node):
                     "mass": tmp_mass,
                     "n_atoms": tmp_configuration.n_atoms,
                     "definition": definition,
+                    "source": None if existing else source,
                     "bonds": bonds,
+                    "entries": entries,
                 }
             )
 
@@ -556,6 +2780,40 @@ class Packmol(seamm.Node):
                 elif shape == "spherical":
                     center, solute_radius = bounding_sphere(xyzs)
 
+        # A series of densities is made by compressing the box at the lowest one
+        series = packmol_step.parse_densities(P["density series"])
+        if len(series) > 0 and (
+            dimensions != "calculated from the density"
+            or not periodic
+            or shape == "spherical"
+            or adding
+            or solute_configuration is not None
+        ):
+            raise RuntimeError(
+                "A series of densities needs a periodic cell of fluid with the "
+                "dimensions calculated from the density."
+            )
+
+        # A series of compositions is made by swapping molecules in one box
+        compositions = packmol_step.parse_compositions(P["composition series"])
+        if len(compositions) > 0:
+            if (
+                not periodic
+                or adding
+                or solute_configuration is not None
+                or len(series) > 0
+            ):
+                raise RuntimeError(
+                    "A series of compositions needs a periodic cell of fluid, and "
+                    "cannot be combined with a series of densities."
+                )
+            for composition in compositions:
+                if len(composition) != len(molecules):
+                    raise RuntimeError(
+                        f"The composition {composition} does not have an amount for "
+                        f"each of the {len(molecules)} components."
+                    )
+
         # Work out the dimensions of the region
         if dimensions == "given explicitly":
             if shape == "cubic":
@@ -639,7 +2897,9 @@ class Packmol(seamm.Node):
                 a, b, c = sides
                 if shape == "cubic":
                     a = max(a, b, c)
-                    if periodic:
+                    if periodic_solute:
+                        volume = a**3
+                    elif periodic:
                         volume = (a + thickness) ** 3
                         a += thickness
                         b = c = a
@@ -681,6 +2941,8 @@ class Packmol(seamm.Node):
                     fixed = f"   fixed {dx:.4f} {dy:.4f} {dz:.4f} 0.0 0.0 0.0"
         elif dimensions == "calculated from the density":
             density = P["density"]
+            if len(series) > 0:
+                density = min(density, Q_(min(series), density.units))
             if amount == "rounding this number of atoms":
                 n_atoms = P["approximate number of atoms"]
                 n_copies = (n_atoms - n_solute_atoms) / n_fluid_atoms
@@ -790,8 +3052,103 @@ class Packmol(seamm.Node):
         else:
             raise RuntimeError(f"Do not recognize dimensions '{dimensions}'")
 
+        # A layer fills only a slab of its cell
+        if slab is not None:
+            if not periodic or shape == "spherical":
+                raise RuntimeError("A layer must be in a periodic box.")
+            volume = a * b * (slab[1] - slab[0])
+
+        # Tile a box of the solvent from the library rather than packing, if possible
+        solvent_box = None
+        library_note = ""
+        if P["solvation"] == "tiling a box from the solvent library":
+            fluids = [m for m in molecules if m["type"] != "solute"]
+            sources = [
+                source for component, source, *_ in components if component != "solute"
+            ]
+            if (
+                dimensions != "calculated from the solute dimensions"
+                or solute_configuration is None
+                or periodic_solute
+                or shape == "spherical"
+                or len(fluids) != 1
+                or sources != ["SMILES"]
+            ):
+                raise RuntimeError(
+                    "Tiling a box from the solvent library needs a non-periodic "
+                    "solute, one solvent given by SMILES, and a cubic or rectangular "
+                    "region calculated from the solute dimensions."
+                )
+            fluid = fluids[0]
+            if library is not None:
+                solvent_box = packmol_step.find_solvent_box(
+                    library, fluid["definition"]
+                )
+            if solvent_box is None:
+                library_note = (
+                    f"\n\nThere is no box of {fluid['definition']} in the solvent "
+                    "library, so the solvent was packed with Packmol."
+                )
+            else:
+                # Put the atoms of the box in the order of the template, so that
+                # the bonds and atom types of the template apply
+                n_per_molecule = solvent_box["atoms_per_molecule"]
+                symbols = solvent_box["symbols"][0:n_per_molecule]
+                template_symbols = fluid["configuration"].atoms.symbols
+                if solvent_box["bonds"] is None:
+                    logger.warning(
+                        f"The box '{solvent_box['name']}' in the solvent library has "
+                        "no bonds, so its atoms are assumed to be in the order of "
+                        "the template. Save it again to store its bonds."
+                    )
+                    order = list(range(n_per_molecule))
+                    if symbols != template_symbols:
+                        order = None
+                else:
+                    order = packmol_step.match_atoms(
+                        symbols, solvent_box["bonds"], template_symbols, fluid["bonds"]
+                    )
+                if order is None:
+                    raise RuntimeError(
+                        f"The atoms in the box '{solvent_box['name']}' in the solvent "
+                        f"library do not match those of {fluid['definition']}."
+                    )
+                xyz = np.asarray(solvent_box["xyz"]).reshape(-1, n_per_molecule, 3)
+                solvent_box["xyz"] = xyz[:, order, :].reshape(-1, 3)
+                solvent_box["symbols"] = [
+                    solvent_box["symbols"][i] for i in order
+                ] * len(xyz)
+                if periodic:
+                    # The cell must be a whole number of boxes, so round up
+                    sides = solvent_box["cell"]
+                    a, b, c = (
+                        math.ceil(x / side - 1.0e-6) * side
+                        for x, side in zip((a, b, c), sides)
+                    )
+                    if shape == "cubic" and not (a == b == c):
+                        shape = "rectangular"
+                    cell = (a, b, c)
+                volume = a * b * c
+                solute_xyz = [
+                    [
+                        x + dx
+                        for x, dx in zip(xyz, recenter(center, (a / 2, b / 2, c / 2)))
+                    ]
+                    for xyz in xyzs
+                ]
+                solvent_xyz = packmol_step.tile_solvent(
+                    solvent_box, (a, b, c), periodic=periodic, solute=solute_xyz
+                )
+                library_note = (
+                    f"\n\nThe solvent was tiled from the box '{solvent_box['name']}' "
+                    "in the solvent library, removing the molecules overlapping the "
+                    "solute."
+                )
+
         # Now that we have the volume, get the number of molecules
-        if amount == "rounding this number of atoms":
+        if solvent_box is not None:
+            n_copies = len(solvent_xyz) / fluid["count"]
+        elif amount == "rounding this number of atoms":
             n_atoms = P["approximate number of atoms"]
             n_copies = (n_atoms - n_solute_atoms) / n_fluid_atoms
         elif amount == "rounding this number of molecules":
@@ -809,35 +3166,155 @@ class Packmol(seamm.Node):
         else:
             raise RuntimeError(f"Do not recognize fluid amount '{amount}'")
         n_atoms, n_molecules, mass = round_copies(n_copies, molecules)
+        if adding and all(
+            molecule["number"] <= 0
+            for molecule in molecules
+            if molecule["type"] != "solute"
+        ):
+            raise RuntimeError(
+                "There are no molecules to add to the current configuration."
+            )
 
         # Prepare the input
+        tolerance = 2.0
+        files = {}
+
+        # Large templates do not fit in PDB files, and are slow to write as them
+        filetype = packmol_step.choose_filetype(molecules)
+
+        # A large solute can be left out of Packmol's input, keeping the fluid out
+        # of spheres covering it. It is placed as Packmol would, and its atoms are
+        # put first, before Packmol's structure, when reading it.
+        exclusion = []
+        if (
+            P["solute representation"] == "exclusion spheres"
+            and solute_configuration is not None
+            and solvent_box is None
+        ):
+            placed = np.array(xyzs)
+            if not periodic_solute:
+                placed -= placed.mean(axis=0)
+            placed += [float(x) for x in fixed.split()[1:4]]
+            spheres = packmol_step.exclusion_spheres(
+                placed,
+                P["exclusion sphere size"].to("Å").magnitude,
+                tolerance,
+                cell=cell if periodic else None,
+            )
+            exclusion = [
+                f"   outside sphere {x:.4f} {y:.4f} {z:.4f} {r:.4f}"
+                for x, y, z, r in spheres
+            ]
+            molecules.sort(key=lambda molecule: molecule["type"] != "solute")
+            files[f"solute.{filetype}"] = packmol_step.placed_text(
+                [
+                    (
+                        packmol_step.template_text(
+                            molecules[0]["configuration"], filetype
+                        ),
+                        placed,
+                    )
+                ],
+                filetype=filetype,
+                remark="The solute, which Packmol did not see",
+            )
+
         lines = []
         lines.append("seed -1")
-        lines.append("tolerance 2.0")
-        lines.append("output packmol.pdb")
-        lines.append("filetype pdb")
-        lines.append("connect yes")
+        lines.append(f"tolerance {tolerance}")
+        lines.append(f"output packmol.{filetype}")
+        lines.append(f"filetype {filetype}")
+        if filetype == "pdb":
+            lines.append("connect yes")
         if periodic:
             lines.append(f"pbc {a:.4f} {b:.4f} {c:.4f}")
 
-        files = {}
+        # For two-stage packing, first pack each molecule as one pseudo-atom
+        coarse = P["packing method"] == "coarse-grained, then atomistic"
+        if coarse:
+            coarse_lines = [
+                "seed -1",
+                f"tolerance {tolerance}",
+                f"output coarse.{filetype}",
+                f"filetype {filetype}",
+            ]
+            if periodic:
+                coarse_lines.append(f"pbc {a:.4f} {b:.4f} {c:.4f}")
+
         for i, molecule in enumerate(molecules, start=1):
-            lines.append(f"structure input_{i}.pdb")
+            if exclusion and molecule["type"] == "solute":
+                continue
+            structure = []
             if not periodic:
-                lines.append(region)
+                structure.append(region)
+            elif slab is not None and molecule["type"] != "solute":
+                z0, z1 = slab
+                structure.append(
+                    f"   inside box 0.0 0.0 {z0:.4f} {a:.4f} {b:.4f} {z1:.4f}"
+                )
+            structure.extend(exclusion)
             if molecule["type"] == "solute":
                 if not periodic_solute:
-                    lines.append("   center")
-                lines.append(fixed)
-                lines.append("   number 1")
+                    structure.append("   center")
+                structure.append(fixed)
+                structure.append("   number 1")
             else:
-                lines.append(f"   number {molecule['number']}")
-            lines.append("end structure")
+                structure.append(f"   number {molecule['number']}")
             configuration = molecule["configuration"]
-            files[f"input_{i}.pdb"] = configuration.to_pdb_text()
+            files[f"input_{i}.{filetype}"] = packmol_step.template_text(
+                configuration, filetype
+            )
+
+            lines.append(f"structure input_{i}.{filetype}")
+            lines.extend(structure)
+            if coarse and molecule["type"] != "solute":
+                lines.append(f"   restart_from input_{i}.restart")
+            lines.append("end structure")
+
+            if coarse:
+                if molecule["type"] == "solute":
+                    coarse_lines.append(f"structure input_{i}.{filetype}")
+                    coarse_lines.extend(structure)
+                else:
+                    xyz = configuration.atoms.get_coordinates(fractionals=False)
+                    _, bounding_radius = bounding_sphere(xyz)
+                    share = volume * (molecule["mass"] / mass).to("").magnitude
+                    radius = packmol_step.coarse_radius(
+                        bounding_radius, share, tolerance
+                    )
+                    if filetype == "pdb":
+                        files[f"coarse_{i}.pdb"] = packmol_step.pseudo_atom_pdb
+                    else:
+                        files[f"coarse_{i}.xyz"] = packmol_step.pseudo_atom_xyz
+                    coarse_lines.append(f"structure coarse_{i}.{filetype}")
+                    coarse_lines.extend(structure)
+                    coarse_lines.append(f"   radius {radius:.4f}")
+                    coarse_lines.append(f"   restart_to coarse_{i}.restart")
+                coarse_lines.append("end structure")
 
         lines.append("")
         files["input.inp"] = "\n".join(lines)
+        if coarse:
+            coarse_lines.append("")
+            files["coarse.inp"] = "\n".join(coarse_lines)
+
+        # With a box from the solvent library the structure is the solute in the
+        # tiled solvent, written as Packmol would, so Packmol is not needed.
+        if solvent_box is not None:
+            files = {
+                f"packmol.{filetype}": packmol_step.placed_text(
+                    [
+                        (
+                            packmol_step.template_text(
+                                molecule["configuration"], filetype
+                            ),
+                            solute_xyz if molecule["type"] == "solute" else solvent_xyz,
+                        )
+                        for molecule in molecules
+                    ],
+                    filetype=filetype,
+                )
+            }
 
         string = "\n"
         if periodic:
@@ -877,24 +3354,142 @@ class Packmol(seamm.Node):
             "Number": [],
             "Actual %": [],
         }
+        # One row for each molecule as given, in the order given. Duplicates that
+        # were packed as one structure share its molecules in proportion to the
+        # amounts requested.
+        total_count = sum(m["count"] for m in molecules if m["type"] != "solute")
+        total_number = sum(m["number"] for m in molecules if m["type"] != "solute")
+        rows = []
+        merged = []
         for molecule in molecules:
-            table["Component"].append(molecule["type"])
-            table["Structure"].append(molecule["definition"])
-            table["Requested %"].append(molecule["requested %"])
-            table["Number"].append(molecule["number"])
-            table["Actual %"].append(molecule["actual %"])
+            entries = molecule.get(
+                "entries", [(molecule["definition"], molecule["count"], -1)]
+            )
+            if len(entries) == 1:
+                definition, count, position = entries[0]
+                rows.append(
+                    (
+                        position,
+                        molecule["type"],
+                        definition,
+                        molecule["requested %"],
+                        molecule["number"],
+                        molecule["actual %"],
+                    )
+                )
+                continue
+            merged.append(molecule)
+            numbers = _split_number(molecule["number"], [e[1] for e in entries])
+            for (definition, count, position), number in zip(entries, numbers):
+                rows.append(
+                    (
+                        position,
+                        molecule["type"],
+                        definition,
+                        f"{count/total_count*100:.3f}",
+                        number,
+                        f"{number/total_number*100:.3f}",
+                    )
+                )
+        for _, *row in sorted(rows, key=lambda row: row[0]):
+            for key, value in zip(table, row):
+                table[key].append(value)
 
         text_lines = tabulate(
             table, headers="keys", tablefmt="psql", colalign=("center", "left", "right")
         )
         string += textwrap.indent(text_lines, 4 * " ")
+        for molecule in merged:
+            names = [definition for definition, *_ in molecule["entries"]]
+            string += "\n\n" + textwrap.fill(
+                f"{', '.join(names[:-1])} and {names[-1]} are the same molecule, so "
+                f"were packed as one structure of {molecule['number']} molecules, "
+                "shared between them in proportion to the amounts requested."
+            )
 
         string += f"\n\nThere are a total of {n_atoms} atoms in the cell"
         string += f" giving a density of {density:.5~P}."
+        string += library_note
+
+        if summary is not None:
+            summary["n_atoms"] = n_atoms
+            summary["n_molecules"] = n_molecules
+            summary["n_components"] = len(molecules)
+            summary["n_solute_atoms"] = int(n_solute_atoms)
+            summary["density"] = density.magnitude
+            summary["shape"] = shape
+            summary["periodic"] = bool(periodic)
+            summary["tolerance"] = tolerance
+            summary["filetype"] = filetype
+            summary["embedding"] = backend
+            summary["embedding time"] = sum(t for _, t in embedded)
+            summary["n_embedded"] = len(embedded)
+            summary["n_cached"] = sum(1 for by, _ in embedded if by == "cache")
 
         return molecules, files, string, cell
 
 
+def _split_number(number, counts):
+    """Split a whole number in proportion to counts, keeping the total.
+
+    Parameters
+    ----------
+    number : int
+        The number to split.
+    counts : [float]
+        The relative amounts.
+
+    Returns
+    -------
+    [int]
+        The part of the number for each count, by the largest remainders.
+    """
+    shares = [number * count / sum(counts) for count in counts]
+    result = [math.floor(share) for share in shares]
+    remainders = sorted(range(len(shares)), key=lambda i: result[i] - shares[i])
+    for i in remainders[: number - sum(result)]:
+        result[i] += 1
+    return result
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of this process to its current value.
+
+    This is only possible on Linux, by writing to /proc/self/clear_refs.
+
+    Returns
+    -------
+    bool
+        Whether the peak was reset.
+    """
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss():
+    """The peak resident memory in bytes of this process.
+
+    Returns
+    -------
+    int or None
+        The largest resident set size since the process started or the peak was
+        last reset, or None if it cannot be measured on this platform.
+    """
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
 def bounding_sphere(points):
     """A fast, approximate method for finding the sphere containing a set of points.
 
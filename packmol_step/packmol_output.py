@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+
+"""Parsing and monitoring the output of Packmol, packmol.out."""
+
+import logging
+import math
+from pathlib import Path
+import re
+import shlex
+import shutil
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# Regular expressions for the lines of interest, and the key for each.
+patterns = {
+    "loop": re.compile(r"Starting GENCAN loop:\s*(\d+)"),
+    "function value": re.compile(r"Function value from last GENCAN loop: f =\s*(\S+)"),
+    "best function value": re.compile(r"Best function value before: f =\s*(\S+)"),
+    "distance violation": re.compile(r"Maximum violation of target distance:\s*(\S+)"),
+    "constraint violation": re.compile(
+        r"Maximum violation of the constraints:\s*(\S+)"
+    ),
+    "final function value": re.compile(r"Final objective function value:\s*(\S+)"),
+    "running time": re.compile(r"Running time:\s*(\S+)\s*seconds"),
+    "version": re.compile(r"Version\s+(\S+)"),
+}
+
+
+def parse_output(text, tolerance=2.0):
+    """Parse the output of Packmol.
+
+    Parameters
+    ----------
+    text : str
+        The contents of packmol.out, which may be incomplete if Packmol is running.
+    tolerance : float
+        The tolerance used by Packmol, to get the minimum distance between
+        molecules from the violation of the target distance.
+
+    Returns
+    -------
+    dict(str, any)
+        "loops" is a list of the GENCAN loops, each a dictionary with the loop
+        number, the "phase" ("type" when packing each type of molecule, "all" when
+        packing all the molecules together), the function value, the distance and
+        constraint violations, and whether the structure was "written". Also
+        "converged", the final values, Packmol's "running time" and "version", if
+        found.
+    """
+    result = {"loops": [], "converged": None}
+    phase = None
+    loop = None
+    final = False
+    for line in text.splitlines():
+        if "Packing molecules of type" in line:
+            phase = "type"
+        elif "Packing all molecules together" in line:
+            phase = "all"
+        elif "Success!" in line:
+            result["converged"] = True
+        elif "ENDED WITHOUT PERFECT PACKING" in line:
+            result["converged"] = False
+        elif "written to file" in line and loop is not None:
+            loop["written"] = True
+        elif "Running final GENCAN loop" in line or "Final objective" in line:
+            final = True
+
+        for key, pattern in patterns.items():
+            match = pattern.search(line)
+            if match is None:
+                continue
+            value = match.group(1)
+            if key == "loop":
+                loop = {
+                    "loop": int(value),
+                    "phase": "all" if phase is None else phase,
+                    "written": False,
+                }
+                result["loops"].append(loop)
+            elif key == "version":
+                result.setdefault("version", value)
+            elif key in ("final function value", "running time"):
+                result[key] = _float(value)
+            elif final:
+                result["final " + key] = _float(value)
+            elif loop is not None:
+                loop[key] = _float(value)
+
+    for loop in result["loops"]:
+        if "distance violation" in loop:
+            loop["minimum distance"] = tolerance - loop["distance violation"]
+    if "final distance violation" in result:
+        result["minimum distance"] = tolerance - result["final distance violation"]
+
+    return result
+
+
+def accepted_loop(data, criterion, value):
+    """The last written structure from packing all the molecules, if acceptable.
+
+    Parameters
+    ----------
+    data : dict(str, any)
+        The parsed output from parse_output.
+    criterion : str
+        "objective function below" or "minimum distance above".
+    value : float
+        The limit for the criterion.
+
+    Returns
+    -------
+    dict(str, any) or None
+        The loop that wrote the structure, or None if it is not acceptable.
+    """
+    written = [
+        loop for loop in data["loops"] if loop["phase"] == "all" and loop["written"]
+    ]
+    if len(written) == 0:
+        return None
+    loop = written[-1]
+    if criterion == "objective function below":
+        if loop.get("function value", math.inf) <= value:
+            return loop
+    elif criterion == "minimum distance above":
+        if loop.get("minimum distance", -math.inf) >= value:
+            return loop
+    else:
+        raise ValueError(f"Do not recognize the criterion '{criterion}'")
+    return None
+
+
+class Monitor(threading.Thread):
+    """Watch packmol.out while Packmol runs, stopping it when good enough.
+
+    Packmol is stopped when the last structure it wrote meets the criterion, or
+    when the time limit is reached. Packmol is the child process of this process
+    running the Packmol command in the directory of packmol.out, which is found
+    with the psutil package.
+
+    Packmol rewrites its structure file after each loop, so it is suspended while
+    the structure is copied, and only if it is not writing it. The copy, e.g.
+    accepted.pdb, is the structure that was checked.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The output file of Packmol, packmol.out.
+    criterion : str
+        "objective function below", "minimum distance above", or "time limit".
+    value : float
+        The limit for the criterion, in Å for the distance and s for the time.
+    tolerance : float
+        The tolerance used by Packmol.
+    poll : float
+        The time in seconds between checks of the output.
+    structure : str or pathlib.Path
+        The structure file that Packmol writes, e.g. packmol.pdb, to copy.
+    code : str
+        The command that runs Packmol, e.g. "packmol" or "/usr/local/bin/packmol".
+    """
+
+    def __init__(
+        self,
+        path,
+        criterion,
+        value,
+        tolerance=2.0,
+        poll=1.0,
+        structure=None,
+        code="packmol",
+    ):
+        super().__init__(daemon=True)
+        self.path = Path(path)
+        self.code = code
+        self.criterion = criterion
+        self.value = value
+        self.tolerance = tolerance
+        self.poll = poll
+        self.structure = None if structure is None else Path(structure)
+
+        self.accepted = None
+        self.stopped = False
+        self.reason = None
+        self.copy = None
+
+        self._done = threading.Event()
+
+    def finish(self):
+        """Stop monitoring, e.g. because Packmol has finished."""
+        self._done.set()
+        self.join()
+
+    def run(self):
+        t0 = time.perf_counter()
+        while not self._done.wait(self.poll):
+            data = None
+            if self.path.exists():
+                data = parse_output(self.path.read_text(), self.tolerance)
+                if data["converged"] is not None:
+                    # Packmol is finishing by itself
+                    continue
+
+            if self.criterion == "time limit":
+                if time.perf_counter() - t0 >= self.value:
+                    if self._stop_packmol("the time limit was reached"):
+                        return
+            elif data is not None:
+                if accepted_loop(data, self.criterion, self.value) is not None:
+                    if self._stop_packmol(f"the {self.criterion} {self.value} was met"):
+                        return
+
+    def _stop_packmol(self, reason):
+        """Terminate the Packmol processes that are children of this process.
+
+        Packmol is suspended while its output is checked again. If it has started
+        writing the structure for a newer loop, it is resumed so it can finish.
+
+        Parameters
+        ----------
+        reason : str
+            Why Packmol is being stopped.
+
+        Returns
+        -------
+        bool
+            Whether monitoring is over, because Packmol was stopped or cannot be.
+        """
+        if psutil is None:
+            logger.warning(
+                "Cannot stop Packmol early without the 'psutil' package. Install it "
+                "with 'conda install psutil' or 'pip install psutil'."
+            )
+            return True
+
+        processes = []
+        for process in packmol_processes(self.code, self.path.parent):
+            try:
+                process.suspend()
+                processes.append(process)
+            except psutil.Error:
+                pass
+
+        try:
+            data = {"loops": []}
+            if self.path.exists():
+                data = parse_output(self.path.read_text(), self.tolerance)
+            loops = data["loops"]
+            if (
+                len(loops) > 0
+                and "function value" in loops[-1]
+                and not loops[-1]["written"]
+            ):
+                # Packmol may be writing the structure, so let it finish
+                return False
+            if self.criterion == "time limit":
+                written = [loop for loop in loops if loop["written"]]
+                accepted = written[-1] if len(written) > 0 else None
+            else:
+                accepted = accepted_loop(data, self.criterion, self.value)
+                if accepted is None:
+                    return False
+
+            if accepted is not None and self.structure is not None:
+                if self.structure.exists():
+                    copy = self.structure.with_name("accepted" + self.structure.suffix)
+                    shutil.copyfile(self.structure, copy)
+                    self.copy = copy
+            self.accepted = accepted
+            self.reason = reason
+            for process in processes:
+                try:
+                    process.terminate()
+                    self.stopped = True
+                except psutil.Error:
+                    pass
+        finally:
+            # A terminated process gets the signal once it is resumed
+            for process in processes:
+                try:
+                    process.resume()
+                except psutil.Error:
+                    pass
+
+        logger.info(f"Stopped Packmol because {reason}.")
+        return True
+
+
+class PeakMemory(threading.Thread):
+    """Follow the peak resident memory of the Packmol processes while they run.
+
+    Only the Packmol processes running in the directory are measured, not the
+    other children of this process. On Linux the peak is the high-water mark the
+    kernel keeps for each process, otherwise the largest resident memory seen
+    while polling. This needs the psutil package; without it the peak is None.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The directory where Packmol runs.
+    code : str
+        The command that runs Packmol, e.g. "packmol" or "/usr/local/bin/packmol".
+    poll : float
+        The time in seconds between measurements.
+    """
+
+    def __init__(self, directory, code="packmol", poll=0.2):
+        super().__init__(daemon=True)
+        self.directory = Path(directory)
+        self.code = code
+        self.poll = poll
+
+        self.peak = None
+
+        self._done = threading.Event()
+
+    def finish(self):
+        """Stop measuring, e.g. because Packmol has finished.
+
+        Returns
+        -------
+        int or None
+            The peak resident memory in bytes, or None if it was not measured.
+        """
+        self._done.set()
+        self.join()
+        return self.peak
+
+    def run(self):
+        if psutil is None:
+            return
+        while True:
+            for process in packmol_processes(self.code, self.directory):
+                try:
+                    rss = _high_water_mark(process.pid) or process.memory_info().rss
+                except psutil.Error:
+                    continue
+                if self.peak is None or rss > self.peak:
+                    self.peak = rss
+            if self._done.wait(self.poll):
+                break
+
+
+def packmol_processes(code, directory):
+    """The Packmol processes among the children of this process.
+
+    A process is Packmol if its command line starts with the Packmol command,
+    comparing only the name of the executable, and it is running in the given
+    directory. Shells wrapping the command, and Packmol running for other steps,
+    do not match. This needs the psutil package.
+
+    Parameters
+    ----------
+    code : str
+        The command that runs Packmol, e.g. "packmol" or "python fake_packmol.py".
+    directory : str or pathlib.Path
+        The directory where Packmol runs.
+
+    Returns
+    -------
+    [psutil.Process]
+        The processes, or an empty list without psutil.
+    """
+    if psutil is None:
+        return []
+    words = shlex.split(code)
+    directory = Path(directory).resolve()
+    processes = []
+    for child in psutil.Process().children(recursive=True):
+        try:
+            cmdline = child.cmdline()
+            if (
+                len(cmdline) < len(words)
+                or Path(cmdline[0]).name != Path(words[0]).name
+                or cmdline[1 : len(words)] != words[1:]
+            ):
+                continue
+            if Path(child.cwd()).resolve() != directory:
+                continue
+        except psutil.Error:
+            continue
+        processes.append(child)
+    return processes
+
+
+def _high_water_mark(pid):
+    """The peak resident memory of a process in bytes, from /proc on Linux."""
+    try:
+        with open(f"/proc/{pid}/status") as fd:
+            for line in fd:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _float(text):
+    """Convert Packmol's Fortran-style numbers to floats."""
+    try:
+        return float(text.replace("D", "E"))
+    except ValueError:
+        return None
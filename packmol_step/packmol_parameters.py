@@ -44,6 +44,26 @@ class PackmolParameters(seamm.Parameters):
             "description": "The molecules",
             "help_text": "An internal place to put the molecule definitions.",
         },
+        "mode": {
+            "default": "build a new configuration",
+            "kind": "enumeration",
+            "default_units": "",
+            "enumeration": (
+                "build a new configuration",
+                "add to the current configuration",
+                "build a layered cell",
+                "build separate regions",
+            ),
+            "format_string": "s",
+            "description": "Mode:",
+            "help_text": (
+                "Whether to build a new configuration, to add molecules to the "
+                "current periodic configuration, keeping its atoms fixed, to build "
+                "a periodic cell of layers with different compositions, e.g. for "
+                "interfaces, or to build a periodic cell with separate regions, e.g. "
+                "droplets."
+            ),
+        },
         "periodic": {
             "default": "No",
             "kind": "boolean",
@@ -98,6 +118,20 @@ class PackmolParameters(seamm.Parameters):
             "description": "Density:",
             "help_text": ("The target density of the cell."),
         },
+        "density series": {
+            "default": "",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "s",
+            "description": "Also at densities:",
+            "help_text": (
+                "Other densities, in the units of the density, for a series of boxes "
+                "of the same molecules, e.g. for an equation of state. The box is "
+                "packed once at the lowest density and compressed to the others. "
+                "Empty for no series."
+            ),
+        },
         "volume": {
             "default": 8.0,
             "kind": "float",
@@ -220,6 +254,54 @@ class PackmolParameters(seamm.Parameters):
             "description": "Solvent thickness:",
             "help_text": "The thickness of the layer of solvent around the solute",
         },
+        "solvation": {
+            "default": "packing with Packmol",
+            "kind": "enumeration",
+            "default_units": "",
+            "enumeration": (
+                "packing with Packmol",
+                "tiling a box from the solvent library",
+            ),
+            "format_string": "s",
+            "description": "Solvate by:",
+            "help_text": (
+                "Whether to pack the solvent around the solute with Packmol, or to "
+                "tile a pre-equilibrated box of the solvent from the library and "
+                "remove the molecules overlapping the solute. Packmol is used if "
+                "the library has no box of the solvent."
+            ),
+        },
+        "solute representation": {
+            "default": "all atoms",
+            "kind": "enumeration",
+            "default_units": "",
+            "enumeration": (
+                "all atoms",
+                "exclusion spheres",
+            ),
+            "format_string": "s",
+            "description": "Give Packmol the solute as:",
+            "help_text": (
+                "Whether Packmol is given every atom of the fixed solute, or only "
+                "spheres covering it that the fluid must stay outside of. The "
+                "spheres are much faster for large solutes such as proteins or "
+                "slabs, though the fluid cannot fill pockets smaller than them. The "
+                "atoms of the solute are put back afterwards."
+            ),
+        },
+        "exclusion sphere size": {
+            "default": 8.0,
+            "kind": "float",
+            "default_units": "Å",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Size of exclusion spheres:",
+            "help_text": (
+                "The side of the cubic voxels used to cluster the atoms of the "
+                "solute into spheres. Larger sizes give fewer spheres, which is "
+                "faster, but exclude more of the space near the surface."
+            ),
+        },
         "approximate number of molecules": {
             "default": 100,
             "kind": "integer",
@@ -241,6 +323,187 @@ class PackmolParameters(seamm.Parameters):
                 "cell. This will be rounded to give whole molecules"
             ),
         },
+        "composition series": {
+            "default": "",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "s",
+            "description": "Also with compositions:",
+            "help_text": (
+                "Other compositions of the fluid, e.g. '1:3, 1:1, 3:1' for the "
+                "relative amounts of the components in order, for a series of "
+                "boxes with the same number of molecules. The box is packed once and "
+                "the others made by swapping molecules. Empty for no series."
+            ),
+        },
+        "series minimum distance": {
+            "default": 1.8,
+            "kind": "float",
+            "default_units": "Å",
+            "enumeration": tuple(),
+            "format_string": ".2f",
+            "description": "Repack closer than:",
+            "help_text": (
+                "For a series of densities or compositions, the minimum distance "
+                "between atoms in different molecules that is acceptable. Molecules "
+                "closer than this after compressing the box or swapping molecules "
+                "are repacked; the others are kept where they are."
+            ),
+        },
+        "layer compositions": {
+            "default": "1:0, 0:1",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "s",
+            "description": "Layer compositions:",
+            "help_text": (
+                "The composition of each layer from the bottom, e.g. '1:0, 0:1' for "
+                "a layer of the first fluid under a layer of the second, giving the "
+                "relative amounts of the fluid components in order. A periodic "
+                "solute, such as a slab of a solid, is put below the layers."
+            ),
+        },
+        "layer densities": {
+            "default": "1.0, 1.0",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "s",
+            "description": "Layer densities (g/mL):",
+            "help_text": "The density of each layer from the bottom, in g/mL.",
+        },
+        "layer thicknesses": {
+            "default": "20, 20",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "s",
+            "description": "Layer thicknesses (Å):",
+            "help_text": "The thickness of each layer from the bottom, in Å.",
+        },
+        "interface gap": {
+            "default": 2.0,
+            "kind": "float",
+            "default_units": "Å",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Gap between layers:",
+            "help_text": (
+                "The empty space between neighboring layers, which keeps molecules "
+                "in different layers from overlapping."
+            ),
+        },
+        "region shapes": {
+            "default": "sphere, sphere",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "s",
+            "description": "Region shapes:",
+            "help_text": (
+                "The shape of each separate region, 'sphere' or 'box', e.g. "
+                "'sphere, sphere, box'."
+            ),
+        },
+        "region sizes": {
+            "default": "30, 30",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "s",
+            "description": "Region sizes (Å):",
+            "help_text": (
+                "The diameter of each sphere, or the sides of each box, in Å, e.g. "
+                "'30, 40x20x20'. One side for a box makes it a cube."
+            ),
+        },
+        "region compositions": {
+            "default": "1:0, 0:1",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "s",
+            "description": "Region compositions:",
+            "help_text": (
+                "The composition of each region, e.g. '1:0, 0:1' for a region of "
+                "the first fluid and one of the second, giving the relative amounts "
+                "of the fluid components in order."
+            ),
+        },
+        "region densities": {
+            "default": "1.0, 1.0",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "s",
+            "description": "Region densities (g/mL):",
+            "help_text": (
+                "The density of each region, in g/mL, which gives the number of "
+                "molecules in it."
+            ),
+        },
+        "region spacing": {
+            "default": 5.0,
+            "kind": "float",
+            "default_units": "Å",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Spacing between regions:",
+            "help_text": (
+                "The smallest distance between the spheres around the regions, and "
+                "their periodic images."
+            ),
+        },
+        "embedding": {
+            "default": "OpenBabel",
+            "kind": "enumeration",
+            "default_units": "",
+            "enumeration": (
+                "OpenBabel",
+                "RDKit ETKDG",
+                "template cache only",
+            ),
+            "format_string": "s",
+            "description": "Build SMILES in 3-D with:",
+            "help_text": (
+                "How to build the 3-D structures of molecules given by SMILES. "
+                "RDKit's ETKDG is often faster for large, ring-rich molecules and "
+                "gives less strained structures. The structures are kept in the "
+                "template cache, if one is given with the --template-cache option, "
+                "and the last choice uses only the structures already in it."
+            ),
+        },
+        "conformers": {
+            "default": 1,
+            "kind": "integer",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "d",
+            "description": "Conformers to choose from:",
+            "help_text": (
+                "The number of conformers of each molecule given by SMILES, from "
+                "which the most compact is packed. Compact conformers of long, "
+                "flexible molecules pack much faster at high densities than the "
+                "extended structure usually built. 1 uses the structure as built."
+            ),
+        },
+        "conformer measure": {
+            "default": "radius of gyration",
+            "kind": "enumeration",
+            "default_units": "",
+            "enumeration": (
+                "radius of gyration",
+                "bounding sphere",
+            ),
+            "format_string": "s",
+            "description": "Most compact by:",
+            "help_text": (
+                "How to measure how compact the conformers are: the radius of "
+                "gyration, or the radius of the sphere holding all the atoms."
+            ),
+        },
         "assign forcefield": {
             "default": "If not assigned",
             "kind": "enum",
@@ -254,6 +517,128 @@ class PackmolParameters(seamm.Parameters):
             "description": "Assign forcefield:",
             "help_text": "Whether to assign the forcefield to the molecules.",
         },
+        "results": {
+            "default": {},
+            "kind": "dictionary",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "",
+            "description": "results",
+            "help_text": "The results to save to variables or in tables.",
+        },
+        "create tables": {
+            "default": "yes",
+            "kind": "boolean",
+            "default_units": "",
+            "enumeration": ("yes", "no"),
+            "format_string": "",
+            "description": "Create tables as needed:",
+            "help_text": (
+                "Whether to create tables as needed for results being saved into "
+                "tables."
+            ),
+        },
+        "packing method": {
+            "default": "atomistic",
+            "kind": "enumeration",
+            "default_units": "",
+            "enumeration": (
+                "atomistic",
+                "coarse-grained, then atomistic",
+            ),
+            "format_string": "s",
+            "description": "Packing method:",
+            "help_text": (
+                "Whether to pack the atoms directly, or to first pack each molecule "
+                "as a single sphere and then polish the atomistic structure. The "
+                "second is much faster for long chains and other large molecules."
+            ),
+        },
+        "predict resources": {
+            "default": "No",
+            "kind": "enumeration",
+            "default_units": "",
+            "enumeration": (
+                "No",
+                "Warn if over budget",
+                "Stop if over budget",
+            ),
+            "format_string": "s",
+            "description": "Predict time and memory:",
+            "help_text": (
+                "Whether to predict the time and memory that Packmol will need from "
+                "similar builds in the history on this host, and what to do if the "
+                "prediction is over the budgets."
+            ),
+        },
+        "time budget": {
+            "default": 1.0,
+            "kind": "float",
+            "default_units": "h",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Time budget:",
+            "help_text": "The time allowed for Packmol, or 0 for no limit.",
+        },
+        "memory budget": {
+            "default": 8.0,
+            "kind": "float",
+            "default_units": "GB",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Memory budget:",
+            "help_text": "The memory allowed for Packmol, or 0 for no limit.",
+        },
+        "stop early": {
+            "default": "No",
+            "kind": "enumeration",
+            "default_units": "",
+            "enumeration": (
+                "No",
+                "objective function below",
+                "minimum distance above",
+                "time limit",
+            ),
+            "format_string": "s",
+            "description": "Stop early when the:",
+            "help_text": (
+                "Stop Packmol before it meets the tolerance once the last structure "
+                "it wrote is good enough, or after a time limit."
+            ),
+        },
+        "maximum objective": {
+            "default": 0.1,
+            "kind": "float",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": ".3g",
+            "description": "Maximum objective function:",
+            "help_text": "The value of the objective function that is good enough.",
+        },
+        "stop early minimum distance": {
+            "default": 1.8,
+            "kind": "float",
+            "default_units": "Å",
+            "enumeration": tuple(),
+            "format_string": ".2f",
+            "description": "Minimum distance:",
+            "help_text": (
+                "The minimum distance between atoms in different molecules that is "
+                "good enough to stop Packmol early."
+            ),
+        },
+        "time limit": {
+            "default": 30.0,
+            "kind": "float",
+            "default_units": "min",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Time limit:",
+            "help_text": (
+                "The time after which Packmol is stopped, keeping the last structure "
+                "it wrote."
+            ),
+        },
     }
 
     def __init__(self, defaults={}, data=None):
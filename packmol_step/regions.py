@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""Building several separate regions, such as droplets, in one periodic cell.
+
+Each region is a sphere or box with its own composition and density. The regions
+are independent, so each is packed by its own Packmol run, all at the same time,
+in the same way as a region on its own. The regions are then placed at random in
+the cell so that their bounding spheres, and those of their periodic images, are
+at least a given spacing apart.
+"""
+
+import logging
+import math
+
+import numpy as np
+
+from packmol_step.composition_series import parse_compositions
+from packmol_step.layers import parse_lengths
+
+logger = logging.getLogger(__name__)
+
+region_shapes = ("sphere", "box")
+
+# The seed for placing the regions, so that builds are reproducible
+_seed = 20261019
+
+
+def parse_sizes(text):
+    """The sizes of regions, separated by commas or semicolons.
+
+    Parameters
+    ----------
+    text : str
+        The sizes, each one number, or three separated by "x", e.g. "30, 40x20x20".
+
+    Returns
+    -------
+    [(float,)]
+        The numbers for each region, in the order given.
+    """
+    result = []
+    for size in str(text).replace(";", ",").split(","):
+        if size.strip() == "":
+            continue
+        values = parse_lengths(size.replace("x", " ").replace("X", " "), "sizes")
+        if len(values) not in (1, 3):
+            raise RuntimeError(
+                f"The region size '{size.strip()}' should be one length, or three "
+                "separated by 'x'."
+            )
+        result.append(tuple(values))
+    return result
+
+
+def parse_regions(shapes, sizes, compositions, densities, n_components):
+    """The shape, size, composition and density of each region.
+
+    Parameters
+    ----------
+    shapes : str
+        The shape of each region, "sphere" or "box", separated by commas or spaces.
+    sizes : str
+        The diameter of each sphere, or the sides of each box, e.g. "30, 40x20x20".
+        One side for a box makes it a cube.
+    compositions : str
+        The relative amounts of the fluid components in each region, e.g.
+        "1:0, 0:1", as for a series of compositions.
+    densities : str
+        The density of each region, e.g. "1.0, 0.8".
+    n_components : int
+        The number of fluid components.
+
+    Returns
+    -------
+    [dict(str, any)]
+        The "shape", "sides" of the box around it, "radius" of the sphere around
+        it, "composition" and "density" of each region.
+    """
+    shapes = str(shapes).replace(",", " ").split()
+    sizes = parse_sizes(sizes)
+    compositions = parse_compositions(compositions)
+    densities = parse_lengths(densities, "densities")
+    if len(shapes) == 0:
+        raise RuntimeError("A build of separate regions needs at least one region.")
+    if not (len(shapes) == len(sizes) == len(compositions) == len(densities)):
+        raise RuntimeError(
+            f"There are {len(shapes)} region shapes, {len(sizes)} sizes, "
+            f"{len(compositions)} compositions and {len(densities)} densities, which "
+            "should be the same."
+        )
+
+    regions = []
+    for shape, size, composition, density in zip(
+        shapes, sizes, compositions, densities
+    ):
+        if shape not in region_shapes:
+            raise RuntimeError(
+                f"Do not recognize the region shape '{shape}'. It should be one of "
+                f"{', '.join(region_shapes)}."
+            )
+        if len(composition) != n_components:
+            raise RuntimeError(
+                f"The region composition {composition} does not have an amount for "
+                f"each of the {n_components} fluid components."
+            )
+        if shape == "sphere":
+            if len(size) != 1:
+                raise RuntimeError(
+                    f"A sphere needs one size, its diameter, not {len(size)}."
+                )
+            sides = size * 3
+            radius = size[0] / 2
+        else:
+            sides = size * 3 if len(size) == 1 else size
+            radius = math.sqrt(sum(x**2 for x in sides)) / 2
+        regions.append(
+            {
+                "shape": shape,
+                "sides": sides,
+                "radius": radius,
+                "composition": composition,
+                "density": density,
+            }
+        )
+    return regions
+
+
+def place_regions(radii, cell, spacing, tries=1000, seed=_seed):
+    """Random centers for regions, keeping them apart in a periodic cell.
+
+    The regions are placed from the largest, each at the first random point that
+    is far enough from those already placed and their periodic images.
+
+    Parameters
+    ----------
+    radii : [float]
+        The radius of the sphere around each region.
+    cell : (float, float, float)
+        The sides of the orthorhombic periodic cell.
+    spacing : float
+        The smallest distance between the spheres around the regions.
+    tries : int
+        The number of random points to try for each region, in batches of 32.
+    seed : int
+        The seed for the random points, so the placement is reproducible.
+
+    Returns
+    -------
+    numpy.ndarray
+        The center of each region, in the order given, n x 3.
+    """
+    radii = np.asarray(radii, dtype=float)
+    cell = np.asarray(cell, dtype=float)
+    if len(radii) > 0 and 2 * radii.max() + spacing > cell.min():
+        raise RuntimeError(
+            f"A region {2 * radii.max():.1f} Å across does not fit in the "
+            f"{' x '.join(f'{x:.1f}' for x in cell)} Å cell with a spacing of "
+            f"{spacing:.1f} Å from its periodic images."
+        )
+
+    # Try the points in batches, since the first few usually fit
+    batch = 32
+    rng = np.random.default_rng(seed)
+    centers = np.zeros((len(radii), 3))
+    placed = []
+    for i in np.argsort(-radii, kind="stable"):
+        limits = radii[i] + radii[placed] + spacing
+        for _ in range(0, tries, batch):
+            points = rng.random((batch, 3)) * cell
+            delta = points[:, None, :] - centers[placed][None, :, :]
+            delta -= cell * np.round(delta / cell)
+            ok = np.all(np.linalg.norm(delta, axis=2) >= limits, axis=1)
+            if ok.any():
+                break
+        else:
+            raise RuntimeError(
+                f"Could not place {len(radii)} regions in the "
+                f"{' x '.join(f'{x:.1f}' for x in cell)} Å cell without overlapping. "
+                "Try a larger cell or fewer or smaller regions."
+            )
+        centers[i] = points[np.argmax(ok)]
+        placed.append(i)
+    return centers
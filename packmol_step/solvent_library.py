@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+
+"""Solvating a solute by tiling a stored, pre-equilibrated box of solvent.
+
+Each box in the library is a compressed numpy file holding the Cartesian
+coordinates of whole molecules of one solvent in an orthorhombic periodic cell, the
+element symbols, the cell, the canonical SMILES of the solvent, the number of
+atoms in each molecule and the bonds in a molecule. Before tiling, the atoms of
+each molecule are matched to those of the template made from the SMILES by their
+bonds, and put in the same order, so the bonds and atom types of the template
+apply.
+"""
+
+import itertools
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from packmol_step.canonical import canonical_definition
+
+logger = logging.getLogger(__name__)
+
+
+def save_solvent_box(path, configuration, smiles):
+    """Save a periodic box of one solvent, e.g. from an MD run, in the library.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The file to write, e.g. "water.npz" in the library directory.
+    configuration : molsystem._Configuration
+        A periodic, orthorhombic configuration of identical molecules, the atoms of
+        each consecutive and in the order of the template from the SMILES.
+    smiles : str
+        The SMILES of the solvent.
+    """
+    if configuration.periodicity != 3:
+        raise RuntimeError("The box of solvent must be periodic.")
+    a, b, c, alpha, beta, gamma = configuration.cell.parameters
+    if abs(alpha - 90) > 0.1 or abs(beta - 90) > 0.1 or abs(gamma - 90) > 0.1:
+        raise RuntimeError("The box of solvent must be orthorhombic.")
+
+    molecules = configuration.find_molecules(as_indices=True)
+    n_per_molecule = len(molecules[0])
+    symbols = configuration.atoms.symbols
+    for i, molecule in enumerate(molecules):
+        start = i * n_per_molecule
+        if sorted(molecule) != list(range(start, start + n_per_molecule)):
+            raise RuntimeError(
+                "The molecules in the box of solvent must be identical, with the "
+                "atoms of each consecutive."
+            )
+        if symbols[start : start + n_per_molecule] != symbols[0:n_per_molecule]:
+            raise RuntimeError("The molecules in the box of solvent differ.")
+
+    # Make the molecules whole, and put their centers in the cell
+    cell = np.array((a, b, c))
+    xyz = np.array(configuration.atoms.get_coordinates(fractionals=False))
+    xyz = xyz.reshape(-1, n_per_molecule, 3)
+    delta = xyz - xyz[:, 0:1, :]
+    delta -= cell * np.round(delta / cell)
+    xyz = xyz[:, 0:1, :] + delta
+    xyz -= cell * np.floor(xyz.mean(axis=1, keepdims=True) / cell)
+
+    # The bonds in the first molecule, to match its atoms to the template
+    index = {_id: i for i, _id in enumerate(configuration.atoms.ids)}
+    bonds = []
+    for row in configuration.bonds.bonds():
+        i, j = sorted((index[row["i"]], index[row["j"]]))
+        if j < n_per_molecule:
+            bonds.append((i, j))
+
+    with open(path, "wb") as fd:
+        np.savez_compressed(
+            fd,
+            xyz=xyz.reshape(-1, 3).astype(np.float32),
+            symbols=np.asarray(symbols, dtype="U3"),
+            cell=cell,
+            smiles=np.array(canonical_definition("SMILES", smiles)),
+            atoms_per_molecule=np.array(n_per_molecule),
+            bonds=np.array(bonds, dtype=np.int32).reshape(-1, 2),
+        )
+
+
+def find_solvent_box(directory, smiles):
+    """Find the box of a solvent in the library.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The directory holding the library.
+    smiles : str
+        The SMILES of the solvent, which is compared in canonical form.
+
+    Returns
+    -------
+    dict(str, any) or None
+        The "name", "xyz", "symbols", "cell", "atoms_per_molecule" and "bonds" in
+        a molecule of the box, or None if there is no box for the solvent. The
+        bonds are None for a box saved without them.
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        return None
+    canonical = canonical_definition("SMILES", smiles)
+    for path in sorted(directory.glob("*.npz")):
+        with np.load(path) as data:
+            if str(data["smiles"]) != canonical:
+                continue
+            return {
+                "name": path.stem,
+                "xyz": data["xyz"].astype(float),
+                "symbols": [str(symbol) for symbol in data["symbols"]],
+                "cell": data["cell"],
+                "atoms_per_molecule": int(data["atoms_per_molecule"]),
+                "bonds": (
+                    [tuple(int(i) for i in bond) for bond in data["bonds"]]
+                    if "bonds" in data
+                    else None
+                ),
+            }
+    return None
+
+
+def match_atoms(symbols, bonds, template_symbols, template_bonds):
+    """The order of the atoms of a molecule that matches those of a template.
+
+    The atoms are matched by their elements and bonds, ignoring the bond orders,
+    by a depth-first search that is quick for the small molecules of solvents.
+
+    Parameters
+    ----------
+    symbols : [str]
+        The element symbols of the atoms of the molecule.
+    bonds : [(int, int)]
+        The bonds in the molecule, as pairs of indices of the atoms. Any further
+        items, such as the bond order, are ignored.
+    template_symbols : [str]
+        The element symbols of the atoms of the template.
+    template_bonds : [(int, int)]
+        The bonds in the template.
+
+    Returns
+    -------
+    [int] or None
+        The index of the atom of the molecule for each atom of the template, or
+        None if the molecule and template differ.
+    """
+    n = len(symbols)
+    if (
+        n != len(template_symbols)
+        or sorted(symbols) != sorted(template_symbols)
+        or len(bonds) != len(template_bonds)
+    ):
+        return None
+
+    def neighbors(bonds):
+        result = [set() for _ in range(n)]
+        for i, j, *_ in bonds:
+            result[int(i)].add(int(j))
+            result[int(j)].add(int(i))
+        return result
+
+    mine = neighbors(bonds)
+    theirs = neighbors(template_bonds)
+
+    order = []
+    used = set()
+
+    def extend(k):
+        if k == n:
+            return True
+        for atom in range(n):
+            if (
+                atom in used
+                or symbols[atom] != template_symbols[k]
+                or len(mine[atom]) != len(theirs[k])
+            ):
+                continue
+            if any((order[j] in mine[atom]) != (j in theirs[k]) for j in range(k)):
+                continue
+            order.append(atom)
+            used.add(atom)
+            if extend(k + 1):
+                return True
+            order.pop()
+            used.remove(atom)
+        return False
+
+    return order if extend(0) else None
+
+
+def close_atoms(points, others, distance, box=None, labels=None):
+    """Which points are within a distance of any of the other points.
+
+    The other points are sorted into a grid of cells at least the distance on a
+    side, so only the points in neighboring cells are compared, and the cost grows
+    with the number of points rather than with the product of the numbers.
+
+    Parameters
+    ----------
+    points : array_like
+        The points to check, n x 3.
+    others : array_like
+        The other points, m x 3.
+    distance : float
+        The distance for being close.
+    box : (float, float, float)
+        The sides of an orthorhombic periodic cell, or None if not periodic.
+    labels : (array_like, array_like)
+        Labels of the points and of the other points, e.g. the molecule of each
+        atom. A point and another point with the same label are never close.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array, True for the points close to another point.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    others = np.asarray(others, dtype=float).reshape(-1, 3)
+    if labels is not None:
+        point_labels, other_labels = (np.asarray(x) for x in labels)
+    result = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or len(others) == 0:
+        return result
+
+    if box is None:
+        origin = np.minimum(points.min(axis=0), others.min(axis=0))
+        points = points - origin
+        others = others - origin
+        top = np.maximum(points.max(axis=0), others.max(axis=0))
+        n_cells = np.floor(top / distance).astype(int) + 1
+        size = np.full(3, float(distance))
+    else:
+        box = np.asarray(box, dtype=float)
+        points = points % box
+        others = others % box
+        n_cells = np.maximum(1, np.floor(box / distance).astype(int))
+        size = box / n_cells
+
+    def cells_of(xyz):
+        return np.minimum(np.floor(xyz / size).astype(int), n_cells - 1)
+
+    def keys_of(cells):
+        return (cells[:, 0] * n_cells[1] + cells[:, 1]) * n_cells[2] + cells[:, 2]
+
+    keys = keys_of(cells_of(others))
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    others = others[order]
+    if labels is not None:
+        other_labels = other_labels[order]
+
+    point_cells = cells_of(points)
+    d2 = distance**2
+    for offset in itertools.product((-1, 0, 1), repeat=3):
+        cells = point_cells + offset
+        if box is None:
+            valid = np.all((cells >= 0) & (cells < n_cells), axis=1)
+        else:
+            cells %= n_cells
+            valid = np.ones(len(cells), dtype=bool)
+        neighbors = keys_of(cells)
+        start = np.searchsorted(keys, neighbors, side="left")
+        count = np.searchsorted(keys, neighbors, side="right") - start
+        count[~valid] = 0
+        for k in range(count.max()):
+            check = (count > k) & ~result
+            delta = points[check] - others[start[check] + k]
+            if box is not None:
+                delta -= box * np.round(delta / box)
+            close = np.einsum("ij,ij->i", delta, delta) < d2
+            if labels is not None:
+                close &= point_labels[check] != other_labels[start[check] + k]
+            result[check] = close
+    return result
+
+
+def tile_solvent(box, cell, periodic=True, solute=None, tolerance=2.0):
+    """Fill a cell or region with copies of a box of solvent, around a solute.
+
+    Parameters
+    ----------
+    box : dict(str, any)
+        The box of solvent, from find_solvent_box.
+    cell : (float, float, float)
+        The sides of the cell or rectangular region, with its origin at 0, 0, 0.
+        A periodic cell must be a whole number of boxes on each side.
+    periodic : bool
+        Whether the cell is periodic. If not, molecules must lie wholly inside it.
+    solute : array_like
+        The Cartesian coordinates of the solute, n x 3, in the cell. Molecules of
+        solvent with any atom within the tolerance of the solute are removed.
+    tolerance : float
+        The minimum distance between the solvent and solute, in Å.
+
+    Returns
+    -------
+    numpy.ndarray
+        The Cartesian coordinates of the molecules of solvent, n_molecules x
+        atoms_per_molecule x 3.
+    """
+    n_per_molecule = box["atoms_per_molecule"]
+    xyz = np.asarray(box["xyz"], dtype=float).reshape(-1, n_per_molecule, 3)
+    sides = np.asarray(box["cell"], dtype=float)
+    cell = np.asarray(cell, dtype=float)
+
+    counts = np.ceil(cell / sides - 1.0e-6).astype(int)
+    if periodic and np.any(np.abs(counts * sides - cell) > 1.0e-3):
+        raise RuntimeError(
+            f"The periodic cell {cell} is not a whole number of boxes of solvent "
+            f"{sides}."
+        )
+    shifts = np.stack(
+        np.meshgrid(*(np.arange(n) for n in counts), indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+    tiled = (xyz[None, :, :, :] + (shifts * sides)[:, None, None, :]).reshape(
+        -1, n_per_molecule, 3
+    )
+
+    if periodic:
+        keep = np.all(tiled.mean(axis=1) < cell, axis=1)
+    else:
+        keep = np.all((tiled >= 0.0) & (tiled <= cell), axis=(1, 2))
+    tiled = tiled[keep]
+
+    if solute is not None and len(solute) > 0:
+        close = close_atoms(
+            tiled.reshape(-1, 3), solute, tolerance, box=cell if periodic else None
+        )
+        tiled = tiled[~close.reshape(-1, n_per_molecule).any(axis=1)]
+
+    return tiled
+
+
+def solvated_pdb(parts, remark="Solvated from the solvent library"):
+    """The PDB file for molecules placed from templates, as Packmol would write it.
+
+    Parameters
+    ----------
+    parts : [(str, numpy.ndarray)]
+        The PDB text of each template, and the coordinates of its copies,
+        n_copies x n_atoms x 3, in the order to write them.
+    remark : str
+        The remark at the start of the file.
+
+    Returns
+    -------
+    str
+        The PDB file.
+    """
+    lines = [f"REMARK   {remark}"]
+    serial = 0
+    residue = 0
+    for template, xyz in parts:
+        atoms = [
+            f"{line:<80s}"
+            for line in template.splitlines()
+            if line[0:6] in ("ATOM  ", "HETATM")
+        ]
+        for molecule in np.asarray(xyz, dtype=float).reshape(-1, len(atoms), 3):
+            residue += 1
+            for line, (x, y, z) in zip(atoms, molecule):
+                serial += 1
+                lines.append(
+                    f"{line[0:6]}{serial % 100000:5d}{line[11:22]}"
+                    f"{residue % 10000:4d}{line[26:30]}{x:8.3f}{y:8.3f}{z:8.3f}"
+                    f"{line[54:80]}".rstrip()
+                )
+    lines.append("END")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,576 @@
+# -*- coding: utf-8 -*-
+
+"""Preparation of the templates for the molecules that Packmol packs.
+
+Embedding a SMILES string in 3-D and assigning the forcefield are independent for
+each component, so for mixtures with many components they can be done in parallel
+in a pool of processes. The configurations live in SQLite databases that cannot be
+shared between processes, so each worker builds its molecule in a private database
+and sends back compact arrays, which are turned back into configurations in the
+original order.
+
+The SMILES can be embedded with OpenBabel's builder, which is the default, or with
+RDKit's ETKDG, which is often faster for large molecules with many rings and gives
+less strained structures that are easier to pack. The embedded structures can be
+kept in a cache directory, so later builds with the same molecules skip the
+embedding, or use only the structures already in the cache. For long, flexible
+molecules the most compact of several conformers can be used, which packs faster
+at high densities than the extended structure that embedding usually gives.
+"""
+
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import hashlib
+import itertools
+import logging
+import os
+from pathlib import Path
+from pickle import PicklingError
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    from rdkit import Chem
+    from rdkit.Chem import rdDistGeom, rdMolTransforms
+except ImportError:
+    Chem = None
+
+from molsystem import SystemDB
+from packmol_step.canonical import canonical_definition
+
+logger = logging.getLogger(__name__)
+
+# The forcefield for the worker processes, set once by the initializer
+_forcefield = None
+
+# Counter to give the private databases unique names
+_counter = itertools.count()
+
+# The ways of embedding SMILES in 3-D, and their names in the files of the cache
+embedding_backends = ("OpenBabel", "RDKit ETKDG", "template cache only")
+_flavors = {"OpenBabel": "openbabel", "RDKit ETKDG": "rdkit"}
+
+# A fixed seed, so that ETKDG gives the same structure every time
+_seed = 20261004
+
+# Conformers with atoms more than two bonds apart closer than this, in Å, are broken
+closest_contact = 1.2
+
+
+def template_arrays(configuration, bonds=True):
+    """Extract the compact data needed for a template from a configuration.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The configuration of the molecule.
+    bonds : bool
+        Whether to get the bonds, which are not needed for a configuration that is
+        only a fixed obstacle.
+
+    Returns
+    -------
+    dict(str, any)
+        The atomic numbers, Cartesian coordinates, bonds as (i, j, order) with
+        0-based indices, any forcefield atom types and charges, the charge and
+        spin multiplicity of the molecule, and the periodicity and cell.
+
+    Notes
+    -----
+    The configuration is only read, so this is safe to use on the configurations
+    in the main system database.
+    """
+    atoms = configuration.atoms
+    if bonds:
+        index = {_id: i for i, _id in enumerate(atoms.ids)}
+        bonds = [
+            (index[row["i"]], index[row["j"]], row["bondorder"])
+            for row in configuration.bonds.bonds()
+        ]
+    else:
+        bonds = []
+    columns = {
+        key: atoms.get_column_data(key)
+        for key in atoms.keys()
+        if "atom_types_" in key or "charges" in key
+    }
+    result = {
+        "atno": atoms.atomic_numbers,
+        "xyz": atoms.get_coordinates(fractionals=False),
+        "bonds": bonds,
+        "columns": columns,
+        "charge": configuration.charge,
+        "spin_multiplicity": configuration.spin_multiplicity,
+        "periodicity": configuration.periodicity,
+    }
+    if configuration.periodicity == 3:
+        result["cell"] = configuration.cell.parameters
+    return result
+
+
+def configuration_from_template(configuration, template, bonds=False):
+    """Fill an empty configuration with the atoms of a template.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The empty configuration to fill.
+    template : dict(str, any)
+        The data from template_arrays.
+    bonds : bool
+        Whether to add the bonds. By default they are not, since the step keeps
+        them separately.
+    """
+    if template.get("periodicity", 0) == 3:
+        configuration.periodicity = 3
+        configuration.cell.parameters = template["cell"]
+    configuration.coordinate_system = "Cartesian"
+    x, y, z = zip(*template["xyz"])
+    ids = configuration.atoms.append(x=x, y=y, z=z, atno=template["atno"])
+    if bonds and len(template["bonds"]) > 0:
+        i, j, bondorder = zip(*template["bonds"])
+        configuration.bonds.append(
+            i=[ids[k] for k in i], j=[ids[k] for k in j], bondorder=bondorder
+        )
+    for key, values in template["columns"].items():
+        if key not in configuration.atoms:
+            if "atom_types_" in key:
+                configuration.atoms.add_attribute(key, coltype="str")
+            else:
+                configuration.atoms.add_attribute(key, coltype="float")
+        configuration.atoms.get_column(key)[:] = values
+    configuration.charge = template["charge"]
+    configuration.spin_multiplicity = template["spin_multiplicity"]
+
+
+def _cache_key(smiles):
+    """The start of the names of the files in the cache for a SMILES string."""
+    canonical = canonical_definition("SMILES", smiles)
+    return hashlib.sha256(canonical.encode()).hexdigest()[0:16]
+
+
+def cached_template_path(directory, smiles, backend):
+    """The file in the cache for the structure of a SMILES string.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The directory holding the cache.
+    smiles : str
+        The SMILES string, which is used in canonical form.
+    backend : str
+        The backend that embedded the structure, "OpenBabel" or "RDKit ETKDG".
+
+    Returns
+    -------
+    pathlib.Path
+        The file, named from a hash of the canonical SMILES and the backend.
+    """
+    return Path(directory) / f"{_cache_key(smiles)}_{_flavors[backend]}.npz"
+
+
+def save_cached_template(directory, configuration, smiles, backend):
+    """Save the embedded structure of a SMILES string in the cache.
+
+    The file is written under a temporary name and then renamed, so that jobs
+    sharing the cache never read a partial file.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The directory holding the cache, which is created if needed.
+    configuration : molsystem._Configuration
+        The embedded structure, before any forcefield is assigned.
+    smiles : str
+        The SMILES string.
+    backend : str
+        The backend that embedded the structure, "OpenBabel" or "RDKit ETKDG".
+    """
+    path = cached_template_path(directory, smiles, backend)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    template = template_arrays(configuration)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(
+                f,
+                smiles=np.array(canonical_definition("SMILES", smiles)),
+                backend=np.array(backend),
+                atno=np.array(template["atno"], dtype=int),
+                xyz=np.array(template["xyz"], dtype=float).reshape(-1, 3),
+                bonds=np.array(template["bonds"], dtype=int).reshape(-1, 3),
+                charge=np.array(template["charge"]),
+                spin_multiplicity=np.array(template["spin_multiplicity"]),
+            )
+        os.replace(tmp, path)
+    except Exception:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def find_cached_template(directory, smiles, backend=None):
+    """Find the embedded structure of a SMILES string in the cache.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The directory holding the cache.
+    smiles : str
+        The SMILES string, which is compared in canonical form.
+    backend : str
+        Only a structure embedded by this backend, or None for any.
+
+    Returns
+    -------
+    dict(str, any) or None
+        The template, as from template_arrays, or None if the SMILES is not in the
+        cache.
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        return None
+    if backend is None:
+        paths = sorted(directory.glob(f"{_cache_key(smiles)}_*.npz"))
+    else:
+        paths = [cached_template_path(directory, smiles, backend)]
+    canonical = canonical_definition("SMILES", smiles)
+    for path in paths:
+        if not path.exists():
+            continue
+        with np.load(path) as data:
+            if str(data["smiles"]) != canonical:
+                continue
+            return {
+                "atno": data["atno"].tolist(),
+                "xyz": data["xyz"].tolist(),
+                "bonds": [tuple(bond) for bond in data["bonds"].tolist()],
+                "columns": {},
+                "charge": int(data["charge"]),
+                "spin_multiplicity": int(data["spin_multiplicity"]),
+                "periodicity": 0,
+            }
+    return None
+
+
+def embed(
+    configuration,
+    smiles,
+    backend="OpenBabel",
+    cache=None,
+    conformers=1,
+    measure="radius of gyration",
+):
+    """Build the 3-D structure of a SMILES string in an empty configuration.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The empty configuration to fill.
+    smiles : str
+        The SMILES string.
+    backend : str
+        "OpenBabel", "RDKit ETKDG", or "template cache only" to use only a
+        structure already in the cache.
+    cache : str or pathlib.Path
+        The directory of the cache of embedded structures, or None for no cache.
+        A structure from the same backend in the cache is used rather than
+        embedding the SMILES again, and new structures are saved in it.
+    conformers : int
+        If more than 1, the most compact of this many conformers is used, as
+        chosen by compact_conformer.
+    measure : str
+        How compact the conformers are, as for compactness.
+
+    Returns
+    -------
+    str
+        The backend that embedded the structure, or "cache" if it was in the cache.
+    """
+    if backend not in embedding_backends:
+        raise RuntimeError(f"Do not recognize the embedding backend '{backend}'")
+    if backend == "template cache only" and cache is None:
+        raise RuntimeError(
+            "Building SMILES with 'template cache only' needs a template cache. Give "
+            "its directory with the --template-cache option."
+        )
+    embedded_by = None
+    if cache is not None:
+        template = find_cached_template(
+            cache, smiles, None if backend == "template cache only" else backend
+        )
+        if template is not None:
+            configuration_from_template(configuration, template, bonds=True)
+            embedded_by = "cache"
+    if embedded_by is None:
+        if backend == "template cache only":
+            raise RuntimeError(
+                f"The SMILES '{smiles}' is not in the template cache ({cache}). Build "
+                "it once with OpenBabel or RDKit ETKDG to add it to the cache."
+            )
+        if backend == "RDKit ETKDG" and Chem is None:
+            raise RuntimeError(
+                "Embedding with RDKit ETKDG needs the 'rdkit' package. Install it "
+                "with 'conda install -c conda-forge rdkit' or 'pip install rdkit'."
+            )
+        if backend == "RDKit ETKDG":
+            _embed_etkdg(configuration, smiles)
+        else:
+            configuration.from_smiles(smiles, flavor="openbabel")
+        if cache is not None:
+            try:
+                save_cached_template(cache, configuration, smiles, backend)
+            except OSError as e:
+                logger.warning(f"Could not save '{smiles}' in the template cache: {e}")
+        embedded_by = backend
+    if conformers > 1:
+        compact_conformer(configuration, conformers, measure)
+    return embedded_by
+
+
+def compactness(xyz, measure="radius of gyration"):
+    """How compact conformers are, smaller being more compact.
+
+    Parameters
+    ----------
+    xyz : array_like
+        The coordinates of the atoms of the conformers, n_conformers x n_atoms x 3.
+    measure : str
+        "radius of gyration", unweighted by mass, or "bounding sphere" for the
+        radius of the sphere about the center holding all the atoms.
+
+    Returns
+    -------
+    numpy.ndarray
+        The measure for each conformer, in the units of the coordinates.
+    """
+    xyz = np.asarray(xyz, dtype=float)
+    r2 = ((xyz - xyz.mean(axis=1, keepdims=True)) ** 2).sum(axis=2)
+    if measure == "radius of gyration":
+        return np.sqrt(r2.mean(axis=1))
+    elif measure == "bounding sphere":
+        return np.sqrt(r2.max(axis=1))
+    raise RuntimeError(f"Do not recognize the measure of compactness '{measure}'")
+
+
+def compact_conformer(configuration, conformers, measure="radius of gyration"):
+    """Replace the structure of a molecule with the most compact of its conformers.
+
+    Extended conformers of long, flexible molecules take much more room than
+    compact ones, which makes packing them at high densities slow. The conformers
+    are embedded by RDKit's ETKDG from random coordinates, which gives more varied
+    and compact conformers than the distance matrix, using the bonds of the
+    configuration so that the atoms keep their order. The current structure is one
+    of the candidates. Candidates with atoms more than two bonds apart closer than
+    closest_contact are overlapping rather than compact, and are only used if all
+    the candidates are.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The molecule, whose coordinates are replaced.
+    conformers : int
+        The number of conformers to choose from, including the current one.
+    measure : str
+        How compact the conformers are, as for compactness.
+
+    Returns
+    -------
+    (float, float)
+        The measure of the current structure and of the one chosen.
+    """
+    if Chem is None:
+        raise RuntimeError(
+            "Choosing compact conformers needs the 'rdkit' package. Install it with "
+            "'conda install -c conda-forge rdkit' or 'pip install rdkit'."
+        )
+    mol = configuration.to_RDKMol()
+    if any(len(ring) <= 4 for ring in Chem.GetSymmSSSR(mol)):
+        parameters = rdDistGeom.srETKDGv3()
+    else:
+        parameters = rdDistGeom.ETKDGv3()
+    parameters.randomSeed = _seed
+    parameters.useRandomCoords = True
+    ids = rdDistGeom.EmbedMultipleConfs(mol, conformers - 1, parameters)
+
+    xyz = [np.array(configuration.atoms.get_coordinates(fractionals=False))]
+    xyz.extend(mol.GetConformer(i).GetPositions() for i in ids)
+    values = compactness(xyz, measure)
+
+    # Skip conformers with overlapping atoms, one conformer at a time for memory
+    far = Chem.GetDistanceMatrix(mol) > 2
+    if far.any():
+        overlapping = [
+            np.linalg.norm(x[:, None, :] - x[None, :, :], axis=2)[far].min()
+            < closest_contact
+            for x in xyz
+        ]
+        if not all(overlapping):
+            values = np.where(overlapping, np.inf, values)
+    best = int(np.argmin(values))
+    if best > 0:
+        conformer = mol.GetConformer(ids[best - 1])
+        rdMolTransforms.CanonicalizeConformer(conformer, ignoreHs=False)
+        configuration.atoms.set_coordinates(
+            conformer.GetPositions().tolist(), fractionals=False
+        )
+    before = float(compactness(xyz[0:1], measure)[0])
+    return before, float(values[best])
+
+
+def _embed_etkdg(configuration, smiles):
+    """Embed a SMILES string with RDKit's ETKDG, in the standard orientation.
+
+    Large, flexible molecules such as polymers often fail to embed from the
+    distance matrix, so they are retried from random coordinates.
+    """
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        raise RuntimeError(f"SMILES '{smiles}' is not valid.")
+    mol = Chem.AddHs(mol)
+    if any(len(ring) <= 4 for ring in Chem.GetSymmSSSR(mol)):
+        parameters = rdDistGeom.srETKDGv3()
+    else:
+        parameters = rdDistGeom.ETKDGv3()
+    parameters.randomSeed = _seed
+    if rdDistGeom.EmbedMolecule(mol, parameters) == -1:
+        parameters.useRandomCoords = True
+        if rdDistGeom.EmbedMolecule(mol, parameters) == -1:
+            raise RuntimeError(f"RDKit's ETKDG could not embed the SMILES '{smiles}'")
+    rdMolTransforms.CanonicalizeConformer(mol.GetConformer(), ignoreHs=False)
+    name = configuration.name
+    configuration.from_RDKMol(mol, properties=None)
+    configuration.name = name
+
+
+def smiles_template(
+    definition,
+    ff=None,
+    backend="OpenBabel",
+    cache=None,
+    conformers=1,
+    measure="radius of gyration",
+):
+    """Embed a SMILES string and assign the forcefield, returning the template.
+
+    Parameters
+    ----------
+    definition : str
+        The SMILES string.
+    ff : seamm_ff_util.Forcefield
+        The forcefield to assign, or None. Defaults to that given to the worker.
+    backend : str
+        The backend for embedding the SMILES, as for embed.
+    cache : str or pathlib.Path
+        The directory of the cache of embedded structures, or None.
+    conformers : int
+        The number of conformers to choose the most compact from, as for embed.
+    measure : str
+        How compact the conformers are, as for compactness.
+
+    Returns
+    -------
+    dict(str, any)
+        The data from template_arrays, with the "embedded by", as returned by
+        embed, and the "embedding time" in seconds.
+    """
+    if ff is None:
+        ff = _forcefield
+    name = f"file:packmol_template_{os.getpid()}_{next(_counter)}"
+    db = SystemDB(filename=f"{name}?mode=memory&cache=shared")
+    try:
+        system = db.create_system(name=definition)
+        configuration = system.create_configuration(name="default")
+        t0 = time.perf_counter()
+        embedded_by = embed(
+            configuration, definition, backend, cache, conformers, measure
+        )
+        t = time.perf_counter() - t0
+        if ff is not None:
+            ff.assign_forcefield(configuration)
+        template = template_arrays(configuration)
+        template["embedded by"] = embedded_by
+        template["embedding time"] = t
+        return template
+    finally:
+        db.close()
+
+
+def prepare_templates(
+    definitions,
+    ff=None,
+    n_processes=1,
+    backend="OpenBabel",
+    cache=None,
+    conformers=1,
+    measure="radius of gyration",
+):
+    """Prepare the templates for SMILES strings, in parallel if requested.
+
+    If the pool of processes cannot be used, for example because the forcefield
+    cannot be sent to the workers, the templates are prepared one after another.
+    Errors in preparing a template, such as an invalid SMILES, are raised.
+
+    Parameters
+    ----------
+    definitions : [str]
+        The SMILES strings.
+    ff : seamm_ff_util.Forcefield
+        The forcefield to assign, or None.
+    n_processes : int
+        The number of processes to use.
+    backend : str
+        The backend for embedding the SMILES, as for embed.
+    cache : str or pathlib.Path
+        The directory of the cache of embedded structures, or None.
+    conformers : int
+        The number of conformers to choose the most compact from, as for embed.
+    measure : str
+        How compact the conformers are, as for compactness.
+
+    Returns
+    -------
+    dict(str, dict(str, any))
+        The template for each SMILES string.
+    """
+    definitions = list(dict.fromkeys(definitions))
+    work = functools.partial(
+        smiles_template,
+        backend=backend,
+        cache=cache,
+        conformers=conformers,
+        measure=measure,
+    )
+    n_processes = min(n_processes, len(definitions))
+    if n_processes > 1:
+        # Only failing to start the processes falls back to running serially, so
+        # that errors in the workers, including OSErrors, are raised.
+        try:
+            pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_processes, initializer=_initialize, initargs=(ff,)
+            )
+        except OSError as e:
+            pool = None
+            logger.warning(
+                f"Could not start the processes for the templates ({e}), so preparing "
+                "them serially."
+            )
+        if pool is not None:
+            try:
+                with pool:
+                    templates = list(pool.map(work, definitions))
+                return dict(zip(definitions, templates))
+            except (BrokenProcessPool, PicklingError) as e:
+                logger.warning(
+                    f"Could not prepare the templates in parallel ({e}), so "
+                    "preparing them serially."
+                )
+    return {definition: work(definition, ff) for definition in definitions}
+
+
+def _initialize(ff):
+    """Set the forcefield in a worker process."""
+    global _forcefield
+    _forcefield = ff
@@ -39,7 +39,7 @@ class TkPackmol(seamm.TkNode):
         # Create all the widgets
         P = self.node.parameters
         for key in P:
-            if key not in ("molecules",):
+            if key not in ("molecules", "results", "create tables"):
                 self[key] = P[key].widget(frame)
 
         # Frame for specifying molecules
@@ -54,13 +54,25 @@ class TkPackmol(seamm.TkNode):
         for molecule in P["molecules"].value:
             self._molecule_data.append({**molecule})
 
-        for key in ("periodic", "shape", "dimensions", "fluid amount"):
+        for key in (
+            "mode",
+            "periodic",
+            "shape",
+            "dimensions",
+            "fluid amount",
+            "predict resources",
+            "stop early",
+            "solute representation",
+        ):
             self[key].combobox.bind("<<ComboboxSelected>>", self.reset_dialog)
             self[key].combobox.bind("<Return>", self.reset_dialog)
             self[key].combobox.bind("<FocusOut>", self.reset_dialog)
 
         self.reset_dialog()
 
+        # The results that can be saved
+        self.setup_results()
+
         # Resize the dialog to fill the screen, more or less.
         self.fit_dialog()
 
@@ -92,14 +104,54 @@ class TkPackmol(seamm.TkNode):
         # The dimensions control the remaining widgets
         dimensions = self["dimensions"].get()
 
+        # When adding to the current configuration, it gives the cell
+        adding = self["mode"].get() == "add to the current configuration"
+
+        # A layered cell is made of slabs of a given thickness and density, and
+        # separate regions are spheres or boxes in a given cell.
+        layered = self["mode"].get() == "build a layered cell"
+        separate = self["mode"].get() == "build separate regions"
+
         widgets = []
         row = 0
-        for key in ("periodic", "shape", "dimensions"):
-            self[key].grid(row=row, column=0, sticky=tk.EW)
-            row += 1
-            widgets.append(self[key])
+        self["mode"].grid(row=row, column=0, sticky=tk.EW)
+        row += 1
+        widgets.append(self["mode"])
+        if not (adding or layered or separate):
+            for key in ("periodic", "shape", "dimensions"):
+                self[key].grid(row=row, column=0, sticky=tk.EW)
+                row += 1
+                widgets.append(self[key])
 
-        if dimensions == "given explicitly":
+        if adding:
+            pass
+        elif layered:
+            for key in (
+                "a",
+                "b",
+                "layer compositions",
+                "layer densities",
+                "layer thicknesses",
+                "interface gap",
+            ):
+                self[key].grid(row=row, column=0, sticky=tk.EW)
+                row += 1
+                widgets.append(self[key])
+        elif separate:
+            for key in (
+                "a",
+                "b",
+                "c",
+                "region shapes",
+                "region sizes",
+                "region compositions",
+                "region densities",
+                "region spacing",
+            ):
+                self[key].grid(row=row, column=0, sticky=tk.EW)
+                row += 1
+                widgets.append(self[key])
+        elif dimensions == "given explicitly":
             if shape == "cubic":
                 keys = ("edge length",)
             elif shape == "rectangular":
@@ -122,7 +174,7 @@ class TkPackmol(seamm.TkNode):
                 row += 1
                 widgets.append(self[key])
         elif dimensions == "calculated from the solute dimensions":
-            keys = ("solvent thickness",)
+            keys = ("solvent thickness", "solvation")
             for key in keys:
                 self[key].grid(row=row, column=0, sticky=tk.EW)
                 row += 1
@@ -132,6 +184,8 @@ class TkPackmol(seamm.TkNode):
                 keys = ("density", "a_ratio", "b_ratio", "c_ratio")
             else:
                 keys = ("density",)
+            if periodic == "Yes":
+                keys = (*keys, "density series", "series minimum distance")
             for key in keys:
                 self[key].grid(row=row, column=0, sticky=tk.EW)
                 row += 1
@@ -148,56 +202,111 @@ class TkPackmol(seamm.TkNode):
         else:
             raise RuntimeError(f"Do not recognize dimensions '{dimensions}'")
 
-        # Next we need the amount of material. However the options change depending on
-        # the above
-        amount = self["fluid amount"].get()
-        if dimensions in (
-            "calculated from the density",
-            "calculated using the Ideal Gas Law",
-        ):
-            amounts = PackmolParameters.amounts_for_density
-        elif dimensions in ("calculated from the solute dimensions",):
-            amounts = PackmolParameters.amounts_for_layer
-        else:
-            amounts = PackmolParameters.amounts
-        self["fluid amount"].combobox.config(values=amounts)
-        if amount not in amounts:
-            amount = amounts[0]
-        self["fluid amount"].set(amount)
-
-        for key in ("fluid amount",):
-            self[key].grid(row=row, column=0, sticky=tk.EW)
-            row += 1
-            widgets.append(self[key])
+        if not (layered or separate):
+            # Next we need the amount of material. However the options change
+            # depending on the above
+            amount = self["fluid amount"].get()
+            if adding:
+                amounts = PackmolParameters.amounts
+            elif dimensions in (
+                "calculated from the density",
+                "calculated using the Ideal Gas Law",
+            ):
+                amounts = PackmolParameters.amounts_for_density
+            elif dimensions in ("calculated from the solute dimensions",):
+                amounts = PackmolParameters.amounts_for_layer
+            else:
+                amounts = PackmolParameters.amounts
+            self["fluid amount"].combobox.config(values=amounts)
+            if amount not in amounts:
+                amount = amounts[0]
+            self["fluid amount"].set(amount)
 
-        if amount == "rounding this number of atoms":
-            for key in ("approximate number of atoms",):
+            for key in ("fluid amount",):
                 self[key].grid(row=row, column=0, sticky=tk.EW)
                 row += 1
                 widgets.append(self[key])
-        elif amount == "rounding this number of molecules":
-            for key in ("approximate number of molecules",):
-                self[key].grid(row=row, column=0, sticky=tk.EW)
-                row += 1
-                widgets.append(self[key])
-        elif amount == "using the density":
-            for key in ("density",):
-                self[key].grid(row=row, column=0, sticky=tk.EW)
-                row += 1
-                widgets.append(self[key])
-        elif amount == "using the Ideal Gas Law":
-            for key in ("temperature", "pressure"):
+
+            if amount == "rounding this number of atoms":
+                for key in ("approximate number of atoms",):
+                    self[key].grid(row=row, column=0, sticky=tk.EW)
+                    row += 1
+                    widgets.append(self[key])
+            elif amount == "rounding this number of molecules":
+                for key in ("approximate number of molecules",):
+                    self[key].grid(row=row, column=0, sticky=tk.EW)
+                    row += 1
+                    widgets.append(self[key])
+            elif amount == "using the density":
+                for key in ("density",):
+                    self[key].grid(row=row, column=0, sticky=tk.EW)
+                    row += 1
+                    widgets.append(self[key])
+            elif amount == "using the Ideal Gas Law":
+                for key in ("temperature", "pressure"):
+                    self[key].grid(row=row, column=0, sticky=tk.EW)
+                    row += 1
+                    widgets.append(self[key])
+            else:
+                raise RuntimeError(f"Do not recognize amount '{amount}'")
+
+            if periodic == "Yes" and not adding:
+                for key in ("composition series", "series minimum distance"):
+                    if self[key] not in widgets:
+                        self[key].grid(row=row, column=0, sticky=tk.EW)
+                        row += 1
+                        widgets.append(self[key])
+
+            keys = ["solute representation"]
+            if self["solute representation"].get() == "exclusion spheres":
+                keys.append("exclusion sphere size")
+            for key in keys:
                 self[key].grid(row=row, column=0, sticky=tk.EW)
                 row += 1
                 widgets.append(self[key])
-        else:
-            raise RuntimeError(f"Do not recognize amount '{amount}'")
 
-        key = "assign forcefield"
+        for key in (
+            "embedding",
+            "conformers",
+            "conformer measure",
+            "assign forcefield",
+        ):
+            self[key].grid(row=row, column=0, sticky=tk.EW)
+            row += 1
+            widgets.append(self[key])
+
+        key = "packing method"
         self[key].grid(row=row, column=0, sticky=tk.EW)
         row += 1
         widgets.append(self[key])
 
+        if not (layered or separate):
+            key = "predict resources"
+            self[key].grid(row=row, column=0, sticky=tk.EW)
+            row += 1
+            widgets.append(self[key])
+            if self[key].get() != "No":
+                for key in ("time budget", "memory budget"):
+                    self[key].grid(row=row, column=0, sticky=tk.EW)
+                    row += 1
+                    widgets.append(self[key])
+
+            key = "stop early"
+            self[key].grid(row=row, column=0, sticky=tk.EW)
+            row += 1
+            widgets.append(self[key])
+            criterion = self[key].get()
+            limit = {
+                "objective function below": "maximum objective",
+                "minimum distance above": "stop early minimum distance",
+                "time limit": "time limit",
+            }
+            if criterion in limit and self[limit[criterion]] not in widgets:
+                key = limit[criterion]
+                self[key].grid(row=row, column=0, sticky=tk.EW)
+                row += 1
+                widgets.append(self[key])
+
         sw.align_labels(widgets, sticky=tk.E)
 
         # The table of molecules to use
@@ -347,7 +456,7 @@ class TkPackmol(seamm.TkNode):
         P = self.node.parameters
 
         for key in P:
-            if key not in ("molecules",):
+            if key not in ("molecules", "results", "create tables"):
                 P[key].set_from_widget()
 
         # And handle the molecules
@@ -3,6 +3,9 @@
 
 """Fixtures for testing the packmol_step package."""
 
+from pathlib import Path
+import sys
+
 import pytest
 
 from molsystem import SystemDB
@@ -93,3 +96,18 @@ def Argon(configuration):
     configuration.atoms.append(x=0.0, y=0.0, z=0.0, symbol=["Ar"])
 
     return configuration
+
+
+@pytest.fixture()
+def fake_packmol(tmp_path):
+    """A SEAMM root whose packmol.ini runs the fake Packmol in tests/."""
+    root = tmp_path / "SEAMM"
+    root.mkdir()
+    fake = Path(__file__).resolve().parent / "fake_packmol.py"
+    (root / "packmol.ini").write_text(
+        "# Run the fake Packmol for testing\n\n"
+        "[local]\n"
+        "installation = local\n"
+        f"code = {sys.executable} {fake}\n"
+    )
+    return root
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A fast stand-in for Packmol, for testing and benchmarking the step.
+
+It reads Packmol's input from stdin, like Packmol, and writes the output structure
+and a log to stdout in the form that Packmol uses. Rather than optimizing, the
+molecules are placed without rotation on a simple lattice filling their region, so
+the placements are deterministic and cheap for any number of atoms.
+
+The understood keywords are tolerance, output, filetype (pdb or xyz), pbc,
+writeout, restart_to and restart_from, and in structures number, inside cube, box
+and sphere, outside box, center, fixed, radius, restart_to and restart_from. Others
+are ignored.
+
+Two environment variables control how it runs:
+
+    FAKE_PACKMOL_LOOPS  the number of GENCAN loops to report, default 1
+    FAKE_PACKMOL_DELAY  the time in seconds that each loop takes, default 0
+"""
+
+import math
+import os
+from pathlib import Path
+import sys
+import time
+
+
+def read_input(text):
+    """Parse Packmol's input into the global keywords and the structures."""
+    keywords = {}
+    structures = []
+    structure = None
+    for line in text.splitlines():
+        words = line.split("#")[0].split()
+        if len(words) == 0:
+            continue
+        key = words[0].lower()
+        if key == "structure":
+            structure = {"file": words[1], "number": 1, "constraints": []}
+        elif key == "end" and structure is not None:
+            structures.append(structure)
+            structure = None
+        elif structure is not None:
+            if key in ("inside", "outside"):
+                structure["constraints"].append(
+                    (key, words[1], [float(x) for x in words[2:]])
+                )
+            elif key == "number":
+                structure["number"] = int(words[1])
+            elif key == "center":
+                structure["center"] = True
+            elif key == "fixed":
+                structure["fixed"] = [float(x) for x in words[1:4]]
+            else:
+                structure[key] = words[1:]
+        else:
+            keywords[key] = words[1:]
+    return keywords, structures
+
+
+def read_template(path, filetype="pdb"):
+    """The atom lines, symbols and coordinates of a PDB or xyz template."""
+    lines = []
+    symbols = []
+    xyz = []
+    if filetype == "xyz":
+        for line in Path(path).read_text().splitlines()[2:]:
+            words = line.split()
+            if len(words) >= 4:
+                lines.append(line)
+                symbols.append(words[0])
+                xyz.append(tuple(float(x) for x in words[1:4]))
+    else:
+        for line in Path(path).read_text().splitlines():
+            if line[0:6] in ("ATOM  ", "HETATM"):
+                lines.append(f"{line:<80s}")
+                symbols.append(line[76:78].strip())
+                xyz.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    return lines, symbols, xyz
+
+
+def bounds(constraints, pbc):
+    """The box around the region, and a test for points inside it."""
+    inside = [c for c in constraints if c[0] == "inside"]
+    outside = [c for c in constraints if c[0] == "outside"]
+    if len(inside) > 0:
+        _, shape, values = inside[0]
+        if shape == "cube":
+            x, y, z, d = values
+            lo, hi = (x, y, z), (x + d, y + d, z + d)
+        elif shape == "box":
+            lo, hi = tuple(values[0:3]), tuple(values[3:6])
+        elif shape == "sphere":
+            x, y, z, r = values
+            lo, hi = (x - r, y - r, z - r), (x + r, y + r, z + r)
+        else:
+            raise RuntimeError(f"The fake Packmol cannot handle 'inside {shape}'")
+    elif pbc is not None:
+        lo, hi = pbc
+    else:
+        raise RuntimeError("The fake Packmol needs a region or pbc for each structure")
+
+    def ok(point):
+        for kind, shape, values in inside + outside:
+            if shape == "sphere":
+                x, y, z, r = values
+                is_inside = math.dist(point, (x, y, z)) <= r
+            else:
+                if shape == "cube":
+                    x0, y0, z0, d = values
+                    x1, y1, z1 = x0 + d, y0 + d, z0 + d
+                else:
+                    x0, y0, z0, x1, y1, z1 = values
+                is_inside = all(
+                    a <= p <= b for p, a, b in zip(point, (x0, y0, z0), (x1, y1, z1))
+                )
+            if is_inside != (kind == "inside"):
+                return False
+        return True
+
+    return lo, hi, ok
+
+
+def lattice(n, lo, hi, ok):
+    """At least n points on a simple lattice in the region."""
+    if n == 0:
+        return []
+    k = max(1, math.ceil(n ** (1 / 3)))
+    while True:
+        steps = [(b - a) / k for a, b in zip(lo, hi)]
+        points = []
+        for i in range(k):
+            x = lo[0] + (i + 0.5) * steps[0]
+            for j in range(k):
+                y = lo[1] + (j + 0.5) * steps[1]
+                for m in range(k):
+                    point = (x, y, lo[2] + (m + 0.5) * steps[2])
+                    if ok(point):
+                        points.append(point)
+        if len(points) >= n:
+            return points[0:n]
+        k += 1
+
+
+def read_centers(path):
+    """The centers of the molecules in a Packmol restart file."""
+    centers = []
+    for line in Path(path).read_text().splitlines():
+        values = line.split()
+        if len(values) == 6:
+            centers.append(tuple(float(x) for x in values[0:3]))
+    return centers
+
+
+def write_restart(path, centers):
+    """Write a Packmol restart file with the centers and no rotation."""
+    lines = [
+        f" {x:23.16e} {y:23.16e} {z:23.16e} {0.0:23.16e} {0.0:23.16e} {0.0:23.16e}"
+        for x, y, z in centers
+    ]
+    Path(path).write_text("\n".join(lines) + "\n")
+
+
+def pack(keywords, structures, filetype="pdb"):
+    """Place the molecules, returning the structure and centers of each."""
+    pbc = None
+    if "pbc" in keywords:
+        values = [float(x) for x in keywords["pbc"]]
+        if len(values) == 3:
+            pbc = ((0.0, 0.0, 0.0), tuple(values))
+        else:
+            pbc = (tuple(values[0:3]), tuple(values[3:6]))
+
+    # Share one lattice between the structures in the same region
+    regions = {}
+    for structure in structures:
+        if "fixed" in structure or "restart_from" in structure:
+            continue
+        key = repr(structure["constraints"])
+        regions.setdefault(key, []).append(structure)
+    for group in regions.values():
+        n = sum(structure["number"] for structure in group)
+        points = lattice(n, *bounds(group[0]["constraints"], pbc))
+        for structure in group:
+            structure["centers"] = points[0 : structure["number"]]
+            points = points[structure["number"] :]
+
+    for structure in structures:
+        lines, symbols, xyz = read_template(structure["file"], filetype)
+        structure["lines"] = lines
+        structure["symbols"] = symbols
+        n = len(xyz)
+        center = [sum(p[i] for p in xyz) / n for i in range(3)]
+        if "fixed" in structure:
+            if structure.get("center", False):
+                xyz = [[p[i] - center[i] for i in range(3)] for p in xyz]
+            structure["xyz"] = [
+                [x + dx for x, dx in zip(p, structure["fixed"])] for p in xyz
+            ]
+            structure["centers"] = []
+            continue
+        if "restart_from" in structure:
+            structure["centers"] = read_centers(structure["restart_from"][0])
+        relative = [[p[i] - center[i] for i in range(3)] for p in xyz]
+        structure["xyz"] = [
+            [x + dx for x, dx in zip(p, c)]
+            for c in structure["centers"]
+            for p in relative
+        ]
+
+
+def write_structure(path, filetype, structures):
+    """Write the packed structure as PDB or xyz."""
+    lines = []
+    if filetype == "xyz":
+        n = sum(len(structure["xyz"]) for structure in structures)
+        lines.append(f"{n}")
+        lines.append(" Built with the fake Packmol")
+        for structure in structures:
+            symbols = structure["symbols"]
+            n_atoms = len(symbols)
+            for i, (x, y, z) in enumerate(structure["xyz"]):
+                lines.append(
+                    f" {symbols[i % n_atoms]:2s} {x:14.6f} {y:14.6f} {z:14.6f}"
+                )
+    else:
+        lines.append("REMARK   Built with the fake Packmol")
+        serial = 0
+        residue = 0
+        for structure in structures:
+            template = structure["lines"]
+            n_atoms = len(template)
+            for i, (x, y, z) in enumerate(structure["xyz"]):
+                if i % n_atoms == 0:
+                    residue += 1
+                serial += 1
+                line = template[i % n_atoms]
+                lines.append(
+                    f"{line[0:6]}{serial % 100000:5d}{line[11:22]}"
+                    f"{residue % 10000:4d}{line[26:30]}{x:8.3f}{y:8.3f}{z:8.3f}"
+                    f"{line[54:80]}".rstrip()
+                )
+        lines.append("END")
+    Path(path).write_text("\n".join(lines) + "\n")
+
+
+def main():
+    t0 = time.perf_counter()
+    keywords, structures = read_input(sys.stdin.read())
+    tolerance = float(keywords.get("tolerance", ["2.0"])[0])
+    output = keywords.get("output", ["packmol.pdb"])[0]
+    filetype = keywords.get("filetype", ["pdb"])[0]
+    writeout = int(keywords.get("writeout", ["10"])[0])
+    n_loops = int(os.environ.get("FAKE_PACKMOL_LOOPS", "1"))
+    delay = float(os.environ.get("FAKE_PACKMOL_DELAY", "0"))
+
+    pack(keywords, structures, filetype)
+
+    def write_all():
+        write_structure(output, filetype, structures)
+        if "restart_to" in keywords:
+            centers = [c for structure in structures for c in structure["centers"]]
+            write_restart(keywords["restart_to"][0], centers)
+        for structure in structures:
+            if "restart_to" in structure:
+                write_restart(structure["restart_to"][0], structure["centers"])
+
+    out = sys.stdout
+    out.write(
+        "#" * 80 + "\n\n PACKMOL - Packing optimization for the automated generation "
+        "of\n starting configurations for molecular dynamics simulations.\n\n"
+        "                                Version 20.99.0 (fake)\n\n" + "#" * 80 + "\n"
+    )
+    out.write("\n  Packing all molecules together\n")
+    out.flush()
+    f_best = 1.0e3
+    for loop in range(n_loops):
+        time.sleep(delay)
+        fraction = (loop + 1) / n_loops
+        f = 1.0e3 * (1.0 - fraction)
+        violation = tolerance * (1.0 - fraction)
+        out.write(
+            f"\n  Starting GENCAN loop: {loop:12d}\n"
+            f"  Function value from last GENCAN loop: f = {f:.5E}\n"
+            f"  Best function value before: f = {f_best:.5E}\n"
+            f"  Maximum violation of target distance: {violation:12.6f}\n"
+            "  Maximum violation of the constraints: .00000E+00\n"
+        )
+        f_best = f
+        if (loop + 1) % writeout == 0 or loop + 1 == n_loops:
+            write_all()
+            out.write(f"  Current solution written to file: {output}\n")
+        out.flush()
+
+    out.write(
+        "\n" + "#" * 80 + "\n\n                                 Success! \n\n"
+        "              Final objective function value: .00000E+00\n"
+        "              Maximum violation of target distance:   0.000000\n"
+        "              Maximum violation of the constraints: .00000E+00\n\n"
+        + "-" * 80
+        + "\n\n"
+        f"   Running time: {time.perf_counter() - t0:12.6f} seconds.\n"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for adding molecules to the current configuration."""
+
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+
+fake = Path(__file__).resolve().parent / "fake_packmol.py"
+
+
+@pytest.fixture()
+def argon_box(configuration):
+    """A periodic 20 Å box with 64 argon atoms in fractional coordinates."""
+    configuration.periodicity = 3
+    configuration.cell.parameters = (20.0, 20.0, 20.0, 90.0, 90.0, 90.0)
+    configuration.coordinate_system = "fractional"
+    fractions = [(i + 0.5) / 4 for i in range(4)]
+    xyz = [(x, y, z) for x in fractions for y in fractions for z in fractions]
+    x, y, z = zip(*xyz)
+    configuration.atoms.append(x=x, y=y, z=z, symbol=["Ar"] * 64)
+    return configuration
+
+
+def get_input(db, P):
+    """Run get_input with the temporary database."""
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    try:
+        return packmol_step.Packmol.get_input(P, db, tmp_db, seamm.flowchart_variables)
+    finally:
+        tmp_db.close()
+
+
+def parameters(**values):
+    """The parameters for adding water to the current configuration."""
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters["mode"].value = "add to the current configuration"
+    parameters["molecules"].value = [
+        {"component": "fluid", "source": "SMILES", "definition": "O", "count": "1"}
+    ]
+    parameters["fluid amount"].value = "rounding this number of molecules"
+    parameters["approximate number of molecules"].value = 10
+    for key, value in values.items():
+        parameters[key].value = value
+    return parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+
+
+@pytest.mark.unit
+def test_add_input(db, argon_box):
+    """The current configuration is fixed in its cell and the water is added."""
+    molecules, files, text, cell = get_input(db, parameters())
+
+    assert cell == (20.0, 20.0, 20.0)
+    assert "pbc 20.0000 20.0000 20.0000" in files["input.inp"]
+    assert "   fixed 0.0 0.0 0.0 0.0 0.0 0.0\n   number 1\n" in files["input.inp"]
+    assert "   number 10\n" in files["input.inp"]
+    assert molecules[0]["bonds"] == []
+
+
+@pytest.mark.unit
+def test_add_to_configuration(db, argon_box, tmp_path):
+    """Only the new atoms and bonds are appended."""
+    before = argon_box.atoms.get_coordinates(fractionals=True)
+    molecules, files, text, cell = get_input(db, parameters())
+
+    for name, data in files.items():
+        (tmp_path / name).write_text(data)
+    with open(tmp_path / "input.inp") as fd:
+        subprocess.run(
+            [sys.executable, str(fake)],
+            stdin=fd,
+            cwd=tmp_path,
+            capture_output=True,
+            check=True,
+        )
+
+    water = molecules[1]
+    bonds = [(i + 3 * k, j + 3 * k, o) for k in range(10) for i, j, o in water["bonds"]]
+    ids = packmol_step.append_atoms(
+        argon_box,
+        (tmp_path / "packmol.pdb").read_text(),
+        64,
+        30,
+        bonds=tuple(zip(*bonds)),
+    )
+
+    assert len(ids) == 30
+    assert argon_box.n_atoms == 94
+    assert argon_box.bonds.n_bonds == 20
+    assert argon_box.atoms.symbols[64:67] == ["O", "H", "H"]
+    assert argon_box.atoms.get_coordinates(fractionals=True)[0:64] == before
+    xyz = argon_box.atoms.get_coordinates(fractionals=True)[64:]
+    assert all(0.0 <= value <= 1.0 for point in xyz for value in point)
+
+
+@pytest.mark.unit
+def test_nothing_to_add(db, argon_box):
+    """Adding to an already dense configuration is an error."""
+    P = parameters(
+        **{
+            "fluid amount": "using the density",
+            "density": 0.001,
+        }
+    )
+    with pytest.raises(RuntimeError, match="no molecules to add"):
+        get_input(db, P)
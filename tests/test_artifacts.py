@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for handling the files from Packmol."""
+
+import gzip
+
+import pytest
+
+from packmol_step import (
+    archive,
+    copy_back,
+    load_coordinates,
+    read_artifact,
+    remove_artifacts,
+    save_coordinates,
+)
+
+
+@pytest.fixture()
+def scratch(tmp_path):
+    """A scratch directory after a Packmol run."""
+    path = tmp_path / "scratch"
+    path.mkdir()
+    (path / "input.inp").write_text("tolerance 2.0\n")
+    (path / "input_1.pdb").write_text("ATOM\n" * 100)
+    (path / "packmol.out").write_text("Success!\n")
+    (path / "packmol.pdb").write_text("HETATM\n" * 1000)
+    return path
+
+
+@pytest.mark.unit
+def test_copy_back(tmp_path, scratch):
+    """Only the chosen files are copied back."""
+    step = tmp_path / "step"
+    metrics = copy_back(scratch, step, ["packmol.*"])
+
+    assert sorted(p.name for p in step.iterdir()) == ["packmol.out", "packmol.pdb"]
+    assert metrics["bytes copied back"] == 9 + 7000
+    assert metrics["bytes kept off the step directory"] == 14 + 500
+
+
+@pytest.mark.unit
+def test_copy_back_gzip(tmp_path, scratch):
+    """The files copied back can be compressed."""
+    step = tmp_path / "step"
+    metrics = copy_back(scratch, step, ["packmol.pdb"], compress="gzip")
+
+    path = step / "packmol.pdb.gz"
+    assert gzip.decompress(path.read_bytes()).decode() == "HETATM\n" * 1000
+    assert metrics["bytes copied back"] == path.stat().st_size
+
+
+@pytest.mark.unit
+def test_archive(scratch):
+    """Archived files are compressed and read back transparently."""
+    before, after = archive(scratch)
+
+    assert before == 14 + 500 + 9 + 7000
+    assert after < before
+    assert sorted(p.name for p in scratch.iterdir()) == [
+        "input.inp.gz",
+        "input_1.pdb.gz",
+        "packmol.out.gz",
+        "packmol.pdb.gz",
+    ]
+    assert read_artifact(scratch, "packmol.out") == "Success!\n"
+
+
+@pytest.mark.unit
+def test_archive_twice(scratch):
+    """Files that are already compressed are not compressed again."""
+    (scratch / "coarse.out").write_text("Success!\n")
+    archive(scratch)
+    before, after = archive(scratch)
+
+    assert before == after == 0
+    assert "coarse.out.gz" in [p.name for p in scratch.iterdir()]
+    assert not any(p.name.endswith(".gz.gz") for p in scratch.iterdir())
+
+
+@pytest.mark.unit
+def test_remove_artifacts(scratch):
+    """Removing the artifacts handles both plain and compressed files."""
+    archive(scratch, patterns=["packmol.pdb"])
+    removed = remove_artifacts(scratch)
+
+    assert removed > 14 + 500 + 9
+    assert list(scratch.iterdir()) == []
+
+
+@pytest.mark.unit
+def test_coordinates(tmp_path):
+    """The compact coordinate file holds the coordinates, symbols and cell."""
+    path = tmp_path / "packmol.npz"
+    save_coordinates(path, [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]], ["Ar", "Ne"], (5, 6, 7))
+    data = load_coordinates(path)
+
+    assert data["xyz"].tolist() == [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]]
+    assert data["symbols"].tolist() == ["Ar", "Ne"]
+    assert data["cell"].tolist() == [5.0, 6.0, 7.0]
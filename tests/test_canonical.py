@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the canonical forms of the definitions of components."""
+
+import pytest
+
+from packmol_step import canonical_definition
+
+
+@pytest.mark.unit
+def test_canonical_definition():
+    """Whitespace is removed, and an empty configuration is the current one."""
+    assert canonical_definition("configuration", "  ") == "current"
+    assert canonical_definition("configuration", " water/1 ") == "water/1"
+    assert canonical_definition("SMILES", "not a SMILES ") == "not a SMILES"
+
+
+@pytest.mark.unit
+def test_canonical_smiles():
+    """With RDKit, different SMILES for one molecule have the same form."""
+    pytest.importorskip("rdkit")
+    assert canonical_definition("SMILES", "[OH2]") == canonical_definition(
+        "SMILES", " O"
+    )
+    assert canonical_definition("SMILES", "OC") == canonical_definition("SMILES", "CO")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for checkpointing and resuming Packmol."""
+
+import pytest
+import seamm
+
+import packmol_step
+
+
+@pytest.fixture()
+def step(tmp_path):
+    """A Packmol step in a flowchart in a temporary directory."""
+    flowchart = seamm.Flowchart(directory=str(tmp_path))
+    instance = packmol_step.Packmol(flowchart=flowchart)
+    instance._id = ("1",)
+    return instance
+
+
+def input_files(template="ATOM 1\n"):
+    """The input files for a simple Packmol run."""
+    return {
+        "input_1.pdb": template,
+        "input.inp": (
+            "seed -1\ntolerance 2.0\noutput packmol.pdb\nfiletype pdb\n"
+            "structure input_1.pdb\n   number 10\nend structure\n"
+        ),
+    }
+
+
+@pytest.mark.unit
+def test_resume(step, tmp_path):
+    """A rerun with the same input resumes with the same templates."""
+    files = input_files()
+    assert not step._checkpoint(files, 5, False)
+    assert "writeout 5\nrestart_to checkpoint/packmol.restart\nstructure" in (
+        files["input.inp"]
+    )
+    assert "restart_from" not in files["input.inp"]
+
+    # Packmol writes the restart file, then the job is stopped
+    (tmp_path / "1" / "checkpoint" / "packmol.restart").write_text("1.0 2.0 3.0\n")
+
+    files = input_files(template="ATOM 2\n")
+    assert step._checkpoint(files, 5, False)
+    assert "restart_from checkpoint/packmol.restart\n" in files["input.inp"]
+    assert files["input_1.pdb"] == "ATOM 1\n"
+
+
+@pytest.mark.unit
+def test_changed_input(step, tmp_path):
+    """A rerun with different input starts from scratch."""
+    step._checkpoint(input_files(), 5, False)
+    (tmp_path / "1" / "checkpoint" / "packmol.restart").write_text("1.0 2.0 3.0\n")
+
+    files = input_files()
+    files["input.inp"] = files["input.inp"].replace("number 10", "number 11")
+    assert not step._checkpoint(files, 5, True)
+    assert "restart_from" not in files["input.inp"]
+    assert not (tmp_path / "1" / "checkpoint" / "packmol.restart").exists()
+    restart = (tmp_path / "1" / "checkpoint" / "packmol.restart").resolve()
+    assert f"restart_to {restart}\n" in files["input.inp"]
+
+
+@pytest.mark.unit
+def test_checkpoint_and_monitor(step, tmp_path):
+    """Monitoring keeps the checkpoint, writing the structure after every loop."""
+    seamm.flowchart_variables = seamm.Variables()
+    step.parameters["stop early"].value = "minimum distance above"
+    P = step.parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+    files = input_files()
+    step._checkpoint(files, 5, False)
+    monitor = step._monitor(P, files, tmp_path, "packmol.pdb", "packmol", {})
+    text = files["input.inp"]
+    assert text.count("writeout") == 1
+    assert "writeout 1\nrestart_to checkpoint/packmol.restart\nstructure" in text
+    assert monitor.structure == tmp_path / "packmol.pdb"
+
+
+@pytest.mark.unit
+def test_monitor_uses_stop_early_distance(step, tmp_path):
+    """Stopping early uses its own distance, not the one for the series."""
+    seamm.flowchart_variables = seamm.Variables()
+    step.parameters["stop early"].value = "minimum distance above"
+    step.parameters["stop early minimum distance"].value = 2.5
+    step.parameters["series minimum distance"].value = 1.2
+    P = step.parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+    files = input_files()
+    monitor = step._monitor(P, files, tmp_path, "packmol.pdb", "packmol", {})
+    assert monitor.value == pytest.approx(2.5)
+
+
+@pytest.mark.unit
+def test_resume_coarse_grained(step, tmp_path):
+    """A resumed packing does not start from the coarse-grained packing again."""
+    files = input_files()
+    files["input.inp"] = files["input.inp"].replace(
+        "   number 10\n", "   number 10\n   restart_from input_1.restart\n"
+    )
+    files["coarse.inp"] = "structure coarse_1.pdb\nend structure\n"
+    files["coarse_1.pdb"] = "ATOM 1\n"
+    coarse = dict(files)
+    assert not step._checkpoint(files, 5, False)
+    assert "coarse.inp" in files
+    assert "restart_from input_1.restart" in files["input.inp"]
+    (tmp_path / "1" / "checkpoint" / "packmol.restart").write_text("1.0 2.0 3.0\n")
+
+    files = dict(coarse)
+    assert step._checkpoint(files, 5, False)
+    assert "coarse.inp" not in files and "coarse_1.pdb" not in files
+    lines = [line for line in files["input.inp"].splitlines() if "restart_from" in line]
+    assert lines == ["restart_from checkpoint/packmol.restart"]
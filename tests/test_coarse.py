@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the coarse-grained, two-stage packing."""
+
+import math
+import random
+import shutil
+import subprocess
+import time
+
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+from packmol_step import coarse_radius, randomize_orientations
+
+
+def get_input(db, smiles, n_atoms, method):
+    """The Packmol input for a periodic melt of the SMILES."""
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters["molecules"].value = [
+        {"component": "fluid", "source": "SMILES", "definition": smiles, "count": "1"}
+    ]
+    parameters["periodic"].value = "Yes"
+    parameters["shape"].value = "cubic"
+    parameters["approximate number of atoms"].value = n_atoms
+    parameters["density"].value = 0.85
+    parameters["packing method"].value = method
+    P = parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    try:
+        return packmol_step.Packmol.get_input(P, db, tmp_db, seamm.flowchart_variables)
+    finally:
+        tmp_db.close()
+
+
+@pytest.mark.unit
+def test_coarse_radius():
+    """The radius is the bounding sphere, capped by the volume per molecule."""
+    assert coarse_radius(3.0, 1.0e6) == pytest.approx(4.0)
+    cap = (3 * 0.5 * 1000.0 / (4 * math.pi)) ** (1 / 3)
+    assert coarse_radius(30.0, 1000.0) == pytest.approx(cap)
+    assert coarse_radius(0.0, 0.001) == pytest.approx(1.0)
+
+
+@pytest.mark.unit
+def test_randomize_orientations():
+    """The centers are kept and the angles replaced."""
+    text = " 1.0 2.0 3.0 0.0 0.0 0.0\n 4.0 5.0 6.0 0.0 0.0 0.0\n"
+    result = randomize_orientations(text, random.Random(1))
+
+    lines = [[float(x) for x in line.split()] for line in result.splitlines()]
+    assert [line[0:3] for line in lines] == [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]
+    assert all(line[3:] != [0.0, 0.0, 0.0] for line in lines)
+
+
+@pytest.mark.unit
+def test_coarse_input(db):
+    """The two-stage input packs pseudo-atoms, then restarts from them."""
+    molecules, files, text, cell = get_input(
+        db, "CCCCCCCCCCCCCCCCCCCC", 2000, "coarse-grained, then atomistic"
+    )
+
+    assert files["coarse_1.pdb"] == packmol_step.pseudo_atom_pdb
+    assert "structure coarse_1.pdb" in files["coarse.inp"]
+    assert "   radius " in files["coarse.inp"]
+    assert "   restart_to coarse_1.restart" in files["coarse.inp"]
+    assert "   restart_from input_1.restart" in files["input.inp"]
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("length", [20, 50, 100])
+def test_polymer_melt(db, tmp_path, length):
+    """Time packing a polyethylene melt directly and in two stages."""
+    packmol = shutil.which("packmol")
+    if packmol is None:
+        pytest.skip("Packmol is not installed")
+
+    print()
+    for method in ("atomistic", "coarse-grained, then atomistic"):
+        molecules, files, text, cell = get_input(db, "C" * length, 5000, method)
+        directory = tmp_path / method.split(",")[0]
+        directory.mkdir()
+        for name, data in files.items():
+            (directory / name).write_text(data)
+
+        t0 = time.perf_counter()
+        if "coarse.inp" in files:
+            with open(directory / "coarse.inp") as fd:
+                subprocess.run([packmol], stdin=fd, cwd=directory, capture_output=True)
+            for path in directory.glob("coarse_*.restart"):
+                restart = directory / path.name.replace("coarse_", "input_")
+                restart.write_text(randomize_orientations(path.read_text()))
+        t1 = time.perf_counter()
+        with open(directory / "input.inp") as fd:
+            subprocess.run([packmol], stdin=fd, cwd=directory, capture_output=True)
+        t2 = time.perf_counter()
+
+        assert (directory / "packmol.pdb").exists()
+        print(
+            f"C{length} melt, {method:>30s}: {t1 - t0:7.2f} s + {t2 - t1:7.2f} s = "
+            f"{t2 - t0:7.2f} s"
+        )
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for making a series of compositions by swapping molecules."""
+
+import json
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+
+test_dir = Path(__file__).resolve().parent
+flowchart = test_dir / "flowcharts" / "unit_20_rectangular_cell_volume_density.flow"
+
+methanol = np.array(
+    (
+        (-0.75, 0.0, 0.0),
+        (0.68, 0.0, 0.0),
+        (-1.1, 1.03, 0.0),
+        (-1.1, -0.5, 0.9),
+        (-1.1, -0.5, -0.9),
+        (1.0, -0.9, 0.0),
+    )
+)
+
+
+def rotation(seed):
+    """A random rotation matrix."""
+    q, r = np.linalg.qr(np.random.default_rng(seed).normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] *= -1
+    return q
+
+
+def distances(xyz):
+    """The distances between all the atoms of a molecule."""
+    return np.linalg.norm(xyz[:, None, :] - xyz[None, :, :], axis=2)
+
+
+@pytest.mark.unit
+def test_parse_compositions():
+    """Compositions are separated by commas or semicolons, components by colons."""
+    assert packmol_step.parse_compositions("1:3, 1:1; 3:1") == [
+        [1.0, 3.0],
+        [1.0, 1.0],
+        [3.0, 1.0],
+    ]
+    assert packmol_step.parse_compositions("") == []
+    with pytest.raises(RuntimeError, match="Cannot understand"):
+        packmol_step.parse_compositions("1:x")
+    with pytest.raises(RuntimeError, match="not sensible"):
+        packmol_step.parse_compositions("0:0")
+
+
+@pytest.mark.unit
+def test_composition_numbers():
+    """The numbers add up to the total and are as close as possible."""
+    assert packmol_step.composition_numbers(10, [1, 1, 1]) == [4, 3, 3]
+    assert packmol_step.composition_numbers(100, [1, 3]) == [25, 75]
+    assert packmol_step.composition_numbers(7, [0, 1]) == [0, 7]
+
+
+@pytest.mark.unit
+def test_swaps_pair_similar_sizes():
+    """Molecules are swapped between the components closest in size."""
+    result = packmol_step.swaps([4, 4, 0, 0], [2, 2, 2, 2], [1.0, 3.0, 1.1, 2.9])
+    assert sorted(result) == [(0, 2, 2), (1, 3, 2)]
+    assert packmol_step.swaps([3, 3], [3, 3], [1.0, 2.0]) == []
+
+
+@pytest.mark.unit
+def test_superpose():
+    """The new molecule is rigid, on the center and axes of the old one."""
+    placed = np.stack(
+        [methanol @ rotation(seed).T + (5.0, 6.0, 7.0) for seed in range(4)]
+    )
+    template = methanol @ rotation(99).T - (3.0, 2.0, 1.0)
+    new = packmol_step.superpose(template, placed)
+
+    assert new.shape == placed.shape
+    for old, copy in zip(placed, new):
+        assert copy.mean(axis=0) == pytest.approx(old.mean(axis=0))
+        assert distances(copy) == pytest.approx(distances(methanol))
+        # The same spread along the same axes, up to the direction of each
+        c1 = (copy - copy.mean(axis=0)).T @ (copy - copy.mean(axis=0))
+        c0 = (old - old.mean(axis=0)).T @ (old - old.mean(axis=0))
+        assert c1 == pytest.approx(c0, abs=1.0e-6)
+
+
+@pytest.mark.unit
+def test_composition_needs_periodic():
+    """A series of compositions is only for periodic boxes of fluid."""
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters["molecules"].value = [
+        {"component": "fluid", "source": "SMILES", "definition": s, "count": "1"}
+        for s in ("O", "C")
+    ]
+    parameters["composition series"].value = "1:3"
+    P = parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+
+    system_db = SystemDB(filename="file:seamm_db?mode=memory&cache=shared")
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    try:
+        with pytest.raises(RuntimeError, match="series of compositions"):
+            packmol_step.Packmol.get_input(
+                P, system_db, tmp_db, seamm.flowchart_variables
+            )
+        P["periodic"] = True
+        P["shape"] = "cubic"
+        P["composition series"] = "1:2:3"
+        with pytest.raises(RuntimeError, match="for each of the 2 components"):
+            packmol_step.Packmol.get_input(
+                P, system_db, tmp_db, seamm.flowchart_variables
+            )
+    finally:
+        tmp_db.close()
+        system_db.close()
+
+
+@pytest.mark.unit
+def test_composition_series(tmp_path, fake_packmol):
+    """The flowchart writes a configuration for each composition in one system."""
+    head, text = flowchart.read_text().split("#flowchart\n")
+    text, end, tail = text.partition("\n#end")
+    data = json.loads(text)
+    for node in data["nodes"]:
+        if node["class"] == "Packmol":
+            P = node["attributes"]["parameters"]
+            P["molecules"]["value"] = [
+                {
+                    "component": "fluid",
+                    "source": "SMILES",
+                    "definition": s,
+                    "count": "1",
+                }
+                for s in ("O", "CO")
+            ]
+            P["composition series"] = {"value": "1:3, 0:1", "units": None}
+    path = tmp_path / "flowchart.flow"
+    path.write_text(head + "#flowchart\n" + json.dumps(data, indent=4) + end + tail)
+
+    # Run in a separate process, since the options can only be parsed once
+    job = tmp_path / "job"
+    job.mkdir()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"from seamm_exec import run; run(wdir={str(job)!r})",
+            str(path),
+            "--standalone",
+            "--root",
+            str(fake_packmol),
+        ],
+        capture_output=True,
+        check=True,
+    )
+
+    db = SystemDB(filename=str(job / "seamm.db"))
+    try:
+        packed, *series = db.system.configurations
+        n_water = packed.atoms.symbols.count("O") - packed.atoms.symbols.count("C")
+        n_methanol = packed.atoms.symbols.count("C")
+        assert n_water == n_methanol
+        n = n_water + n_methanol
+        assert len(series) == 2
+
+        first, last = series
+        n_first = packmol_step.composition_numbers(n, [1, 3])[1]
+        assert first.atoms.symbols.count("C") == n_first
+        assert last.atoms.symbols.count("C") == n
+        assert last.n_atoms == 6 * n
+        assert last.bonds.n_bonds == 5 * n
+        assert last.cell.parameters == pytest.approx(packed.cell.parameters)
+
+        # Each atom is labeled with its molecule and template
+        assert last.atoms.get_column_data("molecule") == [
+            i for i in range(n) for _ in range(6)
+        ]
+        methanol_id = db.templates.get_id("CO", category="molecule")
+        assert set(last.atoms.get_column_data("template")) == {methanol_id}
+
+        # The molecules of methanol are whole, with the right bond lengths
+        xyz = np.array(last.atoms.get_coordinates(fractionals=False))
+        co = np.linalg.norm(xyz[1::6] - xyz[0::6], axis=1)
+        assert co == pytest.approx(co[0], abs=1.0e-3)
+    finally:
+        db.close()
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n", [1000, 10000, 100000])
+def test_swapping_speed(n):
+    """Time superposing methanol onto half of a box of molecules."""
+    placed = np.stack([methanol @ rotation(seed).T for seed in range(100)])
+    placed = np.tile(placed, (n // 200, 1, 1))
+    t0 = time.perf_counter()
+    packmol_step.superpose(methanol, placed)
+    t = time.perf_counter() - t0
+    print(f"\n{n:7d} molecules: swapping half took {t:6.3f} s")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for making a series of densities by compressing one packed box."""
+
+import json
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+
+test_dir = Path(__file__).resolve().parent
+flowchart = test_dir / "flowcharts" / "unit_20_rectangular_cell_volume_density.flow"
+
+water = np.array(((0.0, 0.0, 0.0), (0.96, 0.0, 0.0), (-0.24, 0.93, 0.0)))
+water_masses = [15.999, 1.008, 1.008]
+
+
+def parameters(**values):
+    """The parameters for a periodic box of water from the density."""
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters["periodic"].value = "Yes"
+    parameters["shape"].value = "cubic"
+    parameters["molecules"].value = [
+        {"component": "fluid", "source": "SMILES", "definition": "O", "count": "1"}
+    ]
+    parameters["fluid amount"].value = "rounding this number of molecules"
+    parameters["approximate number of molecules"].value = 100
+    for key, value in values.items():
+        parameters[key].value = value
+    return parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+
+
+def get_input(P):
+    """Run get_input with temporary databases, returning the summary."""
+    system_db = SystemDB(filename="file:seamm_db?mode=memory&cache=shared")
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    summary = {}
+    try:
+        packmol_step.Packmol.get_input(
+            P, system_db, tmp_db, seamm.flowchart_variables, summary=summary
+        )
+    finally:
+        tmp_db.close()
+        system_db.close()
+    return summary
+
+
+@pytest.mark.unit
+def test_parse_densities():
+    """The densities can be separated by commas or spaces."""
+    assert packmol_step.parse_densities("0.9, 1.0 1.1") == [0.9, 1.0, 1.1]
+    assert packmol_step.parse_densities("") == []
+    with pytest.raises(RuntimeError, match="Cannot understand"):
+        packmol_step.parse_densities("0.9, dense")
+
+
+@pytest.mark.unit
+def test_compress():
+    """The centers of mass are scaled and the molecules stay rigid."""
+    xyz = np.concatenate((water + (10.0, 10.0, 10.0), water + (2.0, 4.0, 6.0)))
+    index = packmol_step.molecule_index([{"n_atoms": 3, "number": 2}])
+    masses = water_masses * 2
+    new = packmol_step.compress(xyz, index, masses, 0.5)
+
+    for old_molecule, new_molecule in zip(xyz.reshape(2, 3, 3), new.reshape(2, 3, 3)):
+        center = np.average(old_molecule, axis=0, weights=water_masses)
+        new_center = np.average(new_molecule, axis=0, weights=water_masses)
+        assert new_center == pytest.approx(0.5 * center)
+        assert new_molecule - new_center == pytest.approx(old_molecule - center)
+
+
+@pytest.mark.unit
+def test_clashing_molecules():
+    """Only atoms of different molecules clash, including across the cell."""
+    xyz = np.array(((0.2, 5.0, 5.0), (9.5, 5.0, 5.0), (5.0, 5.0, 5.0), (5.5, 5.0, 5.0)))
+    index = np.array((0, 1, 2, 2))
+    cell = (10.0, 10.0, 10.0)
+    assert packmol_step.clashing_molecules(xyz, index, 1.0, cell).tolist() == [
+        True,
+        True,
+        False,
+    ]
+    assert not packmol_step.clashing_molecules(xyz, index, 0.6, cell).any()
+
+
+@pytest.mark.unit
+def test_packed_at_lowest_density():
+    """The box is packed at the lowest density of the series."""
+    summary = get_input(parameters(density=0.5, **{"density series": "0.9, 0.2, 1.0"}))
+    assert summary["density"] == pytest.approx(0.2)
+
+    summary = get_input(parameters(density=0.5, **{"density series": "0.9"}))
+    assert summary["density"] == pytest.approx(0.5)
+
+
+@pytest.mark.unit
+def test_series_needs_periodic_density():
+    """A series is only for periodic cells from the density."""
+    P = parameters(periodic="No", **{"density series": "0.9"})
+    with pytest.raises(RuntimeError, match="series of densities"):
+        get_input(P)
+
+    P = parameters(dimensions="given explicitly", **{"density series": "0.9"})
+    with pytest.raises(RuntimeError, match="series of densities"):
+        get_input(P)
+
+
+@pytest.mark.unit
+def test_density_series(tmp_path, fake_packmol):
+    """The flowchart writes a configuration at each density in one system."""
+    head, text = flowchart.read_text().split("#flowchart\n")
+    text, end, tail = text.partition("\n#end")
+    data = json.loads(text)
+    for node in data["nodes"]:
+        if node["class"] == "Packmol":
+            P = node["attributes"]["parameters"]
+            P["dimensions"]["value"] = "calculated from the density"
+            P["fluid amount"]["value"] = "rounding this number of molecules"
+            P["molecules"]["value"] = P["molecules"]["value"][1:]
+            P["density"]["value"] = "0.1"
+            P["density series"] = {"value": "0.3, 0.2", "units": None}
+    path = tmp_path / "flowchart.flow"
+    path.write_text(head + "#flowchart\n" + json.dumps(data, indent=4) + end + tail)
+
+    # Run in a separate process, since the options can only be parsed once
+    job = tmp_path / "job"
+    job.mkdir()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"from seamm_exec import run; run(wdir={str(job)!r})",
+            str(path),
+            "--standalone",
+            "--root",
+            str(fake_packmol),
+        ],
+        capture_output=True,
+        check=True,
+    )
+
+    db = SystemDB(filename=str(job / "seamm.db"))
+    try:
+        configurations = db.system.configurations
+        assert len(configurations) == 3
+        packed = db.system.configuration
+        volumes = []
+        for configuration in configurations:
+            assert configuration.n_atoms == packed.n_atoms == 900
+            assert configuration.bonds.n_bonds == 600
+            a, b, c = configuration.cell.parameters[0:3]
+            volumes.append(a * b * c)
+            xyz = np.array(configuration.atoms.get_coordinates(fractionals=False))
+            oh = np.linalg.norm(xyz[1::3] - xyz[0::3], axis=1)
+            assert oh == pytest.approx(oh[0], abs=1.0e-3)
+        assert sorted(volumes[0] / np.array(volumes)) == pytest.approx([1, 2, 3])
+    finally:
+        db.close()
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n", [1000, 10000, 100000])
+def test_compression_speed(n):
+    """Time compressing and checking a box of water for each density."""
+    k = int(np.ceil(n ** (1 / 3)))
+    side = 4.0 * k
+    centers = 4.0 * np.array([(i // k**2, i // k % k, i % k) for i in range(n)])
+    xyz = (centers[:, None, :] + water[None, :, :]).reshape(-1, 3)
+    index = packmol_step.molecule_index([{"n_atoms": 3, "number": n}])
+    masses = water_masses * n
+
+    t0 = time.perf_counter()
+    for factor in (0.95, 0.9, 0.85, 0.8):
+        new = packmol_step.compress(xyz, index, masses, factor)
+        cell = (side * factor,) * 3
+        clash = packmol_step.clashing_molecules(new, index, 1.8, cell)
+    t = (time.perf_counter() - t0) / 4
+    print(f"\n{n:7d} molecules: {t:6.3f} s per density, {clash.sum()} clashing")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for giving Packmol a large solute as exclusion spheres."""
+
+import json
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+
+test_dir = Path(__file__).resolve().parent
+fake = test_dir / "fake_packmol.py"
+solute_input = next(test_dir.glob("inputs/test_13_*.json"))
+
+
+def solute_parameters(**values):
+    """The parameters for packing water around biphenyl."""
+    data = json.loads(solute_input.read_text())
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters.from_dict(data)
+    for key, value in values.items():
+        parameters[key].value = value
+    return parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+
+
+def packed(P, tmp_path):
+    """The molecules, input files and structure from the fake Packmol."""
+    system_db = SystemDB(filename="file:seamm_db?mode=memory&cache=shared")
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    try:
+        molecules, files, text, cell = packmol_step.Packmol.get_input(
+            P, system_db, tmp_db, seamm.flowchart_variables
+        )
+        molecules = [{**m, "configuration": None} for m in molecules]
+    finally:
+        tmp_db.close()
+        system_db.close()
+
+    for name, data in files.items():
+        (tmp_path / name).write_text(data)
+    with open(tmp_path / "input.inp") as fd:
+        subprocess.run(
+            [sys.executable, str(fake)],
+            stdin=fd,
+            cwd=tmp_path,
+            capture_output=True,
+            check=True,
+        )
+    return molecules, files, (tmp_path / "packmol.pdb").read_text()
+
+
+def coordinates(lines):
+    """The coordinates of the atoms in the lines of a PDB file."""
+    return np.array(
+        [
+            (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+            for line in lines
+            if line[0:6] in ("ATOM  ", "HETATM")
+        ]
+    )
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("size", [2.0, 5.0, 50.0])
+def test_spheres_cover_atoms(size):
+    """Every atom is inside a sphere, at least the tolerance from its surface."""
+    xyz = np.random.default_rng(1).uniform(-10.0, 10.0, size=(500, 3))
+    spheres = packmol_step.exclusion_spheres(xyz, size, 2.0)
+
+    assert len(spheres) <= np.ceil(20.0 / size + 1) ** 3
+    distance = np.linalg.norm(xyz[:, None, :] - spheres[None, :, 0:3], axis=2)
+    assert (distance + 2.0 <= spheres[None, :, 3] + 1.0e-9).any(axis=1).all()
+
+
+@pytest.mark.unit
+def test_periodic_images():
+    """Spheres crossing the faces of the cell have images on the other side."""
+    xyz = np.array(((0.5, 5.0, 5.0), (5.0, 5.0, 5.0)))
+    spheres = packmol_step.exclusion_spheres(xyz, 1.0, 1.0, cell=(10.0, 10.0, 10.0))
+
+    assert len(spheres) == 3
+    assert spheres[:, 0].tolist() == pytest.approx([0.5, 5.0, 10.5])
+    assert spheres[:, 3].tolist() == pytest.approx([1.0, 1.0, 1.0])
+
+
+@pytest.mark.unit
+def test_exclusion_input(tmp_path):
+    """Packmol sees spheres rather than the solute, which is put back first."""
+    P = solute_parameters(**{"solute representation": "exclusion spheres"})
+    molecules, files, text = packed(P, tmp_path)
+
+    solute = molecules[0]
+    assert solute["type"] == "solute"
+    assert "input_1.pdb" not in files
+    assert "fixed" not in files["input.inp"]
+    assert "   outside sphere " in files["input.inp"]
+    assert len(coordinates(files["solute.pdb"].splitlines())) == solute["n_atoms"]
+
+    lines = list(packmol_step.with_solute(files["solute.pdb"], text.splitlines()))
+    n_atoms = sum(m["n_atoms"] * m["number"] for m in molecules)
+    assert len(coordinates(lines)) == n_atoms
+
+    # The solute is where Packmol would have put it
+    P = solute_parameters()
+    all_atoms = tmp_path / "all_atoms"
+    all_atoms.mkdir()
+    _, _, text = packed(P, all_atoms)
+    expected = coordinates(text.splitlines())[0 : solute["n_atoms"]]
+    assert coordinates(lines)[0 : solute["n_atoms"]] == pytest.approx(
+        expected, abs=2.0e-3
+    )
+
+
+@pytest.mark.unit
+def test_adding_with_spheres(db, configuration, tmp_path):
+    """When adding, Packmol's structure has only the new molecules."""
+    configuration.periodicity = 3
+    configuration.cell.parameters = (20.0, 20.0, 20.0, 90.0, 90.0, 90.0)
+    configuration.atoms.append(
+        x=[5.0, 15.0], y=[5.0, 15.0], z=[5.0, 15.0], symbol=["Ar", "Ar"]
+    )
+    P = solute_parameters(
+        **{
+            "mode": "add to the current configuration",
+            "molecules": [
+                {
+                    "component": "fluid",
+                    "source": "SMILES",
+                    "definition": "O",
+                    "count": "1",
+                }
+            ],
+            "fluid amount": "rounding this number of molecules",
+            "approximate number of molecules": 10,
+            "solute representation": "exclusion spheres",
+        }
+    )
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    try:
+        molecules, files, text, cell = packmol_step.Packmol.get_input(
+            P, db, tmp_db, seamm.flowchart_variables
+        )
+    finally:
+        tmp_db.close()
+
+    assert "solute.pdb" in files
+    assert files["input.inp"].count("   outside sphere ") == 2
+    for name, data in files.items():
+        (tmp_path / name).write_text(data)
+    with open(tmp_path / "input.inp") as fd:
+        subprocess.run(
+            [sys.executable, str(fake)],
+            stdin=fd,
+            cwd=tmp_path,
+            capture_output=True,
+            check=True,
+        )
+    xyz = coordinates((tmp_path / "packmol.pdb").read_text().splitlines())
+    assert len(xyz) == 30
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n", [10000, 50000, 200000])
+def test_sphere_speed(n):
+    """Time covering a dense solute, and count the spheres Packmol would see."""
+    k = int(np.ceil(n ** (1 / 3)))
+    xyz = 1.5 * np.array([(i // k**2, i // k % k, i % k) for i in range(n)])
+    for size in (4.0, 8.0, 16.0):
+        t0 = time.perf_counter()
+        spheres = packmol_step.exclusion_spheres(xyz, size, 2.0)
+        t = time.perf_counter() - t0
+        print(f"\n{n:7d} atoms, {size:4.1f} Å: {len(spheres):6d} spheres {t:6.3f} s")
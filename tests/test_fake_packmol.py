@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests using the fake Packmol, including benchmarks of the whole step."""
+
+import json
+from pathlib import Path
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+
+test_dir = Path(__file__).resolve().parent
+fake = test_dir / "fake_packmol.py"
+flowchart = test_dir / "flowcharts" / "unit_20_rectangular_cell_volume_density.flow"
+
+
+def run_fake(directory, files, env=None):
+    """Write the input files and run the fake Packmol on them."""
+    for name, text in files.items():
+        (directory / name).write_text(text)
+    with open(directory / "input.inp") as fd:
+        subprocess.run(
+            [sys.executable, str(fake)],
+            stdin=fd,
+            stdout=open(directory / "packmol.out", "w"),
+            cwd=directory,
+            env=env,
+            check=True,
+        )
+    return (directory / "packmol.out").read_text()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("name", ["test_8", "test_9", "test_11"])
+def test_fake_packmol(tmp_path, name):
+    """The fake Packmol writes every atom for regions, cells and solutes."""
+    (input_file,) = test_dir.glob(f"inputs/{name}_*.json")
+    data = json.loads(input_file.read_text())
+    seamm.flowchart_variables = seamm.Variables(**data.pop("_variables_", {}))
+    parameters = packmol_step.PackmolParameters()
+    parameters.from_dict(data)
+    P = parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+
+    system_db = SystemDB(filename="file:seamm_db?mode=memory&cache=shared")
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    summary = {}
+    molecules, files, text, cell = packmol_step.Packmol.get_input(
+        P, system_db, tmp_db, seamm.flowchart_variables, summary=summary
+    )
+
+    output = run_fake(tmp_path, files)
+    tmp_db.close()
+    system_db.close()
+
+    progress = packmol_step.parse_output(output)
+    assert progress["converged"] is True
+    assert progress["loops"][-1]["written"]
+    pdb = (tmp_path / "packmol.pdb").read_text().splitlines()
+    n_atoms = sum(1 for line in pdb if line.startswith(("ATOM", "HETATM")))
+    assert n_atoms == summary["n_atoms"]
+
+
+@pytest.mark.unit
+def test_monitor_stops_fake_packmol(tmp_path):
+    """Packmol is stopped early once the minimum distance is good enough."""
+    pytest.importorskip("psutil")
+    (tmp_path / "input_1.pdb").write_text(
+        "HETATM    1 AR   UNK A   1       0.000   0.000   0.000  1.00  0.00"
+        "          AR\n"
+    )
+    (tmp_path / "input.inp").write_text(
+        "tolerance 2.0\nwriteout 1\noutput packmol.pdb\nfiletype pdb\n"
+        "structure input_1.pdb\n   inside cube 0.0 0.0 0.0 20.0\n   number 100\n"
+        "end structure\n"
+    )
+    env = {"FAKE_PACKMOL_LOOPS": "100", "FAKE_PACKMOL_DELAY": "0.05"}
+    with open(tmp_path / "input.inp") as fd:
+        process = subprocess.Popen(
+            [sys.executable, str(fake)],
+            stdin=fd,
+            stdout=open(tmp_path / "packmol.out", "w"),
+            cwd=tmp_path,
+            env=env,
+        )
+        monitor = packmol_step.Monitor(
+            tmp_path / "packmol.out",
+            "minimum distance above",
+            1.0,
+            poll=0.05,
+            structure=tmp_path / "packmol.pdb",
+            code=f"{sys.executable} {fake}",
+        )
+        monitor.start()
+        process.wait(timeout=30)
+        monitor.finish()
+
+    assert monitor.stopped
+    assert 1.0 <= monitor.accepted["minimum distance"] < 2.0
+    pdb = monitor.copy.read_text().splitlines()
+    assert sum(1 for line in pdb if line.startswith(("ATOM", "HETATM"))) == 100
+
+
+@pytest.mark.unit
+def test_peak_memory_of_packmol(tmp_path):
+    """Only the memory of Packmol is measured, not that of other children."""
+    pytest.importorskip("psutil")
+    (tmp_path / "input_1.pdb").write_text(
+        "HETATM    1 AR   UNK A   1       0.000   0.000   0.000  1.00  0.00"
+        "          AR\n"
+    )
+    (tmp_path / "input.inp").write_text(
+        "tolerance 2.0\noutput packmol.pdb\nfiletype pdb\n"
+        "structure input_1.pdb\n   inside cube 0.0 0.0 0.0 20.0\n   number 100\n"
+        "end structure\n"
+    )
+    memory = packmol_step.PeakMemory(
+        tmp_path, code=f"{sys.executable} {fake}", poll=0.05
+    )
+    memory.start()
+    other = subprocess.Popen(
+        [sys.executable, "-c", "x = bytearray(500_000_000); import time; time.sleep(2)"]
+    )
+    env = {"FAKE_PACKMOL_LOOPS": "10", "FAKE_PACKMOL_DELAY": "0.1"}
+    with open(tmp_path / "input.inp") as fd:
+        subprocess.run(
+            [sys.executable, str(fake)],
+            stdin=fd,
+            stdout=open(tmp_path / "packmol.out", "w"),
+            cwd=tmp_path,
+            env=env,
+            check=True,
+        )
+    peak = memory.finish()
+    other.wait()
+
+    assert 1_000_000 < peak < 500_000_000
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("volume", [6, 60, 600])
+def test_pipeline(tmp_path, fake_packmol, volume):
+    """Time a whole flowchart for up to 50,000 atoms, with the fake Packmol."""
+    path = tmp_path / "flowchart.flow"
+    text = flowchart.read_text()
+    text = text.replace('"value": "6",\n', f'"value": "{volume}",\n', 1)
+    path.write_text(text)
+
+    # Run in a separate process, since the options can only be parsed once
+    job = tmp_path / "job"
+    job.mkdir()
+    t0 = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"from seamm_exec import run; run(wdir={str(job)!r})",
+            str(path),
+            "--standalone",
+            "--root",
+            str(fake_packmol),
+        ],
+        capture_output=True,
+        check=True,
+    )
+    t = time.perf_counter() - t0
+
+    (metrics,) = job.glob("**/metrics.json")
+    metrics = json.loads(metrics.read_text())
+    print(
+        f"\n{volume:5d} nm^3: the flowchart took {t:8.2f} s, of which Packmol took "
+        f"{metrics['wall time']:8.2f} s"
+    )
+
+
+@pytest.mark.unit
+def test_scratch_cleaned_up_when_interrupted(tmp_path):
+    """An interrupted run copies back the log and removes its scratch directory."""
+    root = tmp_path / "SEAMM"
+    root.mkdir()
+    slow = tmp_path / "slow_packmol.py"
+    slow.write_text(
+        "import sys, time\n"
+        "sys.stdin.read()\n"
+        "print('Packmol started', flush=True)\n"
+        "time.sleep(20)\n"
+    )
+    (root / "packmol.ini").write_text(
+        f"[local]\ninstallation = local\ncode = {sys.executable} {slow}\n"
+    )
+    scratch = tmp_path / "scratch"
+    job = tmp_path / "job"
+    job.mkdir()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            f"from seamm_exec import run; run(wdir={str(job)!r})",
+            str(flowchart),
+            "--standalone",
+            "--root",
+            str(root),
+            "packmol-step",
+            "--scratch-directory",
+            str(scratch),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        t0 = time.perf_counter()
+        while not any(scratch.glob("packmol_*/packmol.out")):
+            assert time.perf_counter() - t0 < 60, "Packmol did not start"
+            time.sleep(0.1)
+        time.sleep(0.5)
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=60)
+    finally:
+        process.kill()
+
+    assert list(scratch.iterdir()) == []
+    (log,) = job.glob("**/packmol.out")
+    assert log.read_text() == "Packmol started\n"
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n", [1000, 10000, 100000, 1000000])
+def test_fake_scaling(tmp_path, n):
+    """Time the fake Packmol itself for up to a million atoms of argon."""
+    files = {
+        "input_1.pdb": (
+            "HETATM    1 AR   UNK A   1       0.000   0.000   0.000  1.00  0.00"
+            "          AR\n"
+        ),
+        "input.inp": (
+            f"tolerance 2.0\noutput packmol.pdb\nfiletype pdb\npbc {n ** (1 / 3) * 3}"
+            f" {n ** (1 / 3) * 3} {n ** (1 / 3) * 3}\nstructure input_1.pdb\n"
+            f"   number {n}\nend structure\n"
+        ),
+    }
+    t0 = time.perf_counter()
+    run_fake(tmp_path, files)
+    t = time.perf_counter() - t0
+
+    assert (tmp_path / "packmol.pdb").read_text().count("HETATM") == n
+    print(f"\n{n:8d} atoms: {t:6.2f} s")
@@ -35,14 +35,16 @@ def test_ideal_gas(monkeypatch, tmp_path, flowchart):
 
 @pytest.mark.unit
 @pytest.mark.parametrize("flowchart", unit_flowcharts)
-def test_unit(monkeypatch, tmp_path, flowchart):
-    """Unit tests with flowcharts"""
+def test_unit(monkeypatch, tmp_path, fake_packmol, flowchart):
+    """Unit tests with flowcharts, using the fake Packmol"""
     monkeypatch.setattr(
         "sys.argv",
         [
             "testing",
             flowchart,
             "--standalone",
+            "--root",
+            str(fake_packmol),
         ],
     )
 
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for writing Packmol's files as xyz for large templates."""
+
+import json
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from molsystem import SystemDB
+import packmol_step
+
+test_dir = Path(__file__).resolve().parent
+flowchart = test_dir / "flowcharts" / "unit_20_rectangular_cell_volume_density.flow"
+
+water = np.array(((0.0, 0.0, 0.0), (0.96, 0.0, 0.0), (-0.24, 0.93, 0.0)))
+
+
+def run_flowchart(tmp_path, fake_packmol, name, large_template, *options):
+    """Run the flowchart with the given limit on the size of PDB templates."""
+    head, text = flowchart.read_text().split("#flowchart\n")
+    text, end, tail = text.partition("\n#end")
+    data = json.loads(text)
+    for node in data["nodes"]:
+        if node["class"] == "Packmol":
+            P = node["attributes"]["parameters"]
+            P["fluid amount"]["value"] = "rounding this number of molecules"
+    path = tmp_path / "flowchart.flow"
+    path.write_text(head + "#flowchart\n" + json.dumps(data, indent=4) + end + tail)
+
+    # Run in a separate process, since the options can only be parsed once
+    job = tmp_path / name
+    job.mkdir()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import packmol_step.formats; "
+            f"packmol_step.formats.large_template = {large_template}; "
+            f"from seamm_exec import run; run(wdir={str(job)!r})",
+            str(path),
+            "--standalone",
+            "--root",
+            str(fake_packmol),
+            *options,
+        ],
+        capture_output=True,
+        check=True,
+    )
+    return job
+
+
+@pytest.mark.unit
+def test_xyz_text():
+    """The atoms are read back from the xyz file."""
+    text = packmol_step.xyz_text(["O", "H", "H"], water + 1000.0, comment="water")
+    lines = text.splitlines()
+    assert lines[0:2] == ["3", "water"]
+
+    atoms = list(packmol_step.atom_lines(lines, "xyz"))
+    symbols, names, xyz = packmol_step.parse_atoms(atoms, "xyz")
+    assert symbols == names == ["O", "H", "H"]
+    assert xyz == pytest.approx(water + 1000.0)
+
+
+@pytest.mark.unit
+def test_choose_filetype():
+    """Only templates larger than the limit need xyz files."""
+    small = {"n_atoms": packmol_step.formats.large_template}
+    large = {"n_atoms": packmol_step.formats.large_template + 1}
+    assert packmol_step.choose_filetype([small, small]) == "pdb"
+    assert packmol_step.choose_filetype([small, large]) == "xyz"
+
+
+@pytest.mark.unit
+def test_placed_xyz_with_solute():
+    """Placed copies of xyz templates, with the solute put back first."""
+    template = packmol_step.xyz_text(["O", "H", "H"], water)
+    placed = np.stack((water + 5.0, water + 10.0))
+    text = packmol_step.placed_text([(template, placed)], filetype="xyz")
+    solute = packmol_step.xyz_text(["Ar"], [(1.0, 2.0, 3.0)])
+
+    lines = list(
+        packmol_step.with_solute(solute, text.splitlines(keepends=True), filetype="xyz")
+    )
+    assert lines[0] == "7\n"
+    symbols, xs, ys, zs = packmol_step.pdb_atoms("".join(lines), filetype="xyz")
+    assert symbols == ["Ar", "O", "H", "H", "O", "H", "H"]
+    assert np.column_stack((xs, ys, zs))[1:] == pytest.approx(placed.reshape(-1, 3))
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("batch_size", ["0", "7"])
+def test_xyz_build(tmp_path, fake_packmol, batch_size):
+    """A build with xyz files gives the same system as one with PDB files."""
+    options = ["packmol-step", "--ingest-batch-size", batch_size]
+    pdb_job = run_flowchart(tmp_path, fake_packmol, "pdb", 10000, *options)
+    xyz_job = run_flowchart(tmp_path, fake_packmol, "xyz", 3, *options)
+
+    step = next(xyz_job.glob("**/packmol.xyz")).parent
+    assert "filetype xyz" in (step / "input.inp").read_text()
+    assert len(list(step.glob("input_*.xyz"))) == 2
+    assert not (step / "packmol.pdb").exists()
+
+    pdb_db = SystemDB(filename=str(pdb_job / "seamm.db"))
+    xyz_db = SystemDB(filename=str(xyz_job / "seamm.db"))
+    try:
+        expected = pdb_db.system.configuration
+        configuration = xyz_db.system.configuration
+        assert configuration.n_atoms == expected.n_atoms
+        assert configuration.bonds.n_bonds == expected.bonds.n_bonds
+        assert configuration.atoms.symbols == expected.atoms.symbols
+        assert configuration.cell.parameters == expected.cell.parameters
+        xyz = np.array(configuration.atoms.get_coordinates(fractionals=False))
+        xyz0 = np.array(expected.atoms.get_coordinates(fractionals=False))
+        assert xyz == pytest.approx(xyz0, abs=1.0e-3)
+    finally:
+        xyz_db.close()
+        pdb_db.close()
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n", [1000, 10000, 100000])
+def test_template_speed(n):
+    """Compare writing a large template as PDB and as xyz."""
+    db = SystemDB(filename="file:formats_db?mode=memory&cache=shared")
+    try:
+        configuration = db.create_system(name="chain").create_configuration(name="1")
+        xyz = np.random.default_rng(1).uniform(0.0, 100.0, size=(n, 3))
+        configuration.atoms.append(
+            x=xyz[:, 0].tolist(),
+            y=xyz[:, 1].tolist(),
+            z=xyz[:, 2].tolist(),
+            symbol=["C"] * n,
+        )
+        times = {}
+        for filetype in ("pdb", "xyz"):
+            t0 = time.perf_counter()
+            text = packmol_step.template_text(configuration, filetype)
+            lines = list(packmol_step.atom_lines(text.splitlines(), filetype))
+            if filetype == "pdb" and n > 99999:
+                # The columns of the PDB file overflow, so it cannot be read
+                times[filetype] = time.perf_counter() - t0
+                continue
+            symbols, _, xyz = packmol_step.parse_atoms(lines, filetype)
+            times[filetype] = time.perf_counter() - t0
+            assert len(symbols) == n
+    finally:
+        db.close()
+    print(
+        f"\n{n:7d} atoms: writing and reading PDB {times['pdb']:6.3f} s, "
+        f"xyz {times['xyz']:6.3f} s"
+    )
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the history of builds and the predictions from it."""
+
+import sqlite3
+
+import pytest
+
+from packmol_step import BuildHistory
+
+
+def build(n_atoms, wall_time=None, shape="cubic", periodic=True):
+    """The features and measurements of a build."""
+    return {
+        "n_atoms": n_atoms,
+        "n_molecules": n_atoms // 3,
+        "n_components": 1,
+        "n_solute_atoms": 0,
+        "density": 1.0,
+        "shape": shape,
+        "periodic": periodic,
+        "tolerance": 2.0,
+        "packmol_version": "20.14.2",
+        "wall_time": wall_time,
+        "peak_rss": None if wall_time is None else 1000 * n_atoms,
+        "converged": True,
+    }
+
+
+@pytest.mark.unit
+def test_empty(tmp_path):
+    """With no history there is no prediction."""
+    with BuildHistory(tmp_path / "history.db") as history:
+        assert len(history) == 0
+        assert history.predict(build(3000)) is None
+
+
+@pytest.mark.unit
+def test_predict(tmp_path):
+    """A quadratic history is extrapolated quadratically."""
+    path = tmp_path / "history.db"
+    with BuildHistory(path) as history:
+        for n in (300, 1000, 3000, 10000):
+            history.record(build(n, wall_time=(n / 1000) ** 2))
+        history.record(build(1000, wall_time=100.0, shape="spherical"))
+
+    with BuildHistory(path) as history:
+        assert len(history) == 5
+        prediction = history.predict(build(30000), k=2)
+
+    assert prediction["n"] == 2
+    assert prediction["wall_time"] == pytest.approx(900.0)
+    assert prediction["peak_rss"] == pytest.approx(3.0e7)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("flag", ["resumed", "stopped_early", "coarse_grained"])
+def test_flagged_builds(tmp_path, flag):
+    """Builds that did not pack from scratch to the end are not used."""
+    with BuildHistory(tmp_path / "history.db") as history:
+        history.record({**build(1000, wall_time=1.0), flag: True})
+        assert history.predict(build(1000)) is None
+        history.record(build(1000, wall_time=2.0))
+        prediction = history.predict(build(1000))
+
+    assert prediction["n"] == 1
+    assert prediction["wall_time"] == pytest.approx(2.0)
+
+
+@pytest.mark.unit
+def test_older_history(tmp_path):
+    """A history without the flags gains them, and its builds are used."""
+    path = tmp_path / "history.db"
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE builds (id INTEGER PRIMARY KEY, date TEXT, n_atoms INTEGER, "
+        "n_molecules INTEGER, density REAL, shape TEXT, periodic INTEGER, "
+        "wall_time REAL, peak_rss INTEGER)"
+    )
+    db.execute(
+        "INSERT INTO builds (n_atoms, n_molecules, density, shape, periodic, "
+        "wall_time) VALUES (1000, 333, 1.0, 'cubic', 1, 3.0)"
+    )
+    db.commit()
+    db.close()
+
+    with BuildHistory(path) as history:
+        history.record({**build(1000, wall_time=1.0), "resumed": True})
+        prediction = history.predict(build(1000))
+
+    assert prediction["n"] == 1
+    assert prediction["wall_time"] == pytest.approx(3.0)
+
+
+@pytest.mark.unit
+def test_closed_if_not_a_history(tmp_path, monkeypatch):
+    """The database is closed if it cannot be opened as a history."""
+    path = tmp_path / "history.db"
+    path.write_text("This is not a database, but is long enough to look like one.\n")
+    connections = []
+    connect = sqlite3.connect
+
+    def tracked(*args, **kwargs):
+        connections.append(connect(*args, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(sqlite3, "connect", tracked)
+    with pytest.raises(sqlite3.DatabaseError):
+        BuildHistory(path)
+    with pytest.raises(sqlite3.ProgrammingError, match="closed"):
+        connections[0].execute("SELECT 1")
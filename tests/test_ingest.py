@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for reading the structure from Packmol in batches."""
+
+import io
+import math
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+from packmol_step.packmol import peak_rss, reset_peak_rss
+
+fake = Path(__file__).resolve().parent / "fake_packmol.py"
+
+
+def build(directory, n=20, smiles=("O", "C")):
+    """Pack a periodic mixture with the fake Packmol.
+
+    Returns the molecules from get_input, and the temporary database holding their
+    templates, which the caller must close.
+    """
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters["periodic"].value = "Yes"
+    parameters["shape"].value = "cubic"
+    parameters["molecules"].value = [
+        {"component": "fluid", "source": "SMILES", "definition": s, "count": "1"}
+        for s in smiles
+    ]
+    parameters["fluid amount"].value = "rounding this number of molecules"
+    parameters["approximate number of molecules"].value = n
+    P = parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+
+    system_db = SystemDB(filename="file:build_db?mode=memory&cache=shared")
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    molecules, files, text, cell = packmol_step.Packmol.get_input(
+        P, system_db, tmp_db, seamm.flowchart_variables
+    )
+    system_db.close()
+
+    for name, data in files.items():
+        (directory / name).write_text(data)
+    with open(directory / "input.inp") as fd:
+        subprocess.run(
+            [sys.executable, str(fake)],
+            stdin=fd,
+            cwd=directory,
+            capture_output=True,
+            check=True,
+        )
+    return molecules, cell, tmp_db
+
+
+def argon_pdb(path, n):
+    """Write a PDB file of argon on a simple cubic lattice, returning its side."""
+    k = math.ceil(n ** (1 / 3))
+    with open(path, "w") as fd:
+        for i in range(n):
+            x, y, z = 3.4 * (i // k**2), 3.4 * (i // k % k), 3.4 * (i % k)
+            fd.write(
+                f"HETATM{(i + 1) % 100000:5d} AR   UNK A   1    {x:8.3f}{y:8.3f}"
+                f"{z:8.3f}  1.00  0.00          AR\n"
+            )
+    return 3.4 * k
+
+
+def periodic(configuration, cell):
+    """Make the configuration periodic, in fractional coordinates."""
+    configuration.periodicity = 3
+    configuration.cell.parameters = (*cell, 90.0, 90.0, 90.0)
+    configuration.coordinate_system = "fractional"
+    return configuration
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("batch_size", [1, 7, 100000])
+def test_ingest_pdb(configuration, tmp_path, batch_size):
+    """The atoms, bonds and coordinates are the same for any batch size."""
+    molecules, cell, tmp_db = build(tmp_path)
+    periodic(configuration, cell)
+    text = (tmp_path / "packmol.pdb").read_text()
+    with open(tmp_path / "packmol.pdb") as fd:
+        n = packmol_step.ingest_pdb(configuration, fd, molecules, batch_size=batch_size)
+    n_bonds = sum(m["number"] * len(m["bonds"]) for m in molecules)
+    tmp_db.close()
+
+    symbols, xs, ys, zs = packmol_step.pdb_atoms(text)
+    assert n == len(symbols) == configuration.n_atoms
+    assert configuration.atoms.symbols == symbols
+    assert configuration.bonds.n_bonds == n_bonds
+    a, b, c = cell
+    expected = [v for x, y, z in zip(xs, ys, zs) for v in (x / a, y / b, z / c)]
+    xyz = configuration.atoms.get_coordinates(fractionals=True)
+    assert [v for point in xyz for v in point] == pytest.approx(expected)
+
+
+@pytest.mark.unit
+def test_ingest_pdb_skips_existing(configuration, tmp_path):
+    """Skipped atoms at the start of the file are not read."""
+    molecules, cell, tmp_db = build(tmp_path, smiles=("O",))
+    lines = (tmp_path / "packmol.pdb").read_text().splitlines()
+    fixed = (
+        "HETATM    1 AR   UNK A   1       1.000   2.000   3.000  1.00  0.00"
+        "          AR"
+    )
+    text = "\n".join([lines[0], fixed, *lines[1:]])
+    n = packmol_step.ingest_pdb(configuration, io.StringIO(text), molecules, skip=1)
+    tmp_db.close()
+
+    assert n == configuration.n_atoms == 60
+    assert "Ar" not in configuration.atoms.symbols
+
+
+@pytest.mark.unit
+def test_ingest_pdb_truncated(configuration, tmp_path):
+    """A structure with missing atoms is an error."""
+    molecules, cell, tmp_db = build(tmp_path, smiles=("O",))
+    lines = (tmp_path / "packmol.pdb").read_text().splitlines()
+    text = "\n".join(lines[0:-10])
+    with pytest.raises(RuntimeError, match="stopped while writing"):
+        packmol_step.ingest_pdb(configuration, io.StringIO(text), molecules)
+    tmp_db.close()
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n", [10000, 100000, 1000000])
+def test_ingest_memory(configuration, tmp_path, n):
+    """Compare the time and memory for reading argon all at once and in batches."""
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    template = tmp_db.create_system(name="argon").create_configuration(name="Ar")
+    template.atoms.append(x=[0.0], y=[0.0], z=[0.0], symbol=["Ar"])
+    molecules = [{"configuration": template, "number": n, "bonds": []}]
+
+    side = argon_pdb(tmp_path / "packmol.pdb", n)
+    periodic(configuration, (side, side, side))
+
+    reset_peak_rss()
+    rss0 = peak_rss()
+    t0 = time.perf_counter()
+    with open(tmp_path / "packmol.pdb") as fd:
+        packmol_step.ingest_pdb(configuration, fd, molecules, batch_size=10000)
+    t_batch = time.perf_counter() - t0
+    rss_batch = peak_rss() - rss0
+    assert configuration.n_atoms == n
+
+    other = configuration.system.create_configuration(name="all at once")
+    reset_peak_rss()
+    rss0 = peak_rss()
+    t0 = time.perf_counter()
+    other.from_pdb_text((tmp_path / "packmol.pdb").read_text())
+    t_text = time.perf_counter() - t0
+    rss_text = peak_rss() - rss0
+    tmp_db.close()
+
+    print(
+        f"\n{n:7d} atoms: in batches {t_batch:6.2f} s {rss_batch / 2**20:7.1f} MiB, "
+        f"all at once {t_text:6.2f} s {rss_text / 2**20:7.1f} MiB"
+    )
+
+
+@pytest.mark.unit
+def test_atom_data():
+    """The coordinates are converted to fractional in the cell."""
+    lines = [
+        "HETATM    1 AR   UNK A   1       5.000  10.000  15.000  1.00  0.00"
+        "          AR",
+        "HETATM    2 CL   UNK A   2      20.000   0.000   2.500  1.00  0.00"
+        "          CL",
+    ]
+    data = packmol_step.atom_data(lines, cell=(20.0, 20.0, 10.0))
+    assert data["x"] == [0.25, 1.0]
+    assert data["y"] == [0.5, 0.0]
+    assert data["z"] == [1.5, 0.25]
+    assert data["symbol"] == ["Ar", "Cl"]
+    assert data["name"] == ["AR", "CL"]
+    assert packmol_step.atom_data(lines)["x"] == [5.0, 20.0]
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n", [100000, 1000000])
+def test_fractional_ingestion(configuration, tmp_path, n):
+    """Time converting to fractional coordinates before and after writing them."""
+    side = argon_pdb(tmp_path / "packmol.pdb", n)
+    text = (tmp_path / "packmol.pdb").read_text()
+    cell = (side, side, side)
+
+    # Write Cartesian coordinates, then read, convert and write them again
+    t0 = time.perf_counter()
+    configuration.from_pdb_text(text)
+    periodic(configuration, cell)
+    configuration.coordinate_system = "Cartesian"
+    xyz = configuration.atoms.get_coordinates(fractionals=False)
+    configuration.coordinate_system = "fractional"
+    configuration.atoms.set_coordinates(xyz, fractionals=False)
+    t_twice = time.perf_counter() - t0
+    expected = configuration.atoms.get_coordinates(fractionals=True)
+
+    # Convert the coordinates in one array operation and write them once
+    other = periodic(
+        configuration.system.create_configuration(name="converted once"), cell
+    )
+    t0 = time.perf_counter()
+    if "name" not in other.atoms:
+        other.atoms.add_attribute("name", coltype="str")
+    lines = [line for line in text.splitlines() if line[0:6] == "HETATM"]
+    other.atoms.append(**packmol_step.atom_data(lines, cell))
+    t_once = time.perf_counter() - t0
+
+    xyz = other.atoms.get_coordinates(fractionals=True)
+    assert xyz[-1] == pytest.approx(expected[-1])
+    print(f"\n{n:8d} atoms: writing twice {t_twice:6.2f} s, once {t_once:6.2f} s")
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("batch_size", [1, 7, 100000])
+def test_molecule_and_template(db, configuration, tmp_path, batch_size):
+    """Each atom is labeled with its molecule and template, for any batch size."""
+    molecules, cell, tmp_db = build(tmp_path)
+    packmol_step.register_templates(db, molecules)
+    periodic(configuration, cell)
+    with open(tmp_path / "packmol.pdb") as fd:
+        packmol_step.ingest_pdb(configuration, fd, molecules, batch_size=batch_size)
+    tmp_db.close()
+
+    expected = packmol_step.molecule_columns(molecules)
+    assert configuration.atoms.get_column_data("molecule") == expected["molecule"]
+    assert configuration.atoms.get_column_data("template") == expected["template"]
+    n_water = molecules[0]["number"]
+    assert expected["molecule"][0:6] == [0, 0, 0, 1, 1, 1]
+    assert expected["molecule"][3 * n_water] == n_water
+    assert packmol_step.next_molecule(configuration) == sum(
+        m["number"] for m in molecules
+    )
+
+
+@pytest.mark.unit
+def test_register_templates(db, tmp_path):
+    """The templates are in the table once, with their size and mass."""
+    molecules, cell, tmp_db = build(tmp_path)
+    packmol_step.register_templates(db, molecules)
+    tids = [m["template id"] for m in molecules]
+    packmol_step.register_templates(db, molecules)
+    tmp_db.close()
+
+    assert [m["template id"] for m in molecules] == tids
+    assert db.templates.n_templates == 2
+    water = db.templates.get("O", category="molecule")
+    assert water.id == tids[0]
+    rows = {row["name"]: row for row in db.templates.rows()}
+    assert rows["O"]["n_atoms"] == 3
+    assert rows["C"]["n_atoms"] == 5
+    assert rows["O"]["mass"] == pytest.approx(18.015, abs=1.0e-2)
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n", [1000, 10000, 100000])
+def test_molecules_from_columns(configuration, tmp_path, n):
+    """Compare finding the molecules from the bonds with reading the column."""
+    molecules, cell, tmp_db = build(tmp_path, n=n, smiles=("O",))
+    molecules[0]["template id"] = 1
+    periodic(configuration, cell)
+    with open(tmp_path / "packmol.pdb") as fd:
+        packmol_step.ingest_pdb(configuration, fd, molecules)
+    tmp_db.close()
+
+    t0 = time.perf_counter()
+    from_bonds = configuration.find_molecules(as_indices=True)
+    t_bonds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    column = configuration.atoms.get_column_data("molecule")
+    t_column = time.perf_counter() - t0
+
+    assert len(from_bonds) == max(column) + 1
+    print(
+        f"\n{n:7d} molecules: from the bonds {t_bonds:6.3f} s, from the column "
+        f"{t_column:6.3f} s"
+    )
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for building layered cells by packing the layers separately."""
+
+import json
+from pathlib import Path
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+
+test_dir = Path(__file__).resolve().parent
+flowchart = test_dir / "flowcharts" / "unit_20_rectangular_cell_volume_density.flow"
+
+
+def layer_parameters(**values):
+    """The parameters for a cell with a layer of water under one of methanol."""
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters["mode"].value = "build a layered cell"
+    parameters["molecules"].value = [
+        {"component": "fluid", "source": "SMILES", "definition": s, "count": "1"}
+        for s in ("O", "CO")
+    ]
+    for key, value in values.items():
+        parameters[key].value = value
+    return parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+
+
+@pytest.fixture()
+def step(tmp_path):
+    """A Packmol step in a flowchart in a temporary directory."""
+    flowchart = seamm.Flowchart(directory=str(tmp_path))
+    instance = packmol_step.Packmol(flowchart=flowchart)
+    instance._id = ("1",)
+    instance.options = {"template_cache": ""}
+    return instance
+
+
+@pytest.mark.unit
+def test_parse_layers():
+    """Each layer has a composition, density and thickness."""
+    assert packmol_step.parse_layers("1:0, 1:3", "1.0 0.8", "20, 10", 2) == [
+        {"composition": [1.0, 0.0], "density": 1.0, "thickness": 20.0},
+        {"composition": [1.0, 3.0], "density": 0.8, "thickness": 10.0},
+    ]
+    with pytest.raises(RuntimeError, match="should be the same"):
+        packmol_step.parse_layers("1:0, 0:1", "1.0", "20, 10", 2)
+    with pytest.raises(RuntimeError, match="each of the 2 fluid components"):
+        packmol_step.parse_layers("1, 1", "1.0, 1.0", "20, 10", 2)
+    with pytest.raises(RuntimeError, match="must be positive"):
+        packmol_step.parse_layers("1:0, 0:1", "1.0, 1.0", "20, -10", 2)
+    with pytest.raises(RuntimeError, match="Cannot understand"):
+        packmol_step.parse_lengths("20, x")
+
+
+@pytest.mark.unit
+def test_layer_offsets():
+    """The layers are stacked a gap apart, with the gap wrapping around the cell."""
+    offsets, height = packmol_step.layer_offsets([20.0, 10.0], 2.0)
+    assert offsets == pytest.approx([0.0, 22.0])
+    assert height == pytest.approx(34.0)
+
+    # A solid at the bottom is half a gap further from the layers on each side
+    offsets, height = packmol_step.layer_offsets([20.0, 10.0], 2.0, bottom=8.0)
+    assert offsets == pytest.approx([9.0, 31.0])
+    assert height == pytest.approx(44.0)
+
+
+@pytest.mark.unit
+def test_layer_input(empty_db):
+    """A layer is packed in a slab of its cell, at the density of the slab."""
+    P = layer_parameters()
+    P.update(
+        {
+            "mode": "build a new configuration",
+            "periodic": True,
+            "shape": "rectangular",
+            "dimensions": "given explicitly",
+            "fluid amount": "using the density",
+            "molecules": P["molecules"][0:1],
+        }
+    )
+    P["c"] = P["a"] + P["a"]
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    summary = {}
+    try:
+        molecules, files, text, cell = packmol_step.Packmol.get_input(
+            P,
+            empty_db,
+            tmp_db,
+            seamm.flowchart_variables,
+            summary=summary,
+            slab=(1.0, 9.0),
+        )
+    finally:
+        tmp_db.close()
+
+    a, b, c = cell
+    assert c == pytest.approx(2 * a)
+    assert f"   inside box 0.0 0.0 1.0000 {a:.4f} {b:.4f} 9.0000" in files["input.inp"]
+    # The density of the slab, not of the whole cell
+    n = molecules[0]["number"]
+    mass = n * molecules[0]["mass"].m_as("g")
+    volume = a * b * 8.0 * 1.0e-24
+    assert mass / volume == pytest.approx(P["density"].m_as("g/ml"), rel=0.02)
+
+
+@pytest.mark.unit
+def test_layers_on_solid(step, configuration):
+    """A periodic solute is the solid under the layers, and sets the cell."""
+    configuration.periodicity = 3
+    configuration.cell.parameters = (15.0, 12.0, 6.0, 90.0, 90.0, 90.0)
+    configuration.coordinate_system = "Cartesian"
+    configuration.atoms.append(
+        x=[0.0, 7.5], y=[0.0, 6.0], z=[1.0, 4.0], symbol=["Ar", "Ar"]
+    )
+    P = layer_parameters(
+        **{
+            "layer compositions": "1:1",
+            "layer densities": "0.9",
+            "layer thicknesses": "10",
+        }
+    )
+    P["molecules"].insert(
+        0,
+        {
+            "component": "solute",
+            "source": "configuration",
+            "definition": "current",
+            "count": "1",
+        },
+    )
+
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    summary = {}
+    try:
+        molecules, layers, text, cell = step._layers(
+            P, configuration.system_db, tmp_db, None, summary
+        )
+    finally:
+        tmp_db.close()
+
+    assert cell == pytest.approx((15.0, 12.0, 6.0 + 1.0 + 12.0 + 1.0))
+    assert molecules[0]["type"] == "solute"
+    assert molecules[0]["number"] == 1
+    assert [m["definition"] for m in molecules[1:]] == ["O", "CO"]
+    assert len(layers) == 1
+    assert layers[0]["offset"] == pytest.approx(7.0)
+    assert "   inside box 0.0 0.0 1.0000 15.0000 12.0000 11.0000" in (
+        layers[0]["files"]["input.inp"]
+    )
+    assert summary["n_atoms"] == 2 + layers[0]["n_atoms"]
+    assert summary["n_solute_atoms"] == 2
+
+
+@pytest.mark.unit
+def test_layered_cell(tmp_path, fake_packmol):
+    """The flowchart stacks a layer of water under one of methanol."""
+    head, text = flowchart.read_text().split("#flowchart\n")
+    text, end, tail = text.partition("\n#end")
+    data = json.loads(text)
+    for node in data["nodes"]:
+        if node["class"] == "Packmol":
+            P = node["attributes"]["parameters"]
+            P["mode"] = {"value": "build a layered cell", "units": None}
+            P["molecules"]["value"] = [
+                {
+                    "component": "fluid",
+                    "source": "SMILES",
+                    "definition": s,
+                    "count": "1",
+                }
+                for s in ("O", "CO")
+            ]
+            P["a"] = {"value": "15", "units": "Å"}
+            P["b"] = {"value": "15", "units": "Å"}
+            P["layer thicknesses"] = {"value": "12, 10", "units": None}
+    path = tmp_path / "flowchart.flow"
+    path.write_text(head + "#flowchart\n" + json.dumps(data, indent=4) + end + tail)
+
+    # Run in a separate process, since the options can only be parsed once
+    job = tmp_path / "job"
+    job.mkdir()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"from seamm_exec import run; run(wdir={str(job)!r})",
+            str(path),
+            "--standalone",
+            "--root",
+            str(fake_packmol),
+        ],
+        capture_output=True,
+        check=True,
+    )
+
+    db = SystemDB(filename=str(job / "seamm.db"))
+    try:
+        configuration = db.system.configuration
+        assert configuration.cell.parameters == pytest.approx(
+            (15.0, 15.0, 12.0 + 2.0 + 10.0 + 2.0, 90.0, 90.0, 90.0)
+        )
+        symbols = configuration.atoms.symbols
+        n_methanol = symbols.count("C")
+        n_water = symbols.count("O") - n_methanol
+        assert n_water > 0 and n_methanol > 0
+        assert configuration.n_atoms == 3 * n_water + 6 * n_methanol
+        assert configuration.bonds.n_bonds == 2 * n_water + 5 * n_methanol
+
+        # The water is all in the bottom layer and the methanol in the top one
+        xyz = np.array(configuration.atoms.get_coordinates(fractionals=False))
+        water = xyz[0 : 3 * n_water : 3]
+        methanol = xyz[3 * n_water :: 6]
+        assert 0.0 < water[:, 2].min()
+        assert water[:, 2].max() < 14.0 < methanol[:, 2].min()
+        assert methanol[:, 2].max() < 26.0
+
+        # Each atom is labeled with its molecule
+        molecule = configuration.atoms.get_column_data("molecule")
+        assert molecule[-1] == n_water + n_methanol - 1
+    finally:
+        db.close()
+
+    metrics = json.loads(next(job.glob("**/metrics.json")).read_text())
+    assert len(metrics["layer times"]) == 2
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "key, value", [("composition series", "1:0, 0:1"), ("density series", "0.8, 1.0")]
+)
+def test_layers_reject_series(step, key, value):
+    """A series for the whole cell would mix the layers, so is not allowed."""
+    P = layer_parameters(**{key: value})
+    with pytest.raises(RuntimeError, match=f"cannot have a {key}"):
+        step._layers(P, None, None, None, {})
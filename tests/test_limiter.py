@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the host-wide limit on Packmol processes."""
+
+import os
+import threading
+import time
+
+import pytest
+
+from packmol_step import ProcessLimiter
+
+
+@pytest.mark.unit
+def test_no_limit(tmp_path):
+    """Without a limit nothing waits and no lock files are made."""
+    with ProcessLimiter(tmp_path / "locks") as limiter:
+        assert not limiter.enabled
+        assert limiter.slot is None
+    assert not (tmp_path / "locks").exists()
+
+
+@pytest.mark.unit
+def test_waits_for_slot(tmp_path):
+    """A second user of a single slot waits until the first releases it."""
+    first = ProcessLimiter(tmp_path, max_processes=1, poll=0.05)
+    first.acquire()
+    assert first.slot == 0
+
+    second = ProcessLimiter(tmp_path, max_processes=1, poll=0.05)
+    thread = threading.Thread(target=second.acquire)
+    thread.start()
+    time.sleep(0.3)
+    assert second.slot is None
+    first.release()
+    thread.join()
+    second.release()
+
+    assert second.slot == 0
+    assert second.wait_time >= 0.25
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="Linux only")
+def test_pinning(tmp_path):
+    """Pinning sets the affinity while the slot is held, then restores it."""
+    original = os.sched_getaffinity(0)
+    with ProcessLimiter(tmp_path, max_processes=2, cores_per_process=1) as limiter:
+        assert os.sched_getaffinity(0) == set(limiter.cores)
+    assert os.sched_getaffinity(0) == original
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="Linux only")
+def test_no_pinning_without_slots(tmp_path, caplog):
+    """Without a limit on the processes there is no slot to pin to."""
+    original = os.sched_getaffinity(0)
+    with ProcessLimiter(tmp_path, cores_per_process=1) as limiter:
+        assert limiter.cores is None
+        assert os.sched_getaffinity(0) == original
+    assert "Not pinning Packmol" in caplog.text
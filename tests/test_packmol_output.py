@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for parsing and monitoring the output of Packmol."""
+
+import subprocess
+import time
+
+import pytest
+
+from packmol_step import accepted_loop, Monitor, packmol_processes, parse_output
+
+# An abbreviated packmol.out, stopped while packing all the molecules together
+output = """
+                                Version 20.14.2
+
+  Packing molecules of type:            1
+
+  Starting GENCAN loop:            0
+  Function value from last GENCAN loop: f = .12345E+01
+  Maximum violation of target distance:     1.500000
+  Maximum violation of the constraints: .00000E+00
+
+  Packing all molecules together
+
+  Starting GENCAN loop:            0
+  Function value from last GENCAN loop: f = .43181E+02
+  Best function value before: f = .10823E+03
+  Maximum violation of target distance:     0.826012
+  Maximum violation of the constraints: .00000E+00
+  Current solution written to file: packmol.pdb
+
+  Starting GENCAN loop:            1
+  Function value from last GENCAN loop: f = .52000E-01
+  Best function value before: f = .43181E+02
+  Maximum violation of target distance:     0.150000
+  Maximum violation of the constraints: .00000E+00
+  Current solution written to file: packmol.pdb
+"""
+
+
+@pytest.mark.unit
+def test_parse_output():
+    """The loops are parsed with their phase and quality."""
+    data = parse_output(output, tolerance=2.0)
+
+    assert data["version"] == "20.14.2"
+    assert data["converged"] is None
+    assert [loop["phase"] for loop in data["loops"]] == ["type", "all", "all"]
+    loop = data["loops"][-1]
+    assert loop["function value"] == pytest.approx(0.052)
+    assert loop["minimum distance"] == pytest.approx(1.85)
+    assert loop["written"]
+
+
+@pytest.mark.unit
+def test_parse_final():
+    """The final values are parsed from a finished run."""
+    text = output + """
+  Success!
+  Final objective function value: .22503E-01
+  Maximum violation of target distance:   0.000000
+  Maximum violation of the constraints: .78985E-02
+  Running time:    0.412000 seconds.
+"""
+    data = parse_output(text)
+
+    assert data["converged"] is True
+    assert data["final function value"] == pytest.approx(0.022503)
+    assert data["minimum distance"] == pytest.approx(2.0)
+    assert data["final constraint violation"] == pytest.approx(0.0078985)
+    assert len(data["loops"]) == 3
+    assert data["running time"] == pytest.approx(0.412)
+
+
+@pytest.mark.unit
+def test_accepted_loop():
+    """Only a written structure from packing everything can be accepted."""
+    data = parse_output(output)
+
+    assert accepted_loop(data, "minimum distance above", 1.8)["loop"] == 1
+    assert accepted_loop(data, "minimum distance above", 1.9) is None
+    assert accepted_loop(data, "objective function below", 0.1)["loop"] == 1
+    assert accepted_loop(data, "objective function below", 0.01) is None
+
+
+@pytest.mark.unit
+def test_monitor_stops_packmol(tmp_path):
+    """The monitor stops Packmol once the criterion is met."""
+    pytest.importorskip("psutil")
+    (tmp_path / "packmol.out").write_text(output)
+
+    # "sleep 30" stands in for the Packmol command
+    process = subprocess.Popen(["sleep", "30"], cwd=tmp_path)
+    monitor = Monitor(
+        tmp_path / "packmol.out",
+        "minimum distance above",
+        1.8,
+        poll=0.05,
+        code="sleep 30",
+    )
+    t0 = time.perf_counter()
+    monitor.start()
+    process.wait(timeout=10)
+    monitor.finish()
+
+    assert time.perf_counter() - t0 < 10
+    assert monitor.stopped
+    assert monitor.accepted["loop"] == 1
+
+
+@pytest.mark.unit
+def test_monitor_waits_while_writing(tmp_path):
+    """Packmol is not stopped while it may be writing the structure."""
+    pytest.importorskip("psutil")
+    path = tmp_path / "packmol.out"
+    path.write_text(output + """
+  Starting GENCAN loop:            2
+  Function value from last GENCAN loop: f = .40000E-01
+  Maximum violation of target distance:     0.100000
+  Maximum violation of the constraints: .00000E+00
+""")
+    (tmp_path / "packmol.pdb").write_text("partial\n")
+
+    # "sleep 30" stands in for the Packmol command
+    process = subprocess.Popen(["sleep", "30"], cwd=tmp_path)
+    monitor = Monitor(
+        path,
+        "minimum distance above",
+        1.8,
+        poll=0.05,
+        structure=tmp_path / "packmol.pdb",
+        code="sleep 30",
+    )
+    monitor.start()
+    time.sleep(0.5)
+    assert process.poll() is None
+    assert not monitor.stopped
+
+    # Packmol finishes writing the structure for loop 2
+    (tmp_path / "packmol.pdb").write_text("complete\n")
+    with open(path, "a") as fd:
+        fd.write("  Current solution written to file: packmol.pdb\n")
+    process.wait(timeout=10)
+    monitor.finish()
+
+    assert monitor.stopped
+    assert monitor.accepted["loop"] == 2
+    assert monitor.copy == tmp_path / "accepted.pdb"
+    assert monitor.copy.read_text() == "complete\n"
+
+
+@pytest.mark.unit
+def test_packmol_processes(tmp_path):
+    """Only the Packmol command in the directory is found, not its shell."""
+    pytest.importorskip("psutil")
+    other = tmp_path / "other"
+    other.mkdir()
+    shell = subprocess.Popen(["/bin/sh", "-c", "sleep 30; true"], cwd=tmp_path)
+    elsewhere = subprocess.Popen(["sleep", "30"], cwd=other)
+    try:
+        time.sleep(0.2)
+        processes = packmol_processes("/usr/bin/sleep 30", tmp_path)
+        assert len(processes) == 1
+        assert processes[0].ppid() == shell.pid
+        assert processes[0].cmdline() == ["sleep", "30"]
+        assert packmol_processes("sleep 10", tmp_path) == []
+    finally:
+        for process in (shell, elsewhere):
+            process.kill()
+            process.wait()
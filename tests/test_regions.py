@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for building several separate regions, like droplets, in one cell."""
+
+import json
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+
+test_dir = Path(__file__).resolve().parent
+flowchart = test_dir / "flowcharts" / "unit_20_rectangular_cell_volume_density.flow"
+
+
+def minimum_image(delta, cell):
+    """The shortest vectors between points in a periodic cell."""
+    return delta - cell * np.round(delta / cell)
+
+
+@pytest.mark.unit
+def test_parse_regions():
+    """Each region has a shape, size, composition and density."""
+    regions = packmol_step.parse_regions(
+        "sphere box, box", "20, 30x20x10; 10", "1:0, 1:1, 0:1", "1.0, 0.9, 0.8", 2
+    )
+    assert [r["shape"] for r in regions] == ["sphere", "box", "box"]
+    assert [r["sides"] for r in regions] == [
+        (20.0, 20.0, 20.0),
+        (30.0, 20.0, 10.0),
+        (10.0, 10.0, 10.0),
+    ]
+    assert regions[0]["radius"] == pytest.approx(10.0)
+    assert regions[1]["radius"] == pytest.approx(np.sqrt(1400.0) / 2)
+    assert regions[2]["composition"] == [0.0, 1.0]
+    assert regions[2]["density"] == pytest.approx(0.8)
+
+    with pytest.raises(RuntimeError, match="should be the same"):
+        packmol_step.parse_regions("sphere", "20, 20", "1:0", "1.0", 2)
+    with pytest.raises(RuntimeError, match="Do not recognize the region shape"):
+        packmol_step.parse_regions("cylinder", "20", "1:0", "1.0", 2)
+    with pytest.raises(RuntimeError, match="its diameter"):
+        packmol_step.parse_regions("sphere", "20x10x10", "1:0", "1.0", 2)
+    with pytest.raises(RuntimeError, match="one length, or three"):
+        packmol_step.parse_sizes("20x10")
+
+
+@pytest.mark.unit
+def test_place_regions():
+    """The regions are apart from each other and their periodic images."""
+    cell = np.array((60.0, 50.0, 40.0))
+    radii = [10.0, 8.0, 8.0, 5.0, 5.0, 5.0]
+    centers = packmol_step.place_regions(radii, cell, 2.0)
+    assert np.all((centers >= 0.0) & (centers < cell))
+    for i in range(len(radii)):
+        for j in range(i):
+            distance = np.linalg.norm(minimum_image(centers[i] - centers[j], cell))
+            assert distance >= radii[i] + radii[j] + 2.0
+
+    # The placement is reproducible
+    assert packmol_step.place_regions(radii, cell, 2.0) == pytest.approx(centers)
+
+    with pytest.raises(RuntimeError, match="does not fit"):
+        packmol_step.place_regions([20.0], cell, 2.0)
+    with pytest.raises(RuntimeError, match="without overlapping"):
+        packmol_step.place_regions([15.0] * 10, cell, 2.0)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "key, value", [("composition series", "1:0, 0:1"), ("density series", "0.8, 1.0")]
+)
+def test_regions_reject_series(tmp_path, key, value):
+    """A series for the whole cell would mix the regions, so is not allowed."""
+    seamm.flowchart_variables = seamm.Variables()
+    step = packmol_step.Packmol(flowchart=seamm.Flowchart(directory=str(tmp_path)))
+    parameters = packmol_step.PackmolParameters()
+    parameters["mode"].value = "build separate regions"
+    parameters[key].value = value
+    P = parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+    with pytest.raises(RuntimeError, match=f"cannot have a {key}"):
+        step._regions(P, None, None, None, {})
+
+
+@pytest.mark.unit
+def test_separate_regions(tmp_path, fake_packmol):
+    """The flowchart packs a droplet of water and a box of methanol in one cell."""
+    head, text = flowchart.read_text().split("#flowchart\n")
+    text, end, tail = text.partition("\n#end")
+    data = json.loads(text)
+    for node in data["nodes"]:
+        if node["class"] == "Packmol":
+            P = node["attributes"]["parameters"]
+            P["mode"] = {"value": "build separate regions", "units": None}
+            P["molecules"]["value"] = [
+                {
+                    "component": "fluid",
+                    "source": "SMILES",
+                    "definition": s,
+                    "count": "1",
+                }
+                for s in ("O", "CO")
+            ]
+            for key in ("a", "b", "c"):
+                P[key] = {"value": "50", "units": "Å"}
+            P["region shapes"] = {"value": "sphere, box", "units": None}
+            P["region sizes"] = {"value": "16, 12", "units": None}
+    path = tmp_path / "flowchart.flow"
+    path.write_text(head + "#flowchart\n" + json.dumps(data, indent=4) + end + tail)
+
+    # Run in a separate process, since the options can only be parsed once
+    job = tmp_path / "job"
+    job.mkdir()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"from seamm_exec import run; run(wdir={str(job)!r})",
+            str(path),
+            "--standalone",
+            "--root",
+            str(fake_packmol),
+        ],
+        capture_output=True,
+        check=True,
+    )
+
+    cell = np.array((50.0, 50.0, 50.0))
+    regions = packmol_step.parse_regions("sphere, box", "16, 12", "1:0, 0:1", "1, 1", 2)
+    centers = packmol_step.place_regions([r["radius"] for r in regions], cell, 5.0)
+
+    db = SystemDB(filename=str(job / "seamm.db"))
+    try:
+        configuration = db.system.configuration
+        assert configuration.cell.parameters == pytest.approx(
+            (50.0, 50.0, 50.0, 90.0, 90.0, 90.0)
+        )
+        symbols = configuration.atoms.symbols
+        n_methanol = symbols.count("C")
+        n_water = symbols.count("O") - n_methanol
+        assert n_water > 0 and n_methanol > 0
+        assert configuration.n_atoms == 3 * n_water + 6 * n_methanol
+        assert configuration.bonds.n_bonds == 2 * n_water + 5 * n_methanol
+
+        # The water is in the droplet and the methanol in the box, up to the size
+        # of the molecules, which the fake Packmol only keeps the centers of inside
+        xyz = np.array(configuration.atoms.get_coordinates(fractionals=False))
+        water = xyz[0 : 3 * n_water : 3]
+        methanol = xyz[3 * n_water :: 6]
+        distance = np.linalg.norm(minimum_image(water - centers[0], cell), axis=1)
+        assert distance.max() <= 8.0 + 1.5
+        delta = np.abs(minimum_image(methanol - centers[1], cell))
+        assert delta.max() <= 6.0 + 1.5
+
+        molecule = configuration.atoms.get_column_data("molecule")
+        assert molecule[-1] == n_water + n_methanol - 1
+    finally:
+        db.close()
+
+    metrics = json.loads(next(job.glob("**/metrics.json")).read_text())
+    assert len(metrics["region times"]) == 2
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n", [10, 100, 1000])
+def test_placing_speed(n):
+    """Time placing droplets in a dilute cell, as for an aerosol."""
+    radii = np.random.default_rng(1).uniform(5.0, 15.0, n)
+    side = (n * 4 / 3 * np.pi * 15.0**3 / 0.05) ** (1 / 3)
+    t0 = time.perf_counter()
+    packmol_step.place_regions(radii, (side, side, side), 2.0)
+    t = time.perf_counter() - t0
+    print(f"\n{n:5d} droplets: placing them took {t:6.3f} s")
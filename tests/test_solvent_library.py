@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for solvating by tiling boxes from the solvent library."""
+
+import json
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+
+test_dir = Path(__file__).resolve().parent
+fake = test_dir / "fake_packmol.py"
+solute_input = next(test_dir.glob("inputs/test_13_*.json"))
+
+
+def water_box(configuration, n=4, spacing=3.1, order=(0, 1, 2)):
+    """A periodic box of n**3 water molecules on a lattice, some split by the cell.
+
+    The atoms of each molecule are O, H, H, or in the given order of those.
+    """
+    side = n * spacing
+    configuration.periodicity = 3
+    configuration.cell.parameters = (side, side, side, 90.0, 90.0, 90.0)
+    water = np.array(((0.0, 0.0, 0.0), (0.96, 0.0, 0.0), (-0.24, 0.93, 0.0)))
+    water = water[list(order)]
+    symbols = [("O", "H", "H")[i] for i in order]
+    oxygen = list(order).index(0)
+    hydrogens = [h for h in range(3) if h != oxygen]
+    xyz = []
+    for i in range(n):
+        for j in range(n):
+            for k in range(n):
+                # The hydrogen atoms of the first layer are across the cell
+                origin = np.array((i, j, k)) * spacing + (0.1 if i > 0 else 0.0)
+                xyz.extend(((water + origin) % side).tolist())
+    x, y, z = zip(*xyz)
+    ids = configuration.atoms.append(x=x, y=y, z=z, symbol=symbols * n**3)
+    configuration.bonds.append(
+        i=[ids[3 * m + oxygen] for m in range(n**3) for _ in range(2)],
+        j=[ids[3 * m + h] for m in range(n**3) for h in hydrogens],
+        bondorder=[1] * (2 * n**3),
+    )
+    return side
+
+
+def solute_parameters(**values):
+    """The parameters for solvating biphenyl in water."""
+    data = json.loads(solute_input.read_text())
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters.from_dict(data)
+    parameters["solvation"].value = "tiling a box from the solvent library"
+    for key, value in values.items():
+        parameters[key].value = value
+    return parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+
+
+def get_input(P, library):
+    """Run get_input with a temporary database, returning the files and more."""
+    system_db = SystemDB(filename="file:seamm_db?mode=memory&cache=shared")
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    summary = {}
+    try:
+        molecules, files, text, cell = packmol_step.Packmol.get_input(
+            P,
+            system_db,
+            tmp_db,
+            seamm.flowchart_variables,
+            summary=summary,
+            library=library,
+        )
+        n_solute = molecules[0]["n_atoms"]
+    finally:
+        tmp_db.close()
+        system_db.close()
+    return files, text, cell, n_solute, summary
+
+
+@pytest.fixture()
+def library(configuration, tmp_path):
+    """A solvent library holding a box of water."""
+    directory = tmp_path / "library"
+    directory.mkdir()
+    water_box(configuration)
+    packmol_step.save_solvent_box(directory / "water.npz", configuration, "O")
+    return directory
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("box", [None, (7.0, 8.0, 9.0)])
+def test_close_atoms(box):
+    """The spatial index finds the same close points as comparing every pair."""
+    rng = np.random.default_rng(42)
+    points = rng.uniform(0.0, 9.0, size=(500, 3))
+    others = rng.uniform(0.0, 9.0, size=(50, 3))
+    delta = points[:, None, :] - others[None, :, :]
+    if box is not None:
+        delta -= np.array(box) * np.round(delta / np.array(box))
+    expected = (np.linalg.norm(delta, axis=2) < 1.5).any(axis=1)
+
+    result = packmol_step.close_atoms(points, others, 1.5, box=box)
+    assert result.tolist() == expected.tolist()
+    assert 0 < result.sum() < len(points)
+
+
+@pytest.mark.unit
+def test_save_and_find(library):
+    """A box is found by its canonical SMILES, with its molecules whole."""
+    assert packmol_step.find_solvent_box(library, "C") is None
+    assert packmol_step.find_solvent_box(library / "missing", "O") is None
+
+    box = packmol_step.find_solvent_box(library, "[OH2]")
+    assert box["name"] == "water"
+    assert box["atoms_per_molecule"] == 3
+    assert box["symbols"][0:6] == ["O", "H", "H", "O", "H", "H"]
+    assert box["bonds"] == [(0, 1), (0, 2)]
+    assert box["cell"] == pytest.approx([12.4, 12.4, 12.4])
+    xyz = box["xyz"].reshape(-1, 3, 3)
+    assert len(xyz) == 64
+    oh = np.linalg.norm(xyz[:, 1:, :] - xyz[:, 0:1, :], axis=2)
+    assert oh == pytest.approx(0.96, abs=1.0e-3)
+    centers = xyz.mean(axis=1)
+    assert np.all((centers >= 0.0) & (centers < box["cell"]))
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("periodic", [True, False])
+def test_tile_solvent(library, periodic):
+    """The solvent fills the cell, away from the solute."""
+    box = packmol_step.find_solvent_box(library, "O")
+    cell = (24.8, 12.4, 37.2) if periodic else (20.0, 12.4, 30.0)
+    solute = [(5.0, 5.0, 5.0), (6.0, 5.0, 5.0)]
+    xyz = packmol_step.tile_solvent(box, cell, periodic=periodic, solute=solute)
+
+    assert xyz.shape[1:] == (3, 3)
+    flat = xyz.reshape(-1, 3)
+    assert not packmol_step.close_atoms(
+        flat, solute, 2.0, box=cell if periodic else None
+    ).any()
+    if periodic:
+        assert 6 * 64 - 10 < len(xyz) < 6 * 64
+    else:
+        assert np.all((flat >= 0.0) & (flat <= cell))
+
+    with pytest.raises(RuntimeError, match="whole number of boxes"):
+        packmol_step.tile_solvent(box, (20.0, 12.4, 12.4))
+
+
+@pytest.mark.unit
+def test_tiled_input(library):
+    """The solute is solvated from the library without any input for Packmol."""
+    files, text, cell, n_solute, summary = get_input(solute_parameters(), library)
+
+    assert list(files) == ["packmol.pdb"]
+    assert "tiled from the box 'water'" in text
+    sides = np.array(cell) / 12.4
+    assert sides == pytest.approx(np.round(sides))
+
+    symbols, xs, ys, zs = packmol_step.pdb_atoms(files["packmol.pdb"])
+    assert len(symbols) == summary["n_atoms"]
+    assert (len(symbols) - n_solute) % 3 == 0
+    xyz = np.array((xs, ys, zs)).T
+    assert not packmol_step.close_atoms(
+        xyz[n_solute:], xyz[0:n_solute], 1.99, box=cell
+    ).any()
+    assert symbols[n_solute : n_solute + 3] == ["O", "H", "H"]
+
+
+@pytest.mark.unit
+def test_match_atoms():
+    """Atoms are matched by their elements and bonds, whatever their order."""
+    # Methanol as C, O, H, H, H, H and as H, O, C, H, H, H
+    symbols = ["C", "O", "H", "H", "H", "H"]
+    bonds = [(0, 1, 1), (0, 2, 1), (0, 3, 1), (0, 4, 1), (1, 5, 1)]
+    other = ["H", "O", "C", "H", "H", "H"]
+    other_bonds = [(2, 1), (2, 3), (2, 4), (2, 5), (1, 0)]
+
+    order = packmol_step.match_atoms(other, other_bonds, symbols, bonds)
+    assert [other[i] for i in order] == symbols
+    assert order[1] == 1 and order[5] == 0
+
+    # Different bonds do not match
+    assert packmol_step.match_atoms(other, other_bonds[:-1], symbols, bonds) is None
+    ethane = [(2, 1), (2, 3), (2, 4), (1, 5), (1, 0)]
+    assert packmol_step.match_atoms(other, ethane, symbols, bonds) is None
+
+
+@pytest.mark.unit
+def test_reordered_box(configuration, tmp_path):
+    """A box with its atoms in another order is reordered to match the template."""
+    library = tmp_path / "library"
+    library.mkdir()
+    water_box(configuration, order=(1, 0, 2))
+    packmol_step.save_solvent_box(library / "water.npz", configuration, "O")
+    assert packmol_step.find_solvent_box(library, "O")["symbols"][0:3] == [
+        "H",
+        "O",
+        "H",
+    ]
+
+    files, text, cell, n_solute, summary = get_input(solute_parameters(), library)
+
+    symbols, xs, ys, zs = packmol_step.pdb_atoms(files["packmol.pdb"])
+    assert symbols[n_solute:] == ["O", "H", "H"] * ((len(symbols) - n_solute) // 3)
+    xyz = np.array((xs, ys, zs)).T[n_solute:].reshape(-1, 3, 3)
+    oh = np.linalg.norm(xyz[:, 1:, :] - xyz[:, 0:1, :], axis=2)
+    assert oh == pytest.approx(0.96, abs=1.0e-2)
+
+
+@pytest.mark.unit
+def test_no_box_in_library(tmp_path):
+    """Without a box of the solvent, it is packed with Packmol as usual."""
+    files, text, cell, n_solute, summary = get_input(solute_parameters(), tmp_path)
+
+    assert "input.inp" in files
+    assert "so the solvent was packed with Packmol" in text
+
+
+@pytest.mark.unit
+def test_tiling_needs_solute(library):
+    """Tiling is only for a solute in a region from its dimensions."""
+    P = solute_parameters(dimensions="given explicitly")
+    with pytest.raises(RuntimeError, match="Tiling a box"):
+        get_input(P, library)
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("thickness", [10.0, 20.0, 40.0])
+def test_tiling_speed(library, tmp_path, thickness):
+    """Compare the time for tiling the solvent with that for packing it."""
+    P = solute_parameters(**{"solvent thickness": thickness})
+    t0 = time.perf_counter()
+    files, text, cell, n_solute, summary = get_input(P, library)
+    t_tile = time.perf_counter() - t0
+    n_tiled = summary["n_atoms"]
+
+    P = solute_parameters(
+        **{"solvent thickness": thickness, "solvation": "packing with Packmol"}
+    )
+    t0 = time.perf_counter()
+    files, text, cell, n_solute, summary = get_input(P, library)
+    work = tmp_path / "packmol"
+    work.mkdir()
+    for name, data in files.items():
+        (work / name).write_text(data)
+    with open(work / "input.inp") as fd:
+        subprocess.run(
+            [sys.executable, str(fake)],
+            stdin=fd,
+            cwd=work,
+            capture_output=True,
+            check=True,
+        )
+    t_pack = time.perf_counter() - t0
+
+    print(
+        f"\n{thickness:5.1f} Å: tiling {n_tiled:7d} atoms {t_tile:7.2f} s, packing "
+        f"{summary['n_atoms']:7d} atoms with the fake Packmol {t_pack:7.2f} s"
+    )
@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for preparing the templates of the molecules."""
+
+import shutil
+import subprocess
+import time
+
+import numpy as np
+import pytest
+import seamm
+
+from molsystem import SystemDB
+import packmol_step
+from packmol_step import configuration_from_template, prepare_templates, template_arrays
+
+# Alkanes, alcohols and ethers standing in for the components of a surrogate fuel
+smiles = [
+    *("C" * n for n in range(1, 31)),
+    *("C" * n + "O" for n in range(1, 31)),
+    *("C" * n + "OC" for n in range(1, 21)),
+]
+
+# Drug-like and polymer molecules for comparing the embedding backends
+benchmark = {
+    "aspirin": "CC(=O)Oc1ccccc1C(=O)O",
+    "caffeine": "Cn1cnc2c1c(=O)n(C)c(=O)n2C",
+    "ibuprofen": "CC(C)Cc1ccc(cc1)C(C)C(=O)O",
+    "diazepam": "CN1C(=O)CN=C(c2ccccc2)c2cc(Cl)ccc12",
+    "atorvastatin": (
+        "CC(C)c1c(C(=O)Nc2ccccc2)c(-c2ccccc2)c(-c2ccc(F)cc2)n1CCC(O)CC(O)CC(=O)O"
+    ),
+    "morphine": "CN1CCC23C4C1CC5=C2C(=C(C=C5)O)OC3C(C=C4)O",
+    "steroid": "CC12CCC3C(CCC4=CC(=O)CCC34C)C1CCC2O",
+    "polyethylene 30-mer": "C" * 60,
+    "polystyrene 10-mer": "C" + "C(c1ccccc1)C" * 10,
+    "PEO 20-mer": "OCC" + "OCC" * 20 + "O",
+    "PMMA 8-mer": "C" + "CC(C)(C(=O)OC)" * 8,
+}
+
+# Long, flexible molecules whose extended structures pack slowly
+chains = {
+    "hexadecane": "C" * 16,
+    "triacontane": "C" * 30,
+    "tetraglyme": "COCCOCCOCCOCCOC",
+    "heptaglyme": "C" + "OCC" * 7 + "OC",
+}
+
+
+def embedded(db, smiles, backend, cache=None):
+    """Embed a SMILES string in a new configuration, returning it and the source."""
+    configuration = db.create_system(name=smiles).create_configuration(name="c")
+    source = packmol_step.embed(configuration, smiles, backend, cache)
+    return configuration, source
+
+
+def strain(configuration):
+    """The shortest distance between atoms that are not bonded or 1-3 neighbors."""
+    xyz = np.array(configuration.atoms.get_coordinates(fractionals=False))
+    n = len(xyz)
+    index = {_id: i for i, _id in enumerate(configuration.atoms.ids)}
+    near = np.eye(n, dtype=bool)
+    for row in configuration.bonds.bonds():
+        i, j = index[row["i"]], index[row["j"]]
+        near[i, j] = near[j, i] = True
+    near = near | ((near.astype(int) @ near.astype(int)) > 0)
+    r = np.linalg.norm(xyz[:, None, :] - xyz[None, :, :], axis=2)
+    return float(r[~near].min()) if (~near).any() else float("nan")
+
+
+@pytest.mark.unit
+def test_parallel_matches_serial():
+    """The templates are the same whether prepared in parallel or not."""
+    serial = prepare_templates(smiles[:6])
+    parallel = prepare_templates(smiles[:6], n_processes=3)
+
+    assert list(parallel) == smiles[:6]
+    for definition in smiles[:6]:
+        assert parallel[definition]["atno"] == serial[definition]["atno"]
+        assert parallel[definition]["bonds"] == serial[definition]["bonds"]
+
+
+@pytest.mark.unit
+def test_parallel_errors_are_raised(tmp_path, caplog):
+    """An error in a worker is raised, not hidden by preparing serially."""
+    with pytest.raises(RuntimeError, match="not in the template cache"):
+        prepare_templates(
+            smiles[:4], n_processes=2, backend="template cache only", cache=tmp_path
+        )
+    assert "preparing them serially" not in caplog.text
+
+
+def unreadable(definition, ff=None, **kwargs):
+    """Stand in for smiles_template, failing as if a file could not be read."""
+    raise OSError(f"Could not read the template for '{definition}'")
+
+
+@pytest.mark.unit
+def test_parallel_os_errors_are_raised(monkeypatch, caplog):
+    """An OSError in a worker is raised, not hidden by preparing serially."""
+    monkeypatch.setattr(packmol_step.templates, "smiles_template", unreadable)
+    with pytest.raises(OSError, match="Could not read the template"):
+        prepare_templates(smiles[:4], n_processes=2)
+    assert "preparing them serially" not in caplog.text
+
+
+@pytest.mark.unit
+def test_serial_if_processes_cannot_start(monkeypatch, caplog):
+    """If the processes cannot be started, the templates are prepared serially."""
+
+    def no_processes(*args, **kwargs):
+        raise OSError("No more processes")
+
+    monkeypatch.setattr(
+        packmol_step.templates.concurrent.futures, "ProcessPoolExecutor", no_processes
+    )
+    templates = prepare_templates(smiles[:2], n_processes=2)
+    assert list(templates) == smiles[:2]
+    assert "preparing them serially" in caplog.text
+
+
+@pytest.mark.unit
+def test_configuration_from_template(configuration):
+    """A configuration is rebuilt from the arrays of a template."""
+    template = prepare_templates(["CCO"])["CCO"]
+    configuration_from_template(configuration, template)
+
+    assert configuration.n_atoms == 9
+    assert configuration.atoms.atomic_numbers == template["atno"]
+    assert len(template["bonds"]) == 8
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("backend", ["OpenBabel", "RDKit ETKDG"])
+def test_embedding_backends(empty_db, backend):
+    """Each backend gives the atoms in the same order, with the same bonds."""
+    reference, _ = embedded(empty_db, "CC(=O)Oc1ccccc1C(=O)O", "OpenBabel")
+    configuration, source = embedded(empty_db, "CC(=O)Oc1ccccc1C(=O)O", backend)
+
+    assert source == backend
+    assert configuration.atoms.symbols == reference.atoms.symbols
+    assert configuration.bonds.n_bonds == reference.bonds.n_bonds
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("name", ["atorvastatin", "PEO 20-mer"])
+def test_etkdg_is_not_strained(empty_db, name):
+    """ETKDG keeps atoms that are not neighbors apart, even in polymers."""
+    configuration, _ = embedded(empty_db, benchmark[name], "RDKit ETKDG")
+    assert strain(configuration) > 1.5
+
+
+@pytest.mark.unit
+def test_template_cache(empty_db, tmp_path):
+    """Embedded structures are saved in the cache and reused."""
+    cache = tmp_path / "cache"
+    with pytest.raises(RuntimeError, match="not in the template cache"):
+        embedded(empty_db, "CCO", "template cache only", cache)
+
+    with pytest.raises(RuntimeError, match="needs a template cache"):
+        embedded(empty_db, "CCO", "template cache only")
+
+    first, source = embedded(empty_db, "CCO", "OpenBabel", cache)
+    assert source == "OpenBabel"
+    assert packmol_step.cached_template_path(cache, "OCC", "OpenBabel").exists()
+
+    # The same molecule, written differently, comes from the cache
+    for backend in ("OpenBabel", "template cache only"):
+        again, source = embedded(empty_db, "OCC", backend, cache)
+        assert source == "cache"
+        assert again.atoms.atomic_numbers == first.atoms.atomic_numbers
+        assert again.atoms.get_coordinates() == first.atoms.get_coordinates()
+        assert again.bonds.n_bonds == first.bonds.n_bonds
+
+    # Another backend embeds the molecule itself
+    _, source = embedded(empty_db, "CCO", "RDKit ETKDG", cache)
+    assert source == "RDKit ETKDG"
+    assert len(list(cache.glob("*.npz"))) == 2
+
+
+@pytest.mark.unit
+def test_parallel_with_cache(tmp_path):
+    """Templates prepared in parallel report how they were embedded."""
+    cache = tmp_path / "cache"
+    first = prepare_templates(smiles[:4], backend="RDKit ETKDG", cache=cache)
+    assert {t["embedded by"] for t in first.values()} == {"RDKit ETKDG"}
+
+    second = prepare_templates(
+        smiles[:4], n_processes=2, backend="template cache only", cache=cache
+    )
+    assert {t["embedded by"] for t in second.values()} == {"cache"}
+    for definition in smiles[:4]:
+        assert second[definition]["xyz"] == first[definition]["xyz"]
+        assert second[definition]["bonds"] == first[definition]["bonds"]
+
+
+@pytest.mark.unit
+def test_embedding_summary(tmp_path):
+    """The backend and the time for embedding are in the summary of the build."""
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters["molecules"].value = [
+        {"component": "fluid", "source": "SMILES", "definition": s, "count": "1"}
+        for s in ("O", "CO")
+    ]
+    parameters["embedding"].value = "RDKit ETKDG"
+    P = parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+
+    cache = tmp_path / "cache"
+    for n_cached in (0, 2):
+        system_db = SystemDB(filename="file:seamm_db?mode=memory&cache=shared")
+        tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+        summary = {}
+        try:
+            packmol_step.Packmol.get_input(
+                P,
+                system_db,
+                tmp_db,
+                seamm.flowchart_variables,
+                summary=summary,
+                cache=cache,
+            )
+        finally:
+            tmp_db.close()
+            system_db.close()
+        assert summary["embedding"] == "RDKit ETKDG"
+        assert summary["n_embedded"] == 2
+        assert summary["n_cached"] == n_cached
+        assert summary["embedding time"] > 0
+
+
+@pytest.mark.unit
+def test_compactness():
+    """The radius of gyration and bounding sphere of conformers at once."""
+    line = np.array([(-2.0, 0.0, 0.0), (0.0, 0.0, 0.0), (2.0, 0.0, 0.0)])
+    bent = np.array([(-1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (1.0, 0.0, 0.0)])
+    xyz = np.stack((line + 5.0, bent))
+    rg = packmol_step.compactness(xyz)
+    assert rg == pytest.approx([np.sqrt(8 / 3), np.sqrt(8 / 9)])
+    assert packmol_step.compactness(xyz, "bounding sphere") == pytest.approx(
+        [2.0, np.sqrt(1 + 1 / 9)]
+    )
+    with pytest.raises(RuntimeError, match="measure of compactness"):
+        packmol_step.compactness(xyz, "volume")
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("measure", ["radius of gyration", "bounding sphere"])
+def test_compact_conformer(empty_db, measure):
+    """The most compact conformer keeps the atoms, their order and the bonds."""
+    configuration, _ = embedded(empty_db, chains["hexadecane"], "OpenBabel")
+    xyz0 = np.array(configuration.atoms.get_coordinates(fractionals=False))
+    symbols = configuration.atoms.symbols
+
+    before, after = packmol_step.compact_conformer(configuration, 10, measure)
+    xyz = np.array(configuration.atoms.get_coordinates(fractionals=False))
+    assert after < before
+    assert packmol_step.compactness([xyz0], measure)[0] == pytest.approx(before)
+    assert packmol_step.compactness([xyz], measure)[0] == pytest.approx(after)
+    assert configuration.atoms.symbols == symbols
+
+    # The bonds are still bonds
+    index = {_id: i for i, _id in enumerate(configuration.atoms.ids)}
+    for row in configuration.bonds.bonds():
+        i, j = index[row["i"]], index[row["j"]]
+        assert np.linalg.norm(xyz[i] - xyz[j]) < 1.7
+    assert strain(configuration) > 1.5
+
+
+@pytest.mark.unit
+def test_overlapping_conformer_is_skipped(empty_db):
+    """A structure with overlapping atoms is not chosen for being compact."""
+    configuration, _ = embedded(empty_db, chains["tetraglyme"], "OpenBabel")
+    assert strain(configuration) < packmol_step.templates.closest_contact
+
+    packmol_step.compact_conformer(configuration, 5)
+    assert strain(configuration) > 1.5
+
+
+@pytest.mark.unit
+def test_compact_templates():
+    """Templates from several conformers are more compact, serially or not."""
+    definitions = [chains["hexadecane"], chains["tetraglyme"]]
+    extended = prepare_templates(definitions, backend="RDKit ETKDG")
+    serial = prepare_templates(definitions, backend="RDKit ETKDG", conformers=10)
+    parallel = prepare_templates(
+        definitions, n_processes=2, backend="RDKit ETKDG", conformers=10
+    )
+    for definition in definitions:
+        assert parallel[definition]["xyz"] == serial[definition]["xyz"]
+        rg0, rg = packmol_step.compactness(
+            [extended[definition]["xyz"], serial[definition]["xyz"]]
+        )
+        assert rg <= rg0
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("n_processes", [1, 2, 4, 8])
+def test_template_scaling(n_processes):
+    """Time preparing the templates for mixtures of 5 to 80 components."""
+    print()
+    for n_components in (5, 20, 40, 80):
+        t0 = time.perf_counter()
+        templates = prepare_templates(smiles[:n_components], n_processes=n_processes)
+        t = time.perf_counter() - t0
+        assert len(templates) == n_components
+        print(
+            f"{n_components:4d} components with {n_processes} processes: "
+            f"{t:7.2f} s, {t / n_components * 1000:6.1f} ms per component"
+        )
+
+
+@pytest.mark.unit
+def test_configuration_is_not_changed(db):
+    """Using a configuration as a component does not change it."""
+    configuration = db.system.configuration
+    configuration.from_smiles("CCO")
+    n_bonds = configuration.bonds.n_bonds
+
+    parameters = packmol_step.PackmolParameters()
+    parameters["molecules"].value = [
+        {
+            "component": "fluid",
+            "source": "configuration",
+            "definition": "current",
+            "count": "1",
+        }
+    ]
+    P = parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+    tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+    molecules, files, text, cell = packmol_step.Packmol.get_input(
+        P, db, tmp_db, seamm.flowchart_variables
+    )
+    tmp_db.close()
+
+    assert configuration.bonds.n_bonds == n_bonds
+    assert len(molecules[0]["bonds"]) == n_bonds
+
+
+@pytest.mark.timing
+def test_template_from_large_configuration(tmp_path):
+    """Time taking a template from a large configuration in a file database."""
+    db = SystemDB(filename=str(tmp_path / "seamm.db"))
+    configuration = db.create_system(name="large").create_configuration(name="c")
+    n = 10000
+    ids = configuration.atoms.append(
+        x=[1.5 * i for i in range(n)], y=[0.0] * n, z=[0.0] * n, symbol=["C"] * n
+    )
+    configuration.bonds.append(i=ids[:-1], j=ids[1:])
+    configuration.db.commit()
+
+    tmp_db = SystemDB(filename="file:tmp_large?mode=memory&cache=shared")
+    t0 = time.perf_counter()
+    template = template_arrays(configuration)
+    copy = tmp_db.create_system(name="large").create_configuration(name="c")
+    configuration_from_template(copy, template)
+    t_snapshot = time.perf_counter() - t0
+    tmp_db.close()
+    assert configuration.bonds.n_bonds == n - 1
+
+    # The previous approach, clearing the bonds in the system database
+    t0 = time.perf_counter()
+    configuration.bonds.clear()
+    configuration.db.commit()
+    t_clear = time.perf_counter() - t0
+    db.close()
+
+    print(
+        f"\n{n} atoms: snapshot and copy {t_snapshot:.3f} s, "
+        f"clear and commit in the file database {t_clear:.3f} s"
+    )
+
+
+@pytest.mark.timing
+def test_embedding_benchmark(empty_db, tmp_path):
+    """Compare the backends on drug-like and polymer molecules."""
+    cache = tmp_path / "cache"
+    backends = ("OpenBabel", "RDKit ETKDG")
+    totals = dict.fromkeys((*backends, "cache"), 0.0)
+    print(
+        f"\n{'':>20s}  {'OpenBabel':>20s}  {'RDKit ETKDG':>20s}  {'cache':>8s}"
+        f"\n{'molecule':>20s}  {'time (s)':>9s} {'closest':>10s}  "
+        f"{'time (s)':>9s} {'closest':>10s}  {'time (s)':>8s}"
+    )
+    for name, definition in benchmark.items():
+        line = f"{name:>20s}"
+        for backend in backends:
+            t0 = time.perf_counter()
+            configuration, _ = embedded(empty_db, definition, backend, cache)
+            t = time.perf_counter() - t0
+            totals[backend] += t
+            line += f"  {t:9.3f} {strain(configuration):8.2f} Å"
+        t0 = time.perf_counter()
+        embedded(empty_db, definition, "template cache only", cache)
+        t = time.perf_counter() - t0
+        totals["cache"] += t
+        print(line + f"  {t:8.3f}")
+    print(
+        f"{'total':>20s}  {totals['OpenBabel']:9.3f} {'':10s}  "
+        f"{totals['RDKit ETKDG']:9.3f} {'':10s}  {totals['cache']:8.3f}"
+    )
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("name", list(chains))
+def test_compact_packing_speed(tmp_path, name):
+    """Compare packing extended and compact conformers of chains at liquid density.
+
+    Choosing the conformers is timed always, and the packing only if Packmol is
+    installed.
+    """
+    seamm.flowchart_variables = seamm.Variables()
+    parameters = packmol_step.PackmolParameters()
+    parameters["molecules"].value = [
+        {
+            "component": "fluid",
+            "source": "SMILES",
+            "definition": chains[name],
+            "count": "1",
+        }
+    ]
+    parameters["periodic"].value = "Yes"
+    parameters["shape"].value = "cubic"
+    parameters["fluid amount"].value = "rounding this number of molecules"
+    parameters["approximate number of molecules"].value = 100
+    parameters["density"].value = 0.8
+    packmol = shutil.which("packmol")
+
+    print()
+    for backend, conformers in (
+        ("OpenBabel", 1),
+        ("RDKit ETKDG", 1),
+        ("RDKit ETKDG", 20),
+    ):
+        parameters["embedding"].value = backend
+        parameters["conformers"].value = conformers
+        P = parameters.current_values_to_dict(context=seamm.flowchart_variables._data)
+        system_db = SystemDB(filename="file:seamm_db?mode=memory&cache=shared")
+        tmp_db = SystemDB(filename="file:tmp_db?mode=memory&cache=shared")
+        summary = {}
+        try:
+            molecules, files, _, _ = packmol_step.Packmol.get_input(
+                P, system_db, tmp_db, seamm.flowchart_variables, summary=summary
+            )
+            xyz = molecules[0]["configuration"].atoms.get_coordinates(fractionals=False)
+        finally:
+            tmp_db.close()
+            system_db.close()
+        rg = packmol_step.compactness([xyz])[0]
+        line = (
+            f"{name:>12s}, {backend:>11s} from {conformers:2d} conformers: Rg "
+            f"{rg:5.2f} Å, building {summary['embedding time']:6.2f} s"
+        )
+        if packmol is not None:
+            directory = tmp_path / f"{backend}_{conformers}"
+            directory.mkdir()
+            for filename, text in files.items():
+                (directory / filename).write_text(text)
+            t0 = time.perf_counter()
+            with open(directory / "input.inp") as fd:
+                subprocess.run(
+                    [packmol], stdin=fd, cwd=directory, capture_output=True, check=True
+                )
+            line += f", packing {time.perf_counter() - t0:7.2f} s"
+        print(line)